@@ -1,11 +1,24 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, g
 import cv2
 import os
+import csv
+import io
+import json
+import random
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from config import Config
 from utils.database import Database
-from utils.face_recognition import FaceRecognizer
+from utils.face_recognition import FaceRecognizer, detect_and_encode, detect_and_encode_classroom
+from utils.job_queue import RecognitionQueue, QueueFull
+from utils.camera import CameraStream
+from utils.live_recognition import LiveRecognizer
+from utils.enrollment import enroll_from_source
+from utils.evidence import EvidenceWriter, evidence_name
+from utils.retention import EvidenceRetention
+from utils.dedup import RecognitionCache, image_hash
+from utils import metrics
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -14,6 +27,79 @@ Config.init_app()
 # Khởi tạo
 db = Database()
 face_recognizer = FaceRecognizer()
+# Khi gom batch, worker chỉ chờ kết quả của batch: dùng thread và đủ worker để lấp đầy một batch
+batching = face_recognizer.batcher is not None
+recognition_queue = RecognitionQueue(workers=max(Config.RECOGNITION_WORKERS, Config.DETECTION_BATCH_SIZE) if batching
+                                     else Config.RECOGNITION_WORKERS,
+                                     kind='thread' if batching else Config.RECOGNITION_POOL,
+                                     max_pending=Config.RECOGNITION_QUEUE_MAX,
+                                     job_ttl=Config.RECOGNITION_JOB_TTL)
+# Mỗi lượt đăng ký hàng loạt đã dùng process pool trên mọi core nên chạy lần lượt trên một thread
+enrollment_queue = RecognitionQueue(workers=1, kind='thread', max_pending=Config.ENROLL_QUEUE_MAX,
+                                    job_ttl=Config.RECOGNITION_JOB_TTL)
+evidence_writer = EvidenceWriter(Config.UPLOAD_FOLDER, max_edge=Config.EVIDENCE_MAX_EDGE,
+                                 quality=Config.EVIDENCE_JPEG_QUALITY, face_size=Config.EVIDENCE_FACE_SIZE,
+                                 face_margin=Config.EVIDENCE_FACE_MARGIN)
+evidence_retention = EvidenceRetention(Config.UPLOAD_FOLDER, db, evidence_writer,
+                                       retention_days=Config.EVIDENCE_RETENTION_DAYS or None,
+                                       quota_bytes=Config.EVIDENCE_QUOTA_MB * 1024 * 1024 or None,
+                                       orphan_grace=Config.EVIDENCE_ORPHAN_GRACE,
+                                       delete_orphans=Config.EVIDENCE_DELETE_ORPHANS,
+                                       compact_legacy=Config.EVIDENCE_COMPACT_LEGACY,
+                                       interval=Config.EVIDENCE_RETENTION_INTERVAL)
+recognition_cache = RecognitionCache(ttl=Config.DEDUP_TTL, max_distance=Config.DEDUP_MAX_DISTANCE,
+                                     capacity=Config.DEDUP_CACHE_SIZE) if Config.DEDUP_ENABLED else None
+
+# Đo đạc: /metrics (Prometheus), Server-Timing theo yêu cầu, cProfile lấy mẫu cho request chậm
+metrics.Gauge('attendance_gallery_students', 'Số sinh viên trong gallery', lambda: face_recognizer.gallery.n_students)
+metrics.Gauge('attendance_gallery_samples', 'Số mẫu encoding trong gallery', lambda: len(face_recognizer.gallery))
+metrics.Gauge('attendance_recognition_queue_pending', 'Số job nhận diện đang chờ', lambda: recognition_queue.pending)
+metrics.Gauge('attendance_evidence_pending', 'Số ảnh minh chứng đang chờ ghi', lambda: evidence_writer.pending)
+metrics.Gauge('attendance_evidence_bytes', 'Dung lượng thư mục ảnh (lần dọn gần nhất)',
+              lambda: (evidence_retention.last_report or {}).get('bytes', 0))
+metrics.Gauge('attendance_evidence_reclaimed_bytes', 'Tổng số byte ảnh đã thu hồi', lambda: evidence_retention.reclaimed_total)
+
+@app.before_request
+def start_request_trace():
+    if not metrics.ENABLED:
+        return
+    g.request_started = time.perf_counter()
+    g.server_timing = Config.SERVER_TIMING and (request.args.get('timing') == '1'
+                                                or 'X-Server-Timing' in request.headers)
+    profile = Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE
+    if g.server_timing or profile:
+        g.trace = metrics.Trace(profile=profile)
+        g.trace_context = metrics.tracing(g.trace)
+        g.trace_context.__enter__()
+
+def end_request_trace():
+    context = g.pop('trace_context', None)
+    if context is not None:
+        context.__exit__(None, None, None)
+
+@app.after_request
+def finish_request_trace(response):
+    if not metrics.ENABLED or 'request_started' not in g:
+        return response
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - g.request_started, request.endpoint or 'unknown')
+    end_request_trace()
+    trace = g.get('trace')
+    if trace is not None:
+        if g.server_timing:
+            response.headers['Server-Timing'] = trace.server_timing()
+        if trace.profile and trace.elapsed * 1000 >= Config.PROFILE_SLOW_MS:
+            trace.dump_profile(Config.PROFILE_DIR, request.endpoint or 'unknown')
+    return response
+
+@app.teardown_request
+def teardown_request_trace(exc):
+    # Request lỗi không qua after_request: vẫn gỡ trace khỏi thread
+    end_request_trace()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metric theo định dạng text của Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
@@ -43,13 +129,12 @@ def register():
             return jsonify({'success': False, 'message': 'Chưa chọn file'})
         
         if file and allowed_file(file.filename):
-            # Lưu file
+            # Giải mã ảnh ngay trong bộ nhớ, chỉ ghi file khi đăng ký thành công
             filename = secure_filename(f"{student_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
-            filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-            file.save(filepath)
+            image_bytes = file.read()
             
             # Đăng ký khuôn mặt
-            success, message = face_recognizer.register_face(filepath, student_id)
+            success, message = face_recognizer.register_face(image_bytes, student_id)
             
             if success:
                 # Thêm vào database
@@ -58,20 +143,187 @@ def register():
                 )
                 
                 if db_success:
+                    # Ghi đồng bộ: ảnh đăng ký phải có trên đĩa trước khi có thể bị xóa cùng sinh viên
+                    evidence_writer.write(filename, image_bytes)
                     return jsonify({'success': True, 'message': 'Đăng ký sinh viên thành công'})
                 else:
                     # Xóa encoding nếu thêm vào DB thất bại
                     face_recognizer.delete_face_encoding(student_id)
-                    os.remove(filepath)
                     return jsonify({'success': False, 'message': db_message})
             else:
-                os.remove(filepath)
                 return jsonify({'success': False, 'message': message})
         
         return jsonify({'success': False, 'message': 'File không hợp lệ'})
     
     return render_template('register.html')
 
+@app.route('/register/bulk', methods=['POST'])
+def register_bulk():
+    """Đăng ký hàng loạt từ file ZIP ảnh và file CSV thông tin"""
+    if 'archive' not in request.files or 'metadata' not in request.files:
+        return jsonify({'success': False, 'message': 'Cần file ZIP ảnh (archive) và file CSV (metadata)'})
+    
+    archive = request.files['archive']
+    metadata = request.files['metadata']
+    if not archive.filename.lower().endswith('.zip') or not metadata.filename.lower().endswith('.csv'):
+        return jsonify({'success': False, 'message': 'File không hợp lệ'})
+    
+    # Stream của request đóng khi request kết thúc nên đọc hết vào bộ nhớ (đã giới hạn bởi MAX_CONTENT_LENGTH)
+    try:
+        job = enrollment_queue.submit(bulk_enrollment, io.BytesIO(metadata.read()), io.BytesIO(archive.read()))
+    except QueueFull as e:
+        return jsonify({'success': False, 'message': f"{e}, vui lòng thử lại sau"}), 429
+    
+    # Mặc định trả job_id ngay (202), poll qua /jobs/<job_id>; ?wait=<giây> để chờ kết quả
+    return job_response(job, request.args.get('wait', default=0, type=float))
+
+def bulk_enrollment(metadata, archive):
+    """Job đăng ký hàng loạt: encoding trên process pool, ảnh lưu qua evidence_writer giống /register"""
+    report, stats = enroll_from_source(face_recognizer, db, metadata, archive, writer=evidence_writer)
+    return {'success': stats['succeeded'] > 0, 'report': report, 'stats': stats}
+
+def attendance_results(face_locations, face_encodings, image, filename, detailed, cache_key=None, classroom=False):
+    """Bước cuối của job nhận diện: so khớp gallery và điểm danh, trả về payload JSON
+    
+    Với cache_key, kết quả so khớp được lưu để ảnh gần trùng gửi sau dùng lại.
+    """
+    version = face_recognizer.gallery_version
+    recognized, message = face_recognizer.recognize_encodings(face_encodings)
+    for info in recognized or ():
+        # Khung mặt để cắt ảnh minh chứng của từng sinh viên
+        info['location'] = face_locations[info['face_index']]
+    payload, saved, learned = record_attendance(recognized, message, image, filename, detailed, classroom=classroom)
+    if cache_key is not None:
+        # Mẫu vừa học từ chính ảnh này đổi phiên bản gallery nhưng không làm kết quả sai đi
+        recognition_cache.put(cache_key, face_recognizer.gallery_version if learned else version,
+                              recognized, message, saved)
+    return payload
+
+def cached_results(entry, image, filename, detailed):
+    """Ảnh gần trùng với một lần nhận diện trước: bỏ qua phát hiện + encoding, dùng lại ảnh minh chứng đã lưu"""
+    payload, saved, _ = record_attendance(entry['recognized'], entry['message'], image, filename, detailed,
+                                          saved_filename=entry['filename'], classroom=entry['mode'] == 'classroom')
+    if saved is not None and entry['filename'] is None:
+        recognition_cache.set_filename(entry['id'], saved)
+    return dict(payload, cached=True)
+
+def record_attendance(recognized, message, image, filename, detailed, saved_filename=None, classroom=False):
+    """Điểm danh các sinh viên đã nhận diện, trả về (payload JSON, ảnh minh chứng đã lưu, số mẫu học thêm)
+    
+    Ảnh minh chứng (bytes hoặc frame) chỉ được ghi nền khi có ít nhất một lượt điểm danh mới,
+    kèm ảnh cắt khuôn mặt của các sinh viên vừa điểm danh; saved_filename là ảnh đã lưu của
+    lần chụp gần trùng trước, dùng lại thay vì ghi file mới.
+    """
+    if not recognized:
+        return {'success': False, 'message': message}, saved_filename, 0
+    
+    # Một transaction cho mọi khuôn mặt trong ảnh
+    marked = db.mark_attendance_many([info['student_id'] for info in recognized], saved_filename or filename)
+    learned = 0
+    if any(entry['status'] == 'new' for entry in marked.values()):
+        if saved_filename is None:
+            faces = [(info['student_id'], info['location']) for info in recognized
+                     if marked[info['student_id']]['status'] == 'new']
+            evidence_writer.save(filename, image, faces,
+                                 Config.CLASSROOM_MAX_EDGE if classroom else Config.ENCODING_MAX_EDGE)
+            saved_filename = filename
+        if Config.FACE_AUTO_SAMPLES:
+            # Ảnh điểm danh lần đầu trong ngày với độ tin cậy cao thành mẫu mới
+            learned = face_recognizer.learn_samples([info for info in recognized
+                                                     if marked[info['student_id']]['status'] == 'new'])
+    
+    results = []
+    seen = set()
+    for student_info in recognized:
+        student_id = student_info['student_id']
+        confidence = student_info['confidence']
+        student = marked[student_id]['student']
+        
+        if student:
+            # Cùng một sinh viên xuất hiện hai lần trong ảnh: lần sau coi như đã điểm danh
+            success = marked[student_id]['status'] == 'new' and student_id not in seen
+            seen.add(student_id)
+            result = {
+                'student_id': student_id,
+                'name': student['name'],
+                'status': 'success' if success else 'already_marked',
+                'message': "Điểm danh thành công" if success else "Sinh viên đã điểm danh hôm nay"
+            }
+            
+            if detailed:
+                # Kiểm tra độ tin cậy
+                if confidence < 0.70:
+                    result['message'] += " (Độ tin cậy thấp - Cần xác nhận)"
+                result['confidence'] = f"{confidence:.2%}"
+                result['confidence_level'] = 'high' if confidence >= 0.70 else 'low'
+            
+            results.append(result)
+    
+    return {'success': True, 'students': results}, saved_filename, learned
+
+def job_response(job, timeout):
+    """Chờ job tối đa timeout giây; nếu chưa xong trả về 202 kèm job_id để poll"""
+    recognition_queue.wait(job, timeout)
+    if job.status == 'done':
+        return jsonify(dict(job.result, job_id=job.id, status='done'))
+    if job.status == 'error':
+        return jsonify({'success': False, 'job_id': job.id, 'status': 'error',
+                        'message': f"Lỗi khi nhận diện: {job.error}"}), 500
+    return jsonify(dict(job.to_dict(), success=True)), 202
+
+def classroom_results(result, image, filename, cache_key=None):
+    """Như attendance_results cho chế độ lớp học, kèm thời gian từng bước và số khuôn mặt"""
+    face_locations, face_encodings, timings = result
+    payload = attendance_results(face_locations, face_encodings, image, filename, detailed=True,
+                                 cache_key=cache_key, classroom=True)
+    payload['timings'] = timings
+    return payload
+
+def submit_recognition(image, filename, detailed, classroom=False):
+    """Đưa ảnh (bytes hoặc frame BGR) vào hàng đợi nhận diện; ?wait=<giây> để chờ kết quả (0 = trả job_id ngay)
+    
+    Ảnh gần trùng với một lần gửi trước (chụp lại, upload lại) trả kết quả ngay, không qua hàng đợi.
+    """
+    cache_key = None
+    if recognition_cache is not None:
+        with metrics.timed('dedup_hash'):
+            fingerprint = image_hash(image)
+        if fingerprint is not None:
+            cache_key = fingerprint + ('classroom' if classroom else 'standard',)
+            entry = recognition_cache.get(cache_key, face_recognizer.gallery_version)
+            if entry is not None:
+                return jsonify(dict(cached_results(entry, image, filename, detailed or classroom), status='done'))
+    
+    try:
+        if classroom:
+            job = recognition_queue.submit(
+                detect_and_encode_classroom, image, Config.FACE_DETECTION_MODEL,
+                then=lambda result: classroom_results(result, image, filename, cache_key)
+            )
+        elif batching:
+            job = recognition_queue.submit(
+                face_recognizer.detect_and_encode, image,
+                then=lambda result: attendance_results(*result, image, filename, detailed, cache_key)
+            )
+        else:
+            job = recognition_queue.submit(
+                detect_and_encode, image, Config.FACE_DETECTION_MODEL,
+                then=lambda result: attendance_results(*result, image, filename, detailed, cache_key)
+            )
+    except QueueFull as e:
+        return jsonify({'success': False, 'message': f"{e}, vui lòng thử lại sau"}), 429
+    
+    timeout = request.args.get('wait', default=Config.RECOGNITION_WAIT_TIMEOUT, type=float)
+    return job_response(job, timeout)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Poll trạng thái job nhận diện hoặc đăng ký hàng loạt"""
+    job = recognition_queue.get(job_id) or enrollment_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Không tìm thấy job'}), 404
+    return job_response(job, 0)
+
 @app.route('/attendance', methods=['GET', 'POST'])
 def attendance():
     """Điểm danh bằng upload ảnh"""
@@ -84,56 +336,155 @@ def attendance():
             return jsonify({'success': False, 'message': 'Chưa chọn file'})
         
         if file and allowed_file(file.filename):
-            # Lưu file tạm
-            filename = secure_filename(f"attendance_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
-            filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-            file.save(filepath)
+            # Đọc ảnh vào bộ nhớ, không ghi file tạm
+            filename = evidence_name('attendance')
             
-            # Nhận diện khuôn mặt
-            recognized, message = face_recognizer.recognize_face(filepath)
-            
-            if recognized:
-                results = []
-                for student_info in recognized:
-                    student_id = student_info['student_id']
-                    confidence = student_info['confidence']
-                    
-                    # Lấy thông tin sinh viên
-                    student = db.get_student(student_id)
-                    
-                    if student:
-                        # Kiểm tra độ tin cậy
-                        if confidence < 0.70:
-                            warning = " (Độ tin cậy thấp - Cần xác nhận)"
-                        else:
-                            warning = ""
-                        
-                        # Điểm danh
-                        success, att_message = db.mark_attendance(student_id, filename)
-                        results.append({
-                            'student_id': student_id,
-                            'name': student['name'],
-                            'confidence': f"{confidence:.2%}",
-                            'status': 'success' if success else 'already_marked',
-                            'message': att_message + warning,
-                            'confidence_level': 'high' if confidence >= 0.70 else 'low'
-                        })
-                
-                return jsonify({'success': True, 'students': results})
-            else:
-                os.remove(filepath)
-                return jsonify({'success': False, 'message': message})
+            # Nhận diện trong hàng đợi nền; mode=classroom cho ảnh toàn cảnh lớp học
+            classroom = request.values.get('mode') == 'classroom'
+            return submit_recognition(file.read(), filename, detailed=True, classroom=classroom)
         
         return jsonify({'success': False, 'message': 'File không hợp lệ'})
     
     return render_template('attendance.html')
 
+def history_filters():
+    """Bộ lọc lịch sử từ query string (?date= giữ tương thích với bộ lọc một ngày cũ)"""
+    date = request.args.get('date')
+    return {
+        'date_from': request.args.get('date_from') or date,
+        'date_to': request.args.get('date_to') or date,
+        'class_name': request.args.get('class'),
+        'student_id': request.args.get('student_id')
+    }
+
+def history_page(cursor=None):
+    """Một trang lịch sử theo bộ lọc; cursor không hợp lệ gây ValueError"""
+    limit = min(request.args.get('limit', default=Config.HISTORY_PAGE_SIZE, type=int), Config.HISTORY_MAX_PAGE_SIZE)
+    return db.get_attendance_page(after=cursor, limit=max(1, limit), **history_filters())
+
 @app.route('/history')
 def history():
-    """Xem lịch sử điểm danh"""
-    date = request.args.get('date')
-    records = db.get_attendance_history(date)
-    return render_template('history.html', records=records)
+    """Xem lịch sử điểm danh (phân trang theo cursor)"""
+    try:
+        records, next_cursor = history_page(request.args.get('cursor'))
+    except ValueError:
+        # Cursor hỏng (link cũ, sửa tay): quay về trang đầu thay vì lỗi 500
+        records, next_cursor = history_page()
+    return render_template('history.html', records=records, next_cursor=next_cursor)
+
+@app.route('/api/attendance')
+def attendance_api():
+    """Lịch sử điểm danh dạng JSON, phân trang bằng ?cursor=<next_cursor>"""
+    try:
+        records, next_cursor = history_page(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'records': records, 'next_cursor': next_cursor})
+
+EXPORT_COLUMNS = ['id', 'student_id', 'name', 'class', 'check_in_time', 'status', 'image_path']
+
+@app.route('/history/export')
+def export_history():
+    """Export lịch sử theo bộ lọc dạng CSV hoặc NDJSON, stream từng dòng"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Định dạng không hỗ trợ'}), 400
+    
+    records = db.iter_attendance(batch_size=Config.EXPORT_BATCH_SIZE, **history_filters())
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM để Excel đọc đúng tiếng Việt
+        buffer.write('\ufeff')
+        writer.writerow(EXPORT_COLUMNS)
+        for record in records:
+            writer.writerow([record[column] for column in EXPORT_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    
+    def generate_ndjson():
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    filename = f"lich_su_diem_danh_{datetime.now().strftime('%Y%m%d%H%M%S')}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson; charset=utf-8'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def stats_range():
+    """Khoảng ngày cho API thống kê, mặc định từ đầu tháng đến hôm nay (giờ Việt Nam)"""
+    today = db.get_vietnam_time().split(' ')[0]
+    return request.args.get('date_from') or today[:8] + '01', request.args.get('date_to') or today
+
+@app.route('/api/stats/overview')
+def stats_overview():
+    """Tổng số sinh viên và số điểm danh hôm nay"""
+    return jsonify(db.get_stats_overview(request.args.get('date') or db.get_vietnam_time().split(' ')[0]))
+
+@app.route('/api/stats/classes')
+def stats_classes():
+    """Tổng hợp theo lớp và ngày"""
+    date_from, date_to = stats_range()
+    return jsonify(db.get_class_summary(date_from, date_to, request.args.get('class')))
+
+@app.route('/api/stats/trend')
+def stats_trend():
+    """Xu hướng tỉ lệ điểm danh theo ngày"""
+    date_from, date_to = stats_range()
+    return jsonify(db.get_attendance_trend(date_from, date_to, request.args.get('class')))
+
+@app.route('/api/stats/students')
+def stats_students():
+    """Tỉ lệ chuyên cần từng sinh viên của một lớp"""
+    date_from, date_to = stats_range()
+    return jsonify(db.get_student_attendance_rates(request.args.get('class', ''), date_from, date_to))
+
+@app.route('/api/stats/absentees')
+def stats_absentees():
+    """Danh sách vắng mặt của một lớp trong ngày"""
+    date = request.args.get('date') or db.get_vietnam_time().split(' ')[0]
+    return jsonify(db.get_absentees(request.args.get('class', ''), date))
+
+@app.route('/api/stats/cache')
+def stats_cache():
+    """Bộ đếm hit/miss của cache thông tin sinh viên"""
+    return jsonify(db.student_cache.stats())
+
+@app.route('/api/stats/batching')
+def stats_batching():
+    """Kích thước batch, độ trễ xếp hàng và chi phí mỗi ảnh của bộ gom batch phát hiện"""
+    if face_recognizer.batcher is None:
+        return jsonify({'enabled': False})
+    return jsonify(face_recognizer.batcher.stats())
+
+@app.route('/api/stats/dedup')
+def stats_dedup():
+    """Bộ đếm hit/miss của cache kết quả nhận diện cho ảnh gần trùng"""
+    if recognition_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(recognition_cache.stats(), enabled=True))
+
+@app.route('/api/stats/evidence')
+def stats_evidence():
+    """Dung lượng thư mục ảnh, số byte đã thu hồi và bộ đếm ghi ảnh minh chứng"""
+    return jsonify(dict(evidence_retention.stats(), writer=evidence_writer.stats()))
+
+@app.route('/api/evidence/retention', methods=['POST'])
+def run_evidence_retention():
+    """Chạy ngay một lượt dọn ảnh minh chứng (compaction, hết hạn, mồ côi, quota)
+
+    ?dry_run=1 chỉ báo cáo những gì sẽ bị xóa/encode lại, không đụng tới file hay DB.
+    """
+    report = evidence_retention.run(dry_run=request.args.get('dry_run') == '1')
+    if report is None:
+        return jsonify({'success': False, 'message': 'Một process khác đang dọn ảnh, vui lòng thử lại sau'}), 409
+    return jsonify({'success': True, 'report': report})
 
 @app.route('/students')
 def students():
@@ -150,6 +501,9 @@ def manage_students():
 @app.route('/students/delete/<student_id>', methods=['POST'])
 def delete_student(student_id):
     """Xóa sinh viên"""
+    # Lấy ảnh đăng ký trước khi xóa bản ghi sinh viên
+    student = db.get_student(student_id)
+    
     # Xóa khỏi database
     success, message = db.delete_student(student_id)
     
@@ -157,8 +511,7 @@ def delete_student(student_id):
         # Xóa face encoding
         face_recognizer.delete_face_encoding(student_id)
         
-        # Xóa ảnh (tùy chọn)
-        student = db.get_student(student_id)
+        # Xóa ảnh đăng ký; ảnh minh chứng điểm danh thành mồ côi và được dọn nền
         if student and student.get('image_path'):
             image_path = os.path.join(Config.UPLOAD_FOLDER, student['image_path'])
             if os.path.exists(image_path):
@@ -168,93 +521,119 @@ def delete_student(student_id):
     
     return jsonify({'success': False, 'message': message})
 
+@app.route('/students/samples/<student_id>', methods=['POST'])
+def add_student_sample(student_id):
+    """Thêm ảnh mẫu khuôn mặt cho sinh viên đã đăng ký"""
+    if 'image' not in request.files:
+        return jsonify({'success': False, 'message': 'Không có file ảnh'})
+    
+    file = request.files['image']
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'success': False, 'message': 'File không hợp lệ'})
+    
+    success, message = face_recognizer.add_sample(file.read(), student_id)
+    return jsonify({'success': success, 'message': message})
+
 # API cho webcam real-time
-camera = None
+camera = CameraStream(Config.CAMERA_SOURCE, buffer_size=Config.CAMERA_BUFFER_SIZE,
+                      reconnect_delay=Config.CAMERA_RECONNECT_DELAY)
+
+def mark_live_attendance(student_id, confidence, frame, box):
+    """Điểm danh tự động khi một track webcam có danh tính ổn định"""
+    filename = evidence_name(f'webcam_{student_id}')
+    success, _ = db.mark_attendance(student_id, filename)
+    if success:
+        evidence_writer.save(filename, frame, [(student_id, box)])
+
+live_recognizer = LiveRecognizer(camera, face_recognizer,
+                                 detection_hz=Config.LIVE_DETECTION_HZ,
+                                 iou_threshold=Config.LIVE_TRACK_IOU,
+                                 max_misses=Config.LIVE_TRACK_MAX_MISSES,
+                                 vote_window=Config.LIVE_VOTE_WINDOW,
+                                 identity_ttl=Config.LIVE_IDENTITY_TTL,
+                                 drift_iou=Config.LIVE_DRIFT_IOU,
+                                 min_confidence=Config.LIVE_MIN_CONFIDENCE,
+                                 attendance_votes=Config.LIVE_ATTENDANCE_VOTES,
+                                 on_identity=mark_live_attendance if Config.LIVE_AUTO_ATTENDANCE else None)
+
+stream_rate = metrics.RateMeter()
+metrics.Gauge('attendance_stream_fps', 'Số frame MJPEG gửi đi mỗi giây (mọi người xem)', stream_rate.rate)
+metrics.Gauge('attendance_live_detection_fps', 'Số frame nhận diện nền mỗi giây', live_recognizer.detection_rate.rate)
 
 def generate_frames():
-    """Generator để stream video từ webcam"""
-    global camera
-    camera = cv2.VideoCapture(0)
+    """Generator để stream video từ webcam (mỗi người xem là một subscriber của camera dùng chung)
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # Nhận diện khuôn mặt
-        student_ids, face_locations = face_recognizer.recognize_face_from_frame(frame)
-        
-        # Vẽ khung và tên
-        for (top, right, bottom, left), student_id in zip(face_locations, student_ids):
-            # Vẽ khung
-            color = (0, 255, 0) if student_id != "Unknown" else (0, 0, 255)
-            cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+    Nhận diện chạy nền trong live_recognizer; ở đây chỉ vẽ lại nhãn mới nhất lên mọi frame.
+    """
+    live_recognizer.acquire()
+    try:
+        seq = 0
+        empty_waits = 0
+        while True:
+            seq, frame = camera.wait_frame(seq)
+            if frame is None:
+                # Camera hỏng hoặc đã đóng: kết thúc stream thay vì giữ live_recognizer mãi
+                empty_waits += 1
+                if not camera.is_running or empty_waits >= Config.CAMERA_STREAM_TIMEOUT:
+                    break
+                continue
+            empty_waits = 0
+            # Frame trong buffer được chia sẻ giữa các subscriber, vẽ lên bản sao
+            frame = frame.copy()
             
-            # Vẽ tên
-            cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
-            cv2.putText(frame, student_id, (left + 6, bottom - 6), 
-                       cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
-        
-        # Encode frame
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            # Vẽ khung và tên
+            for (top, right, bottom, left), student_id in live_recognizer.overlays:
+                # Vẽ khung
+                color = (0, 255, 0) if student_id != "Unknown" else (0, 0, 255)
+                cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+                
+                # Vẽ tên
+                cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
+                cv2.putText(frame, student_id, (left + 6, bottom - 6), 
+                           cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+            
+            # Encode frame
+            ret, buffer = cv2.imencode('.jpg', frame)
+            frame = buffer.tobytes()
+            
+            stream_rate.tick()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    finally:
+        # Client ngắt kết nối: generator bị đóng, trả lại camera
+        live_recognizer.release()
 
 @app.route('/video_feed')
 def video_feed():
     """Stream video"""
     return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/video_feed/stats')
+def video_feed_stats():
+    """Bộ đếm cache danh tính của luồng webcam"""
+    return jsonify(live_recognizer.stats())
+
 @app.route('/capture_attendance', methods=['POST'])
 def capture_attendance():
     """Điểm danh từ webcam"""
-    global camera
-    if camera is None or not camera.isOpened():
+    if not camera.is_running:
         return jsonify({'success': False, 'message': 'Camera chưa được khởi động'})
     
-    # Chụp frame hiện tại
-    success, frame = camera.read()
-    if not success:
+    # Lấy frame mới nhất từ buffer, không đọc trực tiếp thiết bị
+    frame = camera.latest()
+    if frame is None:
         return jsonify({'success': False, 'message': 'Không thể chụp ảnh'})
     
-    # Lưu ảnh
-    filename = f"webcam_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-    filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-    cv2.imwrite(filepath, frame)
-    
-    # Nhận diện
-    recognized, message = face_recognizer.recognize_face(filepath)
-    
-    if recognized:
-        results = []
-        for student_info in recognized:
-            student_id = student_info['student_id']
-            student = db.get_student(student_id)
-            
-            if student:
-                success, att_message = db.mark_attendance(student_id, filename)
-                results.append({
-                    'student_id': student_id,
-                    'name': student['name'],
-                    'status': 'success' if success else 'already_marked',
-                    'message': att_message
-                })
-        
-        return jsonify({'success': True, 'students': results})
-    
-    os.remove(filepath)
-    return jsonify({'success': False, 'message': message})
+    # Nhận diện thẳng trên frame đang giữ; ảnh chỉ được ghi nếu điểm danh thành công
+    filename = evidence_name('webcam')
+    return submit_recognition(frame, filename, detailed=False)
 
 @app.route('/stop_camera')
 def stop_camera():
-    """Dừng camera"""
-    global camera
-    if camera is not None:
-        camera.release()
-        camera = None
-    return jsonify({'success': True})
+    """Camera tự đóng khi người xem cuối cùng ngắt /video_feed; endpoint chỉ báo trạng thái"""
+    return jsonify({'success': True, 'subscribers': camera.refcount, 'running': camera.is_running})
 
 if __name__ == '__main__':
+    # Dọn ảnh định kỳ chỉ khi chạy trực tiếp; khi chạy qua WSGI gọi POST /api/evidence/retention
+    evidence_retention.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
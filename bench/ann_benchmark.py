@@ -0,0 +1,75 @@
+"""So sánh recall và độ trễ của IVF index với quét toàn bộ (exact)
+
+Chạy từ thư mục gốc:
+    python -m bench.ann_benchmark --size 50000 --queries 500
+"""
+import argparse
+import time
+import numpy as np
+from utils.gallery import FaceGallery
+from utils.face_index import ExactIndex, IVFIndex
+
+
+def synthetic_encodings(size, dim=128, n_clusters=256, seed=0):
+    """Encoding giả lập: các cụm quanh tâm ngẫu nhiên, chuẩn hóa giống encoding dlib (norm ~1)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    data = centers[rng.integers(0, n_clusters, size)] + 0.6 * rng.normal(size=(size, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def make_queries(gallery_data, n_queries, noise=0.03, seed=1):
+    """Truy vấn = encoding đã đăng ký cộng nhiễu nhỏ (ảnh khác của cùng sinh viên)"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery_data), n_queries, replace=False)
+    queries = gallery_data[rows] + noise * rng.normal(size=(n_queries, gallery_data.shape[1])).astype(np.float32)
+    return queries
+
+
+def time_search(index, queries, k, batch):
+    start = time.perf_counter()
+    ids = []
+    for i in range(0, len(queries), batch):
+        batch_ids, _ = index.search(queries[i:i + batch], k)
+        ids.extend(batch_ids)
+    elapsed = time.perf_counter() - start
+    return ids, elapsed * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=60, help='Số khuôn mặt mỗi ảnh')
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    data = synthetic_encodings(args.size)
+    student_ids = [f"SV{i:06d}" for i in range(args.size)]
+    gallery = FaceGallery(initial_capacity=args.size)
+    gallery.add_many(data, student_ids)
+    queries = make_queries(data, args.queries)
+
+    exact_ids, exact_ms = time_search(ExactIndex(gallery), queries, args.k, args.batch)
+    print(f"Gallery: {args.size} encoding, {args.queries} truy vấn, batch {args.batch}")
+    print(f"{'backend':<16}{'recall@' + str(args.k):>12}{'ms/face':>12}{'speedup':>10}")
+    print(f"{'exact':<16}{1.0:>12.4f}{exact_ms:>12.4f}{1.0:>10.2f}")
+
+    ivf = IVFIndex(gallery, n_lists=args.n_lists, min_train_size=0)
+    start = time.perf_counter()
+    ivf.rebuild()
+    print(f"(IVF train: {len(ivf.centroids)} cụm, {time.perf_counter() - start:.2f}s)")
+
+    for n_probe in args.n_probe:
+        ivf.n_probe = n_probe
+        ivf_ids, ivf_ms = time_search(ivf, queries, args.k, args.batch)
+        hits = sum(len(set(a) & set(b)) for a, b in zip(exact_ids, ivf_ids))
+        recall = hits / (len(queries) * args.k)
+        print(f"{'ivf/nprobe=' + str(n_probe):<16}{recall:>12.4f}{ivf_ms:>12.4f}{exact_ms / ivf_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Sinh bảng attendance giả lập (mặc định 1 triệu dòng) và đo tra cứu điểm danh
+
+So sánh schema cũ (lọc bằng DATE(check_in_time), không index) với schema đã
+migrate (cột check_in_date + index). Chạy từ thư mục gốc:
+    python -m bench.attendance_benchmark --rows 1000000 --students 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from config import Config
+from utils.database import Database
+
+LEGACY_DUPLICATE_CHECK = '''
+    SELECT * FROM attendance
+    WHERE student_id = ? AND DATE(check_in_time) = ?
+'''
+LEGACY_HISTORY = '''
+    SELECT a.*, s.name, s.class
+    FROM attendance a
+    JOIN students s ON a.student_id = s.student_id
+    WHERE DATE(a.check_in_time) = ?
+    ORDER BY a.check_in_time DESC
+'''
+
+
+def synthetic_rows(n_rows, n_students, days=365 * 3, seed=0):
+    """Sinh (student_id, check_in_time, image_path) cho n_rows lượt điểm danh, không trùng (SV, ngày)"""
+    rng = random.Random(seed)
+    start = date(2023, 9, 5)
+    seen = set()
+    while len(seen) < n_rows:
+        student = rng.randrange(n_students)
+        day = rng.randrange(days)
+        if (student, day) in seen:
+            continue
+        seen.add((student, day))
+        check_in = f"{start + timedelta(days=day)} {rng.randrange(7, 18):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+        yield f'SV{student:06d}', check_in, f'attendance_{day}.jpg'
+
+
+def build_legacy(path, n_rows, n_students):
+    """Tạo database theo schema cũ (không có check_in_date, không index)"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL, email TEXT, phone TEXT, class TEXT, image_path TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE attendance (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL,
+                    check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, image_path TEXT,
+                    status TEXT DEFAULT 'present', FOREIGN KEY (student_id) REFERENCES students(student_id))''')
+    conn.executemany('INSERT INTO students (student_id, name, class) VALUES (?, ?, ?)',
+                     ((f'SV{i:06d}', f'Sinh viên {i}', f'L{i % 50:02d}') for i in range(n_students)))
+    conn.executemany('INSERT INTO attendance (student_id, check_in_time, image_path) VALUES (?, ?, ?)',
+                     synthetic_rows(n_rows, n_students))
+    conn.commit()
+    conn.close()
+
+
+def time_queries(conn, sql, params_list):
+    start = time.perf_counter()
+    for params in params_list:
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) * 1000 / len(params_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', help='Giữ lại database đã sinh tại đường dẫn này')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.db or os.path.join(tmp_dir, 'attendance.db')
+        start = time.perf_counter()
+        build_legacy(path, args.rows, args.students)
+        print(f"Sinh {args.rows} dòng attendance, {args.students} sinh viên: {time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(1)
+        days = [str(date(2023, 9, 5) + timedelta(days=rng.randrange(365 * 3))) for _ in range(args.queries)]
+        checks = [(f'SV{rng.randrange(args.students):06d}', day) for day in days]
+
+        conn = sqlite3.connect(path)
+        legacy_check = time_queries(conn, LEGACY_DUPLICATE_CHECK, checks)
+        legacy_history = time_queries(conn, LEGACY_HISTORY, [(day,) for day in days[:20]])
+        conn.close()
+
+        Config.DATABASE_PATH = path
+        start = time.perf_counter()
+        db = Database()
+        print(f"Migration (check_in_date + index): {time.perf_counter() - start:.1f}s")
+
+        with db.connection() as conn:
+            new_check = time_queries(conn, 'SELECT 1 FROM attendance WHERE student_id = ? AND check_in_date = ?', checks)
+            plan = conn.execute('EXPLAIN QUERY PLAN SELECT 1 FROM attendance WHERE student_id = ? AND check_in_date = ?',
+                                checks[0]).fetchall()
+        start = time.perf_counter()
+        for day in days[:20]:
+            db.get_attendance_history(day)
+        new_history = (time.perf_counter() - start) * 1000 / 20
+        start = time.perf_counter()
+        for student_id, _ in checks:
+            db.mark_attendance(student_id, 'bench.jpg')
+        mark_ms = (time.perf_counter() - start) * 1000 / len(checks)
+        db.close()
+
+    print(f"Query plan: {plan[0][-1]}")
+    print(f"{'truy vấn':<28}{'cũ (ms)':>12}{'mới (ms)':>12}")
+    print(f"{'kiểm tra trùng (SV, ngày)':<28}{legacy_check:>12.3f}{new_check:>12.3f}")
+    print(f"{'lịch sử theo ngày':<28}{legacy_history:>12.3f}{new_history:>12.3f}")
+    print(f"mark_attendance (INSERT OR IGNORE): {mark_ms:.3f} ms/lần")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""So sánh chế độ lớp học (phát hiện theo ô + NMS) với đường một lần trên một bộ ảnh
+
+In thời gian từng bước (giải mã, phát hiện, gộp, encoding) và số khuôn mặt tìm
+được của mỗi cách. Chạy từ thư mục gốc:
+    python -m bench.classroom_benchmark lop1.jpg lop2.jpg --workers 8
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import face_recognition
+from config import Config
+from utils.face_recognition import prepare_image, detect_faces, detect_and_encode_classroom
+
+
+def single_pass(path, model):
+    """Đường cũ: detect_and_encode trên ảnh đã thu nhỏ, đo từng bước"""
+    start = time.perf_counter()
+    prepared = prepare_image(path)
+    decode_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    face_locations = detect_faces(prepared, model)
+    detect_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    if face_locations:
+        face_recognition.face_encodings(prepared.rgb, face_locations)
+    encode_ms = (time.perf_counter() - start) * 1000
+    return {'decode_ms': decode_ms, 'detect_ms': detect_ms, 'merge_ms': 0.0,
+            'encode_ms': encode_ms, 'faces': len(face_locations), 'tiles': 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--model', default=Config.FACE_DETECTION_MODEL)
+    parser.add_argument('--workers', type=int, default=Config.CLASSROOM_WORKERS)
+    args = parser.parse_args()
+
+    columns = ('decode_ms', 'detect_ms', 'merge_ms', 'encode_ms')
+    totals = {'một lần': {'faces': 0, 'ms': 0.0}, 'theo ô': {'faces': 0, 'ms': 0.0}}
+    print(f"{'ảnh':<24}{'cách':<10}{'ô':>4}{'decode':>9}{'detect':>9}{'gộp':>7}{'encode':>9}{'tổng':>9}{'mặt':>6}")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for path in args.images:
+            single = single_pass(path, args.model)
+            _, _, tiled = detect_and_encode_classroom(path, args.model, executor=executor)
+            for name, timings in (('một lần', single), ('theo ô', tiled)):
+                total_ms = sum(timings[column] for column in columns)
+                totals[name]['faces'] += timings['faces']
+                totals[name]['ms'] += total_ms
+                print(f"{path[-24:]:<24}{name:<10}{timings['tiles']:>4}"
+                      + ''.join(f"{timings[column]:>{width}.1f}" for column, width in zip(columns, (9, 9, 7, 9)))
+                      + f"{total_ms:>9.1f}{timings['faces']:>6}")
+
+    for name, total in totals.items():
+        print(f"Tổng ({name}): {total['faces']} khuôn mặt, {total['ms'] / len(args.images):.1f} ms/ảnh")
+
+
+if __name__ == '__main__':
+    main()
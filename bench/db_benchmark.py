@@ -0,0 +1,90 @@
+"""Micro-benchmark đường nóng của database: get_student + mark_attendance
+
+So sánh cách cũ (mở/đóng kết nối mỗi thao tác, journal mặc định) với Database
+dùng pool kết nối + WAL. Hai lần chạy này tắt StudentCache để chỉ đo phần kết nối;
+lần chạy thứ ba bật cache và được báo cáo riêng kèm tỉ lệ hit. Chạy từ thư mục gốc:
+    python -m bench.db_benchmark --students 2000 --ops 5000 --threads 4
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.database import Database
+
+STUDENT_CACHE_SIZE = Config.STUDENT_CACHE_SIZE
+
+
+class NaiveDatabase(Database):
+    """Hành vi trước khi có pool: mỗi thao tác một kết nối mới, không pragma"""
+
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=Config.DB_BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=DELETE')
+        return conn
+
+    def connection(self):
+        conn = self.get_connection()
+
+        class _Closing:
+            def __enter__(self):
+                return conn
+
+            def __exit__(self, *exc):
+                conn.close()
+
+        return _Closing()
+
+
+def make_db(cls, path, n_students, cache=False):
+    Config.DATABASE_PATH = path
+    # Dung lượng 0: mọi get_student đều đọc SQL
+    Config.STUDENT_CACHE_SIZE = STUDENT_CACHE_SIZE if cache else 0
+    db = cls()
+    db.add_students([{'student_id': f'SV{i:06d}', 'name': f'Sinh viên {i}'} for i in range(n_students)])
+    return db
+
+
+def run(db, n_students, n_ops, threads):
+    """Mỗi op = get_student + mark_attendance như khi nhận diện một khuôn mặt"""
+    def op(i):
+        student_id = f'SV{i % n_students:06d}'
+        db.get_student(student_id)
+        db.mark_attendance(student_id, 'bench.jpg')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(op, range(n_ops)))
+    return n_ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {}
+        for name, cls, cache in (('naive', NaiveDatabase, False), ('pooled+wal', Database, False),
+                                 ('+cache', Database, True)):
+            db = make_db(cls, os.path.join(tmp_dir, f'{name.strip("+")}.db'), args.students, cache)
+            results[name] = run(db, args.students, args.ops, args.threads)
+            cache_stats = db.student_cache
+            db.close()
+    Config.STUDENT_CACHE_SIZE = STUDENT_CACHE_SIZE
+
+    print(f"{args.ops} op (get_student + mark_attendance), {args.threads} thread, {args.students} sinh viên")
+    for name, ops in results.items():
+        print(f"{name:<12}{ops:>12.1f} op/s{ops / results['naive']:>8.2f}x")
+    lookups = cache_stats.hits + cache_stats.misses
+    print(f"StudentCache (chỉ dòng +cache): {cache_stats.hits}/{lookups} hit"
+          f" ({cache_stats.hits / max(lookups, 1):.1%})")
+
+
+if __name__ == '__main__':
+    main()
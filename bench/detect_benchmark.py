@@ -0,0 +1,48 @@
+"""Độ trễ giải mã + phát hiện khuôn mặt trên mỗi megapixel: trước và sau bước tiền xử lý
+
+Trước: face_recognition.load_image_file + face_locations trên ảnh gốc.
+Sau: load_image (giải mã thu nhỏ, giới hạn cạnh dài) + phát hiện trên ảnh nhỏ.
+Chạy từ thư mục gốc:
+    python -m bench.detect_benchmark anh1.jpg anh2.jpg --repeat 3
+"""
+import argparse
+import time
+import face_recognition
+from config import Config
+from utils.face_recognition import prepare_image, detect_faces
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model', default=Config.FACE_DETECTION_MODEL)
+    args = parser.parse_args()
+
+    print(f"{'ảnh':<28}{'MP':>6}{'decode cũ':>11}{'detect cũ':>11}{'decode mới':>12}{'detect mới':>12}"
+          f"{'ms/MP cũ':>10}{'ms/MP mới':>11}{'mặt cũ/mới':>12}")
+    for path in args.images:
+        decode_old, image = measure(lambda: face_recognition.load_image_file(path), args.repeat)
+        detect_old, faces_old = measure(lambda: face_recognition.face_locations(image, model=args.model), args.repeat)
+        decode_new, prepared = measure(lambda: prepare_image(path), args.repeat)
+        detect_new, faces_new = measure(lambda: detect_faces(prepared, args.model), args.repeat)
+
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        per_mp_old = (decode_old + detect_old) / megapixels
+        per_mp_new = (decode_new + detect_new) / megapixels
+        print(f"{path[-28:]:<28}{megapixels:>6.1f}{decode_old:>11.1f}{detect_old:>11.1f}{decode_new:>12.1f}"
+              f"{detect_new:>12.1f}{per_mp_old:>10.1f}{per_mp_new:>11.1f}{f'{len(faces_old)}/{len(faces_new)}':>12}")
+
+
+if __name__ == '__main__':
+    main()
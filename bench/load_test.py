@@ -0,0 +1,88 @@
+"""Đo độ trễ và thông lượng của /attendance với N upload đồng thời
+
+Chạy server trước (python app.py), sau đó từ thư mục gốc:
+    python -m bench.load_test --image lop.jpg --concurrency 16 --requests 200
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def multipart_body(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def request_json(url, data=None, content_type=None):
+    req = urllib.request.Request(url, data=data)
+    if content_type:
+        req.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+def upload(base_url, image_bytes, wait, poll_interval):
+    """Gửi một ảnh, poll tới khi job xong; trả về (status cuối, độ trễ giây)"""
+    body, content_type = multipart_body('image', 'load_test.jpg', image_bytes)
+    start = time.perf_counter()
+    status, result = request_json(f'{base_url}/attendance?wait={wait}', body, content_type)
+    while status == 202:
+        time.sleep(poll_interval)
+        status, result = request_json(f"{base_url}/jobs/{result['job_id']}")
+    return status, time.perf_counter() - start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--image', required=True)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--wait', type=float, default=0, help='Giây server chờ trước khi trả job_id')
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    counts = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        status, latency = upload(args.url, image_bytes, args.wait, args.poll_interval)
+        with lock:
+            counts[status] = counts.get(status, 0) + 1
+            if status == 200:
+                latencies.append(latency * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.requests} request, {args.concurrency} đồng thời, {elapsed:.2f}s")
+    print(f"Mã HTTP: {dict(sorted(counts.items()))}  (429 = bị từ chối do hàng đợi đầy)")
+    print(f"Thông lượng: {counts.get(200, 0) / elapsed:.2f} ảnh/s")
+    print(f"Độ trễ ms: p50={percentile(latencies, 0.5):.0f} p95={percentile(latencies, 0.95):.0f} "
+          f"p99={percentile(latencies, 0.99):.0f} max={max(latencies, default=0):.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Đánh giá độ chính xác / độ trễ so khớp với nhiều mẫu mỗi sinh viên
+
+Thư mục ảnh có nhãn dạng <root>/<student_id>/*.jpg. Với mỗi sinh viên, --enroll
+ảnh đầu tiên (theo tên file) làm mẫu, phần còn lại làm ảnh thử. Một phần sinh
+viên (--unknown-ratio) không được đăng ký để đo tỉ lệ nhận nhầm người lạ.
+So sánh ba cách: một mẫu (như trước), centroid, và mẫu gần nhất (best-of-K).
+Chạy từ thư mục gốc:
+    python -m bench.recognition_eval data/lfw_subset --enroll 5 --workers 8
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import Config
+from utils.face_recognition import encode_face_file
+from utils.gallery import FaceGallery, MappedGallery, student_centroids
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_labelled(root, workers):
+    """Encoding mọi ảnh trong <root>/<student_id>/, trả về {student_id: [encoding, ...]} theo tên file"""
+    jobs = []
+    for student_id in sorted(os.listdir(root)):
+        folder = os.path.join(root, student_id)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                jobs.append((student_id, os.path.join(folder, name)))
+
+    encodings = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(encode_face_file, [path for _, path in jobs], chunksize=8)
+        for (student_id, _), (encoding, _) in zip(jobs, results):
+            if encoding is not None:
+                encodings.setdefault(student_id, []).append(np.asarray(encoding, dtype=np.float32))
+    return encodings
+
+
+def build_matchers(enrolled):
+    """Tạo hàm so khớp (probes -> (ids, distances)) cho từng cách, kèm số hàng gallery"""
+    single = FaceGallery()
+    single.add_many([samples[0] for samples in enrolled.values()], list(enrolled))
+
+    ids = [student_id for student_id, samples in enrolled.items() for _ in samples]
+    matrix = np.vstack([np.vstack(samples) for samples in enrolled.values()])
+    centroid_ids, centroids = student_centroids(matrix, ids, outlier_distance=Config.FACE_OUTLIER_DISTANCE)
+    centroid = FaceGallery()
+    centroid.add_many(centroids, centroid_ids)
+
+    best = MappedGallery()
+    best.attach(matrix, ids)
+
+    return {
+        'một mẫu': (single.search_ids, len(single)),
+        'centroid': (centroid.search_ids, len(centroid)),
+        'best-of-K': (best.search_students, len(best))
+    }
+
+
+def evaluate(search, probes, labels, tolerance, repeat):
+    """Trả về (đúng, từ chối nhầm, nhận nhầm, ms mỗi ảnh); label None là người lạ"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        ids, distances = search(probes, 1)
+    per_probe_ms = (time.perf_counter() - start) * 1000 / repeat / max(1, len(probes))
+
+    correct = rejected = wrong = 0
+    for label, row_ids, row_dists in zip(labels, ids, distances):
+        matched = row_ids[0] if len(row_ids) and row_dists[0] <= tolerance else None
+        if matched is None:
+            rejected += label is not None
+        elif matched == label:
+            correct += 1
+        else:
+            wrong += 1
+    return correct, rejected, wrong, per_probe_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    parser.add_argument('--enroll', type=int, default=Config.FACE_MAX_SAMPLES, help='Số ảnh mẫu mỗi sinh viên')
+    parser.add_argument('--unknown-ratio', type=float, default=0.2, help='Tỉ lệ sinh viên giữ lại làm người lạ')
+    parser.add_argument('--tolerance', type=float, default=Config.FACE_RECOGNITION_TOLERANCE)
+    parser.add_argument('--workers', type=int, default=Config.ENROLL_WORKERS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    encodings = load_labelled(args.root, args.workers)
+    print(f"Encoding {sum(map(len, encodings.values()))} ảnh của {len(encodings)} người: "
+          f"{time.perf_counter() - start:.1f}s")
+
+    students = sorted(encodings)
+    random.Random(args.seed).shuffle(students)
+    n_unknown = int(len(students) * args.unknown_ratio)
+    unknown, known = students[:n_unknown], students[n_unknown:]
+
+    enrolled, probes, labels = {}, [], []
+    for student_id in known:
+        samples = encodings[student_id]
+        if len(samples) <= args.enroll:
+            continue
+        enrolled[student_id] = samples[:args.enroll]
+        probes.extend(samples[args.enroll:])
+        labels.extend([student_id] * (len(samples) - args.enroll))
+    n_known_probes = len(probes)
+    for student_id in unknown:
+        probes.extend(encodings[student_id])
+        labels.extend([None] * len(encodings[student_id]))
+    if not enrolled:
+        parser.error(f"Không có sinh viên nào có hơn {args.enroll} ảnh")
+    probes = np.vstack(probes)
+    n_unknown_probes = len(probes) - n_known_probes
+
+    print(f"{len(enrolled)} sinh viên đăng ký, {n_known_probes} ảnh thử, "
+          f"{n_unknown_probes} ảnh người lạ, ngưỡng {args.tolerance}")
+    print(f"{'cách':<12}{'hàng':>8}{'đúng':>9}{'từ chối':>10}{'nhận nhầm':>11}{'người lạ lọt':>14}{'ms/ảnh':>9}")
+    for name, (search, rows) in build_matchers(enrolled).items():
+        correct, rejected, wrong, per_probe_ms = evaluate(search, probes, labels, args.tolerance, args.repeat)
+        _, _, false_accept, _ = evaluate(search, probes[n_known_probes:], labels[n_known_probes:],
+                                         args.tolerance, 1)
+        print(f"{name:<12}{rows:>8}{correct / n_known_probes:>9.2%}{rejected / n_known_probes:>10.2%}"
+              f"{(wrong - false_accept) / n_known_probes:>11.2%}"
+              f"{false_accept / n_unknown_probes if n_unknown_probes else 0.0:>14.2%}{per_probe_ms:>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
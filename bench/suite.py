@@ -0,0 +1,334 @@
+"""Bộ benchmark tái lập được cho các đường nóng: so khớp, phát hiện, database, stream webcam
+
+Mọi dữ liệu đều sinh giả lập với seed cố định (gallery encoding 128 chiều, bảng
+attendance) hoặc đọc từ file video mẫu, ghi vào thư mục tạm; database, models
+và ảnh thật của ứng dụng không bị đụng tới. Chạy offline, chỉ cần CPU.
+
+    python -m bench.suite --output bench/results/base.json
+    python -m bench.suite --video lop_hoc.mp4 --baseline bench/results/base.json
+
+Kết quả là JSON {'meta': ..., 'results': {tên: {'value', 'unit', 'better'}}}.
+Với --baseline, in bảng so sánh và trả mã thoát 1 nếu có chỉ số tệ đi quá
+--tolerance. Để số liệu ổn định nên cố định số thread BLAS (OMP_NUM_THREADS=1)
+và so sánh các lần chạy trên cùng một máy. Không có --video thì dùng video
+tổng hợp (không có khuôn mặt): phát hiện vẫn quét toàn ảnh nhưng không có
+encoding, nên chỉ số live/stream thấp hơn thực tế.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+import cv2
+import numpy as np
+from config import Config
+from bench.ann_benchmark import synthetic_encodings, make_queries
+from bench.attendance_benchmark import build_legacy
+
+SCENARIOS = ('match', 'detect', 'db', 'stream')
+
+
+def median_ms(fn, repeat):
+    """Trung vị thời gian (ms) của repeat lần gọi fn"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def metric(value, unit, better='lower'):
+    return {'value': round(float(value), 4), 'unit': unit, 'better': better}
+
+
+def use_sandbox(tmp_dir, name):
+    """Trỏ đường dẫn dữ liệu của Config vào thư mục tạm riêng cho một kịch bản"""
+    root = os.path.join(tmp_dir, name)
+    Config.UPLOAD_FOLDER = os.path.join(root, 'uploads')
+    Config.DATABASE_PATH = os.path.join(root, 'database', 'students.db')
+    Config.MODELS_PATH = os.path.join(root, 'models')
+    Config.PROFILE_DIR = os.path.join(root, 'profiles')
+    Config.init_app()
+    return root
+
+
+def bench_match(args, tmp_dir, log):
+    """Độ trễ recognize_encodings (đồng bộ kho + so khớp + ngưỡng) theo kích thước gallery và index
+
+    Mỗi backend chạy qua FaceRecognizer thật (kho encoding, index lưu/nạp, chế độ
+    FACE_MATCH_MODE đang cấu hình); backend khác 'exact' còn được đo recall@1 so
+    với kết quả exact trên cùng truy vấn.
+    """
+    from utils.face_recognition import FaceRecognizer
+
+    configured = Config.FACE_INDEX_BACKEND
+    results = {}
+    for size in args.sizes:
+        data = synthetic_encodings(size, seed=args.seed)
+        exact_ids = {}
+        for backend in args.backends:
+            # Chỉ số của exact giữ tên cũ để so được với baseline trước đây
+            prefix = f'match.{size}.' if backend == 'exact' else f'match.{size}.{backend}.'
+            use_sandbox(tmp_dir, f'match_{size}_{backend}')
+            Config.FACE_INDEX_BACKEND = backend
+            recognizer = FaceRecognizer()
+            start = time.perf_counter()
+            recognizer.register_encodings(data, [f'SV{i:06d}' for i in range(size)])
+            results[prefix + 'register_s'] = metric(time.perf_counter() - start, 's')
+
+            for faces in args.faces:
+                probes = make_queries(data, faces, seed=args.seed + 1)
+                ms = median_ms(lambda: recognizer.recognize_encodings(probes), args.repeat)
+                results[prefix + f'faces_{faces}.ms_per_image'] = metric(ms, 'ms')
+                top1 = [row[0][0] if row else None for row in recognizer.match_encodings(probes)]
+                if backend == 'exact':
+                    exact_ids[faces] = top1
+                    log(f"match   gallery {size:>7}, {faces:>3} khuôn mặt/ảnh, {backend:<5}: {ms:.3f} ms/ảnh")
+                elif faces in exact_ids:
+                    recall = sum(a == b for a, b in zip(top1, exact_ids[faces])) / len(top1)
+                    results[prefix + f'faces_{faces}.recall_at_1'] = metric(recall, 'ratio', better='higher')
+                    log(f"match   gallery {size:>7}, {faces:>3} khuôn mặt/ảnh, {backend:<5}: {ms:.3f} ms/ảnh, "
+                        f"recall@1 {recall:.3f}")
+            if recognizer.batcher:
+                recognizer.batcher.shutdown()
+    Config.FACE_INDEX_BACKEND = configured
+    return results
+
+
+def read_frames(video, limit):
+    capture = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < limit:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    capture.release()
+    if not frames:
+        raise SystemExit(f"Không đọc được frame nào từ {video}")
+    return frames, fps
+
+
+def bench_detect(args, frames, log):
+    """Giải mã thu nhỏ + phát hiện trên frame video, quy ra ms mỗi megapixel của ảnh gốc"""
+    from utils.face_recognition import prepare_image, detect_faces
+
+    height, width = frames[0].shape[:2]
+    megapixels = width * height / 1e6
+    per_frame = [median_ms(lambda: detect_faces(prepare_image(frame), Config.FACE_DETECTION_MODEL), args.repeat)
+                 for frame in frames[:args.detect_frames]]
+    ms = statistics.median(per_frame)
+    log(f"detect  {width}x{height} ({Config.FACE_DETECTION_MODEL}): {ms:.2f} ms/frame, {ms / megapixels:.2f} ms/MP")
+    return {'detect.ms_per_frame': metric(ms, 'ms'),
+            'detect.ms_per_megapixel': metric(ms / megapixels, 'ms/MP')}
+
+
+def ops_per_sec(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def bench_db(args, tmp_dir, log):
+    """Số thao tác mỗi giây trên bảng attendance giả lập (get_student, mark_attendance, lịch sử)"""
+    from utils.database import Database
+
+    use_sandbox(tmp_dir, 'db')
+    start = time.perf_counter()
+    build_legacy(Config.DATABASE_PATH, args.rows, args.students)
+    db = Database()
+    log(f"db      sinh {args.rows} dòng attendance, {args.students} sinh viên: {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(args.seed)
+    student_ids = [f'SV{i:06d}' for i in rng.sample(range(args.students), min(args.ops, args.students))]
+    days = [str(date(2023, 9, 5) + timedelta(days=rng.randrange(365 * 3))) for _ in range(20)]
+    results = {}
+    try:
+        db.student_cache.clear()
+        results['db.get_student.cold_ops'] = metric(ops_per_sec(db.get_student, student_ids), 'ops/s', 'higher')
+        results['db.get_student.cached_ops'] = metric(ops_per_sec(db.get_student, student_ids), 'ops/s', 'higher')
+        results['db.mark_attendance.ops'] = metric(ops_per_sec(db.mark_attendance, student_ids), 'ops/s', 'higher')
+        # Lần hai: mọi sinh viên đã điểm danh hôm nay, đo đường từ chối trùng
+        results['db.mark_attendance.duplicate_ops'] = metric(ops_per_sec(db.mark_attendance, student_ids),
+                                                             'ops/s', 'higher')
+        batches = [student_ids[i:i + args.faces[-1]] for i in range(0, len(student_ids), args.faces[-1])]
+        results['db.mark_attendance_many.ops'] = metric(ops_per_sec(db.mark_attendance_many, batches),
+                                                        'ops/s', 'higher')
+        results['db.attendance_history.ops'] = metric(ops_per_sec(db.get_attendance_history, days),
+                                                      'ops/s', 'higher')
+    finally:
+        db.close()
+    for name, value in results.items():
+        log(f"db      {name[3:]:<28}{value['value']:>12.1f} ops/s")
+    return results
+
+
+def synthetic_video(path, n_frames=150, size=(640, 480), fps=30, seed=0):
+    """Video tổng hợp (mảng màu chuyển động + nhiễu) khi không có video mẫu"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(n_frames):
+        frame = np.roll(base, i * 4, axis=1)
+        cv2.circle(frame, (width // 2 + int(100 * np.sin(i / 10)), height // 2), 60, (200, 180, 160), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def bench_stream(args, tmp_dir, video, frames, log):
+    """Phát lại video qua đường webcam của ứng dụng: LiveRecognizer.process và generate_frames"""
+    use_sandbox(tmp_dir, 'stream')
+    Config.CAMERA_SOURCE = video
+    Config.LIVE_AUTO_ATTENDANCE = False
+    import app as web
+
+    if args.stream_gallery:
+        data = synthetic_encodings(args.stream_gallery, seed=args.seed)
+        web.face_recognizer.register_encodings(data, [f'SV{i:06d}' for i in range(args.stream_gallery)])
+    live = web.live_recognizer
+
+    # Không giới hạn tốc độ: chi phí một lần phát hiện + tracking + encoding track mới
+    start = time.perf_counter()
+    for frame in frames:
+        live.process(frame)
+    live_ms = (time.perf_counter() - start) * 1000 / len(frames)
+    log(f"stream  live.process: {live_ms:.2f} ms/frame (tối đa {1000 / live_ms:.1f} lần phát hiện/s)")
+
+    # Phát theo đúng FPS của file: đếm frame MJPEG gửi đi và tần số nhận diện nền thực tế
+    stream = web.generate_frames()
+    next(stream)
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < args.stream_seconds:
+        next(stream)
+        sent += 1
+    elapsed = time.perf_counter() - start
+    stream_fps = sent / elapsed
+    # RateMeter chia cho cả cửa sổ trượt: lần chạy ngắn hơn cửa sổ thì chia cho thời gian thực
+    meter = live.detection_rate
+    detection_fps = meter.rate() * meter.window / min(elapsed, meter.window)
+    stream.close()
+    web.evidence_writer.shutdown()
+    log(f"stream  generate_frames: {stream_fps:.1f} FPS, nhận diện nền {detection_fps:.1f}/s "
+        f"(mục tiêu {Config.LIVE_DETECTION_HZ}/s)")
+    return {'stream.live_process.ms_per_frame': metric(live_ms, 'ms'),
+            'stream.fps': metric(stream_fps, 'fps', 'higher'),
+            'stream.detection_fps': metric(detection_fps, 'fps', 'higher')}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Config.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """In bảng so sánh với baseline, trả về danh sách chỉ số tệ đi quá tolerance (tỉ lệ)"""
+    regressions = []
+    print(f"{'chỉ số':<44}{'baseline':>12}{'hiện tại':>12}{'thay đổi':>10}")
+    for name, current in results.items():
+        old = baseline.get(name)
+        if old is None or not old['value']:
+            print(f"{name:<44}{'-':>12}{current['value']:>12.3f}{'mới':>10}")
+            continue
+        change = current['value'] / old['value'] - 1
+        worse = change > tolerance if current['better'] == 'lower' else change < -tolerance
+        flag = '  <- chậm hơn' if worse else ''
+        print(f"{name:<44}{old['value']:>12.3f}{current['value']:>12.3f}{change:>+10.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Kích thước gallery')
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 30], help='Số khuôn mặt mỗi ảnh khi so khớp')
+    parser.add_argument('--backends', nargs='+', choices=('exact', 'ivf'), default=['exact', 'ivf'],
+                        help='Index so khớp (chạy exact trước để đo recall của các backend khác)')
+    parser.add_argument('--rows', type=int, default=200000, help='Số dòng attendance giả lập')
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--ops', type=int, default=2000, help='Số thao tác DB mỗi phép đo')
+    parser.add_argument('--video', help='Video mẫu phát lại qua đường webcam (mặc định: video tổng hợp)')
+    parser.add_argument('--frames', type=int, default=150, help='Số frame đọc từ video')
+    parser.add_argument('--detect-frames', type=int, default=20)
+    parser.add_argument('--stream-seconds', type=float, default=10.0)
+    parser.add_argument('--stream-gallery', type=int, default=1000, help='Số sinh viên giả lập khi phát stream')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Ghi JSON kết quả ra file (mặc định in ra stdout)')
+    parser.add_argument('--baseline', help='JSON của lần chạy trước để so sánh')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Tỉ lệ tệ đi cho phép khi so sánh')
+    args = parser.parse_args()
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video = args.video or synthetic_video(os.path.join(tmp_dir, 'synthetic.avi'), seed=args.seed)
+        frames, video_fps = read_frames(video, args.frames) if {'detect', 'stream'} & set(args.only) else ([], None)
+        if 'match' in args.only:
+            results.update(bench_match(args, tmp_dir, log))
+        if 'detect' in args.only:
+            results.update(bench_detect(args, frames, log))
+        if 'db' in args.only:
+            results.update(bench_db(args, tmp_dir, log))
+        if 'stream' in args.only:
+            results.update(bench_stream(args, tmp_dir, video, frames, log))
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'omp_num_threads': os.environ.get('OMP_NUM_THREADS'),
+            'video': os.path.basename(args.video) if args.video else 'synthetic',
+            'video_fps': video_fps,
+            'frame_size': list(frames[0].shape[1::-1]) if frames else None,
+            'detection_model': Config.FACE_DETECTION_MODEL,
+            'index_backend': Config.FACE_INDEX_BACKEND,
+            'match_mode': Config.FACE_MATCH_MODE,
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+        },
+        'results': results
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    elif not args.baseline:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} chỉ số tệ đi quá {args.tolerance:.0%} so với {args.baseline} "
+                  f"(revision {baseline['meta'].get('revision')})")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,13 +10,116 @@ class Config:
     DATABASE_PATH = os.path.join(BASE_DIR, 'database', 'students.db')
     MODELS_PATH = os.path.join(BASE_DIR, 'models')
     
+    # Cấu hình database (SQLite)
+    DB_POOL_SIZE = 8  # Số kết nối giữ lại trong pool
+    DB_BUSY_TIMEOUT = 5.0  # Giây chờ khi database đang bị khóa ghi
+    DB_STATEMENT_CACHE = 128  # Số prepared statement cache trên mỗi kết nối
+    DB_CACHE_KB = 16384  # Page cache mỗi kết nối (KiB)
+    DB_MMAP_SIZE = 256 * 1024 * 1024  # Đọc file database qua mmap (byte)
+    DB_MAX_VARIABLES = 900  # Số tham số tối đa trong một truy vấn IN (...)
+    STUDENT_CACHE_SIZE = 10000  # Số sinh viên tối đa giữ trong cache (LRU)
+    STUDENT_CACHE_CHECK_INTERVAL = 1.0  # Số giây tối đa cache sinh viên có thể cũ so với ghi của worker khác
+    
+    # Cấu hình lịch sử điểm danh
+    HISTORY_PAGE_SIZE = 100  # Số bản ghi mỗi trang
+    HISTORY_MAX_PAGE_SIZE = 1000  # Giới hạn ?limit= của API
+    EXPORT_BATCH_SIZE = 500  # Số dòng lấy mỗi lần khi export
+    
     # Cấu hình upload
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     
     # Cấu hình nhận diện khuôn mặt
     FACE_RECOGNITION_TOLERANCE = 0.3  # Độ chính xác (0.0 - 1.0, càng thấp càng nghiêm ngặt)
+    FACE_MIN_CONFIDENCE = 0.60  # Độ tin cậy (1 - khoảng cách) tối thiểu để chấp nhận kết quả
+    FACE_MATCH_MODE = os.environ.get('FACE_MATCH_MODE', 'best')  # 'best' (mẫu gần nhất trong K mẫu, index trên ma trận mmap dùng chung) hoặc 'centroid' (centroid riêng mỗi process)
+    FACE_MAX_SAMPLES = 5  # Số mẫu encoding tối đa mỗi sinh viên
+    FACE_OUTLIER_DISTANCE = 0.35  # Mẫu cách centroid xa hơn ngưỡng này bị loại khi tính centroid
+    FACE_AUTO_SAMPLES = True  # Tự thêm mẫu từ các lần điểm danh có độ tin cậy cao
+    FACE_SAMPLE_MIN_CONFIDENCE = 0.80  # Độ tin cậy tối thiểu để một ảnh điểm danh thành mẫu mới
+    FACE_SAMPLE_MIN_NOVELTY = 0.05  # Mẫu mới phải cách mẫu gần nhất ít nhất khoảng này (tránh trùng lặp)
     FACE_DETECTION_MODEL = 'hog'  # 'hog' hoặc 'cnn' (cnn chính xác hơn nhưng chậm hơn)
+    DETECTION_BATCHING = FACE_DETECTION_MODEL == 'cnn'  # Gom ảnh upload và frame webcam thành batch (nên bật với cnn)
+    DETECTION_BATCH_SIZE = 8  # Số ảnh tối đa mỗi batch phát hiện + encoding
+    DETECTION_BATCH_WAIT_MS = 20  # Thời gian tối đa (ms) ảnh đầu tiên chờ gom batch
+    
+    # Cấu hình tiền xử lý ảnh
+    DETECTION_MAX_EDGE = 800  # Cạnh dài tối đa (px) của ảnh dùng để phát hiện khuôn mặt
+    ENCODING_MAX_EDGE = 1600  # Cạnh dài tối đa (px) của ảnh dùng để encoding (giải mã thu nhỏ JPEG)
+    WEBCAM_DETECTION_MAX_EDGE = 320  # Cạnh dài tối đa khi phát hiện trên frame webcam
+    
+    # Cấu hình chế độ lớp học (ảnh toàn cảnh nhiều khuôn mặt nhỏ)
+    CLASSROOM_MAX_EDGE = 4096  # Cạnh dài tối đa khi giải mã ảnh lớp học (giữ gần nguyên độ phân giải)
+    CLASSROOM_TILE_SIZE = 1024  # Kích thước mỗi ô phát hiện (px)
+    CLASSROOM_TILE_OVERLAP = 192  # Phần chồng lấn giữa hai ô, lớn hơn khuôn mặt lớn nhất cần bắt ở mép ô
+    CLASSROOM_UPSAMPLE = 1  # Số lần phóng to khi phát hiện trên mỗi ô (HOG bắt được mặt ~40px)
+    CLASSROOM_NMS_THRESHOLD = 0.5  # Gộp hai khung nếu phần giao chiếm quá tỉ lệ này của khung nhỏ
+    CLASSROOM_WORKERS = None  # Số process phát hiện song song trên các ô (None = số core CPU)
+    
+    # Cấu hình index tìm kiếm khuôn mặt
+    FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND', 'exact')  # 'exact' hoặc 'ivf' (xấp xỉ, cho gallery lớn)
+    FACE_INDEX_N_LISTS = None  # Số cụm IVF (None = tự động ~4*sqrt(N))
+    FACE_INDEX_N_PROBE = 8  # Số cụm được quét mỗi truy vấn
+    FACE_INDEX_MIN_TRAIN_SIZE = 1000  # Dưới ngưỡng này IVF dùng quét toàn bộ
+    
+    # Cấu hình kho encoding (append-only)
+    FACE_STORE_COMPACT_RATIO = 0.25  # Compaction khi tỉ lệ bản ghi đã xóa vượt ngưỡng này
+    FACE_STORE_COMPACT_MIN = 64  # Số bản ghi đã xóa tối thiểu trước khi compaction
+    
+    # Cấu hình đăng ký hàng loạt
+    ENROLL_WORKERS = None  # Số process encoding (None = số core CPU)
+    ENROLL_BATCH_SIZE = 500  # Số sinh viên ghi vào DB trong mỗi transaction
+    ENROLL_QUEUE_MAX = 2  # Số lượt đăng ký hàng loạt tối đa đang chờ/chạy, vượt quá trả về 429
+    
+    # Cấu hình hàng đợi nhận diện
+    RECOGNITION_POOL = os.environ.get('RECOGNITION_POOL', 'thread')  # 'thread' hoặc 'process'
+    RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', 2))  # Số worker detect/encode
+    RECOGNITION_QUEUE_MAX = 32  # Số job tối đa đang chờ, vượt quá trả về 429
+    RECOGNITION_WAIT_TIMEOUT = 15  # Số giây endpoint chờ kết quả trước khi trả về job_id (202)
+    RECOGNITION_JOB_TTL = 300  # Giữ kết quả job bao lâu (giây) để client poll
+    
+    # Cấu hình bỏ qua ảnh chụp / upload gần trùng
+    DEDUP_ENABLED = True  # Dùng lại kết quả nhận diện cho ảnh gần trùng (pHash) thay vì chạy lại
+    DEDUP_TTL = 120  # Số giây một kết quả được dùng lại
+    DEDUP_MAX_DISTANCE = 4  # Số bit khác nhau tối đa giữa hai pHash 64 bit để coi là cùng một ảnh
+    DEDUP_CACHE_SIZE = 256  # Số ảnh gần nhất được giữ trong cache
+    
+    # Cấu hình lưu ảnh minh chứng
+    EVIDENCE_MAX_EDGE = 1280  # Cạnh dài tối đa (px) của ảnh minh chứng lưu lại (encode lại JPEG)
+    EVIDENCE_JPEG_QUALITY = 80  # Chất lượng JPEG của ảnh minh chứng
+    EVIDENCE_FACE_SIZE = 160  # Cạnh tối đa (px) của ảnh cắt khuôn mặt đi kèm
+    EVIDENCE_FACE_MARGIN = 0.3  # Lề thêm quanh khung mặt khi cắt (tỉ lệ theo kích thước khung)
+    EVIDENCE_RETENTION_DAYS = int(os.environ.get('EVIDENCE_RETENTION_DAYS', 365))  # Xóa ảnh minh chứng cũ hơn (0 = giữ mãi)
+    EVIDENCE_QUOTA_MB = int(os.environ.get('EVIDENCE_QUOTA_MB', 0))  # Dung lượng tối đa, vượt thì xóa ảnh cũ nhất (0 = không giới hạn)
+    EVIDENCE_DELETE_ORPHANS = os.environ.get('EVIDENCE_DELETE_ORPHANS', '0') == '1'  # Xóa ảnh không còn ai tham chiếu (tắt: chỉ báo cáo số ảnh)
+    EVIDENCE_COMPACT_LEGACY = os.environ.get('EVIDENCE_COMPACT_LEGACY', '0') == '1'  # Encode lại ảnh phẳng cũ vào thư mục theo ngày (tắt: chỉ báo cáo số ảnh)
+    EVIDENCE_ORPHAN_GRACE = 3600  # Số giây trước khi coi một ảnh chưa được tham chiếu là mồ côi
+    EVIDENCE_RETENTION_INTERVAL = 3600  # Chu kỳ (giây) dọn dẹp nền, chỉ chạy khi khởi động bằng python app.py
+    
+    # Cấu hình camera
+    CAMERA_SOURCE = os.environ.get('CAMERA_SOURCE', '0')  # Chỉ số thiết bị hoặc đường dẫn file video
+    CAMERA_SOURCE = int(CAMERA_SOURCE) if CAMERA_SOURCE.isdigit() else CAMERA_SOURCE
+    CAMERA_BUFFER_SIZE = 4  # Số frame giữ trong ring buffer
+    CAMERA_RECONNECT_DELAY = 0.5  # Giây chờ trước khi mở lại camera sau khi đọc lỗi
+    CAMERA_STREAM_TIMEOUT = 5  # Số giây liên tiếp không có frame trước khi đóng stream MJPEG
+    
+    # Cấu hình nhận diện trực tiếp (webcam)
+    LIVE_DETECTION_HZ = 5  # Số lần phát hiện khuôn mặt mỗi giây, độc lập với FPS của stream
+    LIVE_TRACK_IOU = 0.3  # IoU tối thiểu để coi là cùng một khuôn mặt giữa hai lần phát hiện
+    LIVE_TRACK_MAX_MISSES = 3  # Số lần phát hiện liên tiếp bị mất trước khi xóa track
+    LIVE_VOTE_WINDOW = 5  # Số lần nhận diện gần nhất dùng để bỏ phiếu danh tính của track
+    LIVE_IDENTITY_TTL = 10.0  # Giây trước khi encoding lại một track đã nhận diện ổn định
+    LIVE_DRIFT_IOU = 0.5  # Encoding lại nếu IoU với khung lúc nhận diện thấp hơn ngưỡng này
+    LIVE_MIN_CONFIDENCE = 0.6  # Độ tin cậy trung bình tối thiểu để dùng cache
+    LIVE_ATTENDANCE_VOTES = 3  # Số phiếu tối thiểu trước khi tự động điểm danh
+    LIVE_AUTO_ATTENDANCE = True  # Tự động điểm danh khi danh tính của track ổn định
+    
+    # Cấu hình đo đạc (/metrics, Server-Timing, cProfile)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # Tắt để bỏ hoàn toàn phần đo trên đường nóng
+    SERVER_TIMING = True  # Cho phép client yêu cầu header Server-Timing (?timing=1 hoặc header X-Server-Timing)
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))  # Tỉ lệ request được chạy cProfile
+    PROFILE_SLOW_MS = 1000  # Chỉ ghi file cProfile khi request chậm hơn ngưỡng này
+    PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')  # Thư mục chứa file .prof
     
     @staticmethod
     def init_app():
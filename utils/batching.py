@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """Gom các yêu cầu đến đồng thời thành micro-batch cho một hàm xử lý theo lô
+
+    process_batch(items) nhận danh sách item và trả về danh sách kết quả cùng thứ
+    tự. Một batch được chạy khi đủ max_batch_size item hoặc khi item đầu tiên đã
+    chờ max_wait giây, nên độ trễ thêm vào mỗi yêu cầu bị chặn bởi max_wait.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.02):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        self.batch_sizes = Counter()
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        self.batch_time_total = 0.0
+
+    def submit(self, item):
+        """Đưa item vào hàng chờ, trả về Future chứa kết quả của riêng item đó"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = first[2] + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._execute(batch)
+            if stop:
+                return
+
+    def _execute(self, batch):
+        start = time.monotonic()
+        delays = [start - enqueued_at for _, _, enqueued_at in batch]
+        try:
+            results = self.process_batch([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self.batches += 1
+            self.images += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.queue_delay_total += sum(delays)
+            self.queue_delay_max = max(self.queue_delay_max, max(delays))
+            self.batch_time_total += elapsed
+
+    def stats(self):
+        """Kích thước batch, độ trễ xếp hàng và chi phí mỗi ảnh để cân bằng throughput / độ trễ"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'batches': self.batches,
+                'images': self.images,
+                'pending': self._queue.qsize(),
+                'avg_batch_size': round(self.images / self.batches, 2) if self.batches else 0.0,
+                'batch_size_histogram': dict(sorted(self.batch_sizes.items())),
+                'avg_queue_delay_ms': round(self.queue_delay_total * 1000 / self.images, 2) if self.images else 0.0,
+                'max_queue_delay_ms': round(self.queue_delay_max * 1000, 2),
+                'avg_batch_ms': round(self.batch_time_total * 1000 / self.batches, 2) if self.batches else 0.0,
+                'avg_image_ms': round(self.batch_time_total * 1000 / self.images, 2) if self.images else 0.0
+            }
+
+    def shutdown(self):
+        self._queue.put(None)
@@ -0,0 +1,97 @@
+import collections
+import threading
+import time
+import cv2
+
+
+class CameraStream:
+    """Một thread duy nhất sở hữu camera, đọc frame vào ring buffer dùng chung
+
+    Mọi người xem MJPEG và endpoint chụp ảnh chỉ đọc frame mới nhất từ buffer,
+    không ai gọi camera.read() trực tiếp. Camera mở khi có người dùng đầu tiên
+    (acquire) và đóng khi người cuối cùng release.
+    """
+
+    def __init__(self, source=0, buffer_size=4, reconnect_delay=0.5):
+        self.source = source
+        self.buffer_size = buffer_size
+        self.reconnect_delay = reconnect_delay
+        self.frames = collections.deque(maxlen=buffer_size)
+        self.seq = 0
+        self.refcount = 0
+        self.condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def is_file(self):
+        """Nguồn là file video (dùng cho test): hết file thì quay lại đầu"""
+        return isinstance(self.source, str)
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def acquire(self):
+        """Tăng số người dùng, mở camera nếu đây là người đầu tiên"""
+        with self._lock:
+            self.refcount += 1
+            if not self.is_running:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='camera', daemon=True)
+                self._thread.start()
+            return self.refcount
+
+    def release(self):
+        """Giảm số người dùng, đóng camera khi không còn ai"""
+        with self._lock:
+            self.refcount = max(0, self.refcount - 1)
+            if self.refcount == 0 and self._thread is not None:
+                self._stop.set()
+                thread, self._thread = self._thread, None
+            else:
+                return self.refcount
+        thread.join(timeout=2)
+        with self.condition:
+            self.frames.clear()
+            self.condition.notify_all()
+        return 0
+
+    def _run(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            while not self._stop.is_set():
+                success, frame = capture.read()
+                if not success:
+                    if self.is_file and capture.isOpened():
+                        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    else:
+                        # Thiết bị bị rút hoặc driver lỗi: handle cũ không đọc lại được,
+                        # đóng rồi mở camera mới sau reconnect_delay
+                        capture.release()
+                        if self._stop.wait(self.reconnect_delay):
+                            break
+                        capture = cv2.VideoCapture(self.source)
+                    continue
+                with self.condition:
+                    self.frames.append(frame)
+                    self.seq += 1
+                    self.condition.notify_all()
+                if self.is_file:
+                    # Phát file theo đúng tốc độ khung hình thay vì đọc nhanh nhất có thể
+                    time.sleep(1.0 / (capture.get(cv2.CAP_PROP_FPS) or 30))
+        finally:
+            capture.release()
+
+    def latest(self):
+        """Frame mới nhất (hoặc None nếu chưa có); không được ghi đè lên frame trả về"""
+        with self.condition:
+            return self.frames[-1] if self.frames else None
+
+    def wait_frame(self, after_seq, timeout=1.0):
+        """Chờ frame mới hơn after_seq, trả về (seq, frame) hoặc (after_seq, None) khi hết giờ"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after_seq and self.frames, timeout):
+                return after_seq, None
+            return self.seq, self.frames[-1]
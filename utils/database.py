@@ -1,163 +1,792 @@
 import sqlite3
+import queue
+import logging
+import base64
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from config import Config
+from utils.student_cache import StudentCache
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+VIETNAM_TZ = timezone(timedelta(hours=7))
+
+# Sĩ số hiện tại của từng lớp (lớp rỗng = ''), tính lúc đọc qua index idx_students_class
+ENROLLED_BY_CLASS = "SELECT COALESCE(class, '') AS class, COUNT(*) AS enrolled_count FROM students GROUP BY class"
+
+
+def vietnam_now():
+    """Thời điểm hiện tại theo giờ Việt Nam (UTC+7), dùng chung cho check_in_time và tên ảnh"""
+    return datetime.now(VIETNAM_TZ)
+
 
 class Database:
     def __init__(self):
         self.db_path = Config.DATABASE_PATH
+        self._pool = queue.LifoQueue(maxsize=Config.DB_POOL_SIZE)
+        self.student_cache = StudentCache(Config.STUDENT_CACHE_SIZE, Config.STUDENT_CACHE_CHECK_INTERVAL)
         self.init_database()
     
     @staticmethod
     def get_vietnam_time():
         """Lấy thời gian Việt Nam (UTC+7)"""
-        vietnam_tz = timezone(timedelta(hours=7))
-        return datetime.now(vietnam_tz).strftime('%Y-%m-%d %H:%M:%S')
+        return vietnam_now().strftime('%Y-%m-%d %H:%M:%S')
     
     def get_connection(self):
-        """Tạo kết nối đến database"""
-        conn = sqlite3.connect(self.db_path)
+        """Tạo kết nối mới đến database với các pragma hiệu năng"""
+        conn = sqlite3.connect(self.db_path, timeout=Config.DB_BUSY_TIMEOUT,
+                               check_same_thread=False,
+                               cached_statements=Config.DB_STATEMENT_CACHE)
         conn.row_factory = sqlite3.Row  # Trả về dict thay vì tuple
+        # WAL: nhiều người đọc đồng thời trong khi một người ghi, không bị "database is locked"
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(Config.DB_BUSY_TIMEOUT * 1000)}')
+        conn.execute(f'PRAGMA cache_size=-{Config.DB_CACHE_KB}')
+        conn.execute(f'PRAGMA mmap_size={Config.DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
         return conn
     
+    @contextmanager
+    def connection(self):
+        """Mượn một kết nối từ pool (tạo mới nếu pool rỗng) và trả lại sau khi dùng
+        
+        Kết nối được giữ lại giữa các lần gọi nên statement cache của sqlite3
+        (prepared statement) được dùng lại cho các truy vấn nóng.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self.get_connection()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    def close(self):
+        """Đóng mọi kết nối đang nằm trong pool"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+    
     def init_database(self):
         """Khởi tạo các bảng trong database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Bảng sinh viên
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS students (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    email TEXT,
+                    phone TEXT,
+                    class TEXT,
+                    image_path TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Bảng điểm danh
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attendance (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT NOT NULL,
+                    check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    check_in_date TEXT,
+                    image_path TEXT,
+                    status TEXT DEFAULT 'present',
+                    FOREIGN KEY (student_id) REFERENCES students(student_id)
+                )
+            ''')
+            
+            # Số lượt trùng đã chuyển sang attendance_duplicates ở lần nâng cấp này (0 nếu không có)
+            self.archived_duplicates = self.migrate_attendance(cursor)
+            if self.archived_duplicates:
+                logger.warning("Đã chuyển %d lượt điểm danh trùng ngày sang bảng attendance_duplicates",
+                               self.archived_duplicates)
+            self.create_attendance_summary(cursor)
+            self.create_students_version(cursor)
+            conn.commit()
+    
+    @staticmethod
+    def migrate_attendance(cursor):
+        """Thêm cột check_in_date (lưu sẵn DATE(check_in_time)) và các index tra cứu
+        
+        So sánh trực tiếp trên cột có index thay vì DATE(check_in_time) = ?,
+        vốn buộc SQLite quét toàn bảng. Lượt điểm danh trùng (cùng sinh viên, cùng
+        ngày) chặn việc tạo unique index: chúng được chép sang attendance_duplicates
+        trước khi xóa khỏi attendance. Trả về số lượt đã chuyển.
+        """
+        moved = 0
+        columns = [row['name'] for row in cursor.execute('PRAGMA table_info(attendance)')]
+        if 'check_in_date' not in columns:
+            cursor.execute('ALTER TABLE attendance ADD COLUMN check_in_date TEXT')
+            cursor.execute('UPDATE attendance SET check_in_date = DATE(check_in_time)')
+            # Mỗi sinh viên chỉ điểm danh một lần mỗi ngày: giữ lần điểm danh sớm nhất,
+            # các lần sau được lưu lại trong bảng archive thay vì mất hẳn
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attendance_duplicates (
+                    id INTEGER PRIMARY KEY,
+                    student_id TEXT NOT NULL,
+                    check_in_time TIMESTAMP,
+                    check_in_date TEXT,
+                    image_path TEXT,
+                    status TEXT,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            duplicates = '''
+                SELECT id FROM attendance WHERE id NOT IN (
+                    SELECT MIN(id) FROM attendance GROUP BY student_id, check_in_date
+                )
+            '''
+            cursor.execute(f'''
+                INSERT INTO attendance_duplicates (id, student_id, check_in_time, check_in_date, image_path, status)
+                SELECT id, student_id, check_in_time, check_in_date, image_path, status
+                FROM attendance WHERE id IN ({duplicates})
+            ''')
+            moved = cursor.rowcount
+            cursor.execute(f'DELETE FROM attendance WHERE id IN ({duplicates})')
+        
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_student_date
+            ON attendance (student_id, check_in_date)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attendance_date_time
+            ON attendance (check_in_date, check_in_time)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attendance_time
+            ON attendance (check_in_time)
+        ''')
+        return moved
+    
+    @staticmethod
+    def create_attendance_summary(cursor):
+        """Bảng tổng hợp theo (lớp, ngày), được trigger cập nhật ngay khi có lượt điểm danh
         
-        # Bảng sinh viên
+        Dashboard đọc bảng này thay vì quét attendance JOIN students. Sinh viên
+        không có lớp được gom vào lớp '' (chuỗi rỗng). Bảng luôn bằng đúng kết quả
+        của _fill_attendance_summary: lượt điểm danh tính theo lớp hiện tại của sinh
+        viên và không có dòng nào present_count = 0. Trigger trên students giữ điều đó
+        khi thêm, xóa sinh viên hoặc đổi lớp. Sĩ số không lưu trong bảng mà tính lúc
+        đọc (ENROLLED_BY_CLASS), nên thêm một sinh viên không phải ghi lại mọi ngày của lớp.
+        
+        Trigger chỉ được tạo (IF NOT EXISTS) một lần; trigger của phiên bản cũ (thiếu
+        trigger trên students hoặc còn cập nhật enrolled_count) bị xóa, tạo lại và bảng
+        được tính lại một lần.
+        """
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_students_class
+            ON students (class)
+        ''')
+        
+        # Lớp rỗng lưu thống nhất là NULL để so sánh "class IS ?" dùng được index
+        cursor.execute("UPDATE students SET class = NULL WHERE class = ''")
+        
+        summary_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_daily_summary'"
+        ).fetchone()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS students (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                email TEXT,
-                phone TEXT,
-                class TEXT,
-                image_path TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS attendance_daily_summary (
+                class TEXT NOT NULL,
+                check_in_date TEXT NOT NULL,
+                present_count INTEGER NOT NULL DEFAULT 0,
+                first_check_in TIMESTAMP,
+                last_check_in TIMESTAMP,
+                PRIMARY KEY (class, check_in_date)
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_summary_date
+            ON attendance_daily_summary (check_in_date)
+        ''')
         
-        # Bảng điểm danh
+        triggers = dict(cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg%summary%'"
+        ).fetchall())
+        outdated = 'trg_students_summary_insert' not in triggers or any(
+            'enrolled_count' in (sql or '') for sql in triggers.values())
+        if outdated:
+            for name in triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_attendance_summary_insert
+            AFTER INSERT ON attendance
+            BEGIN
+                INSERT INTO attendance_daily_summary
+                    (class, check_in_date, present_count, first_check_in, last_check_in)
+                SELECT COALESCE(s.class, ''), NEW.check_in_date, 1, NEW.check_in_time, NEW.check_in_time
+                FROM students s WHERE s.student_id = NEW.student_id
+                ON CONFLICT (class, check_in_date) DO UPDATE SET
+                    present_count = present_count + 1,
+                    first_check_in = MIN(first_check_in, excluded.first_check_in),
+                    last_check_in = MAX(last_check_in, excluded.last_check_in);
+            END
+        ''')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT NOT NULL,
-                check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                image_path TEXT,
-                status TEXT DEFAULT 'present',
-                FOREIGN KEY (student_id) REFERENCES students(student_id)
+            CREATE TRIGGER IF NOT EXISTS trg_attendance_summary_delete
+            AFTER DELETE ON attendance
+            BEGIN
+                UPDATE attendance_daily_summary SET
+                    present_count = present_count - 1,
+                    first_check_in = (SELECT MIN(a.check_in_time) FROM attendance a
+                                      JOIN students s ON a.student_id = s.student_id
+                                      WHERE a.check_in_date = OLD.check_in_date
+                                        AND COALESCE(s.class, '') = attendance_daily_summary.class),
+                    last_check_in = (SELECT MAX(a.check_in_time) FROM attendance a
+                                     JOIN students s ON a.student_id = s.student_id
+                                     WHERE a.check_in_date = OLD.check_in_date
+                                       AND COALESCE(s.class, '') = attendance_daily_summary.class)
+                WHERE check_in_date = OLD.check_in_date
+                  AND class = (SELECT COALESCE(class, '') FROM students WHERE student_id = OLD.student_id);
+                DELETE FROM attendance_daily_summary
+                WHERE check_in_date = OLD.check_in_date AND present_count <= 0;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_students_summary_insert
+            AFTER INSERT ON students
+            BEGIN
+                {Database._summary_refresh_sql('NEW')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_students_summary_delete
+            AFTER DELETE ON students
+            BEGIN
+                {Database._summary_refresh_sql('OLD')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_students_summary_class
+            AFTER UPDATE OF class ON students
+            WHEN OLD.class IS NOT NEW.class
+            BEGIN
+                {Database._summary_refresh_sql('OLD')}
+                {Database._summary_refresh_sql('NEW')}
+            END
+        ''')
+        
+        # Lần đầu tạo bảng (hoặc nâng cấp trigger) trên database đã có dữ liệu: backfill
+        if not summary_exists or outdated:
+            Database._fill_attendance_summary(cursor)
+    
+    @staticmethod
+    def create_students_version(cursor):
+        """Bộ đếm phiên bản bảng students, tăng bởi trigger ở mọi lần thêm/sửa/xóa sinh viên
+        
+        Các worker so sánh bộ đếm này để biết cache sinh viên của mình đã cũ, kể cả
+        khi process khác (hoặc công cụ ngoài) ghi vào bảng.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS students_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL DEFAULT 0
             )
         ''')
+        cursor.execute('INSERT OR IGNORE INTO students_version (id, version) VALUES (0, 0)')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_students_version_{event.lower()}
+                AFTER {event} ON students
+                BEGIN
+                    UPDATE students_version SET version = version + 1 WHERE id = 0;
+                END
+            ''')
+    
+    def _check_student_cache(self, cursor=None):
+        """Bỏ cache sinh viên nếu worker khác đã ghi (đọc bộ đếm tối đa mỗi STUDENT_CACHE_CHECK_INTERVAL giây)"""
+        if not self.student_cache.needs_check():
+            return
+        query = 'SELECT version FROM students_version WHERE id = 0'
+        if cursor is not None:
+            version = cursor.execute(query).fetchone()[0]
+        else:
+            with self.connection() as conn:
+                version = conn.execute(query).fetchone()[0]
+        self.student_cache.validate(version)
+    
+    @staticmethod
+    def _summary_refresh_sql(row):
+        """Câu lệnh trigger tính lại bảng tổng hợp của lớp row.class (row là NEW/OLD của students)
         
-        conn.commit()
-        conn.close()
+        Chỉ tính lại các ngày sinh viên có điểm danh (dùng index student_id, check_in_date);
+        sinh viên mới chưa có lượt điểm danh nào nên gần như không tốn gì.
+        """
+        return f'''
+                DELETE FROM attendance_daily_summary
+                WHERE class = COALESCE({row}.class, '')
+                  AND check_in_date IN (SELECT check_in_date FROM attendance WHERE student_id = {row}.student_id);
+                INSERT INTO attendance_daily_summary
+                    (class, check_in_date, present_count, first_check_in, last_check_in)
+                SELECT COALESCE({row}.class, ''), a.check_in_date, COUNT(*),
+                       MIN(a.check_in_time), MAX(a.check_in_time)
+                FROM attendance a
+                JOIN students s ON a.student_id = s.student_id
+                WHERE s.class IS {row}.class
+                  AND a.check_in_date IN (SELECT check_in_date FROM attendance WHERE student_id = {row}.student_id)
+                GROUP BY a.check_in_date;'''
+    
+    @staticmethod
+    def _fill_attendance_summary(cursor):
+        cursor.execute('DELETE FROM attendance_daily_summary')
+        cursor.execute('''
+            INSERT INTO attendance_daily_summary
+                (class, check_in_date, present_count, first_check_in, last_check_in)
+            SELECT COALESCE(s.class, ''), a.check_in_date, COUNT(*),
+                   MIN(a.check_in_time), MAX(a.check_in_time)
+            FROM attendance a
+            JOIN students s ON a.student_id = s.student_id
+            GROUP BY s.class, a.check_in_date
+        ''')
+    
+    def rebuild_attendance_summary(self):
+        """Tính lại toàn bộ bảng tổng hợp từ attendance (backfill/sửa sai lệch), cùng ngữ nghĩa với trigger"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._fill_attendance_summary(cursor)
+            conn.commit()
+            return cursor.execute('SELECT COUNT(*) FROM attendance_daily_summary').fetchone()[0]
     
     def add_student(self, student_id, name, email=None, phone=None, class_name=None, image_path=None):
         """Thêm sinh viên mới"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                vietnam_time = self.get_vietnam_time()
+                cursor.execute('''
+                    INSERT INTO students (student_id, name, email, phone, class, image_path, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (student_id, name, email, phone, class_name or None, image_path, vietnam_time))
+                conn.commit()
+                self.student_cache.invalidate([student_id])
+                return True, "Thêm sinh viên thành công"
+            except sqlite3.IntegrityError:
+                return False, "Mã sinh viên đã tồn tại"
+    
+    def add_students(self, students):
+        """Thêm nhiều sinh viên trong một transaction
+
+        students: danh sách dict có các khóa student_id, name, email, phone, class, image_path.
+        Trả về danh sách (student_id, success, message) theo thứ tự đầu vào.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            results = []
+
             vietnam_time = self.get_vietnam_time()
-            cursor.execute('''
-                INSERT INTO students (student_id, name, email, phone, class, image_path, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (student_id, name, email, phone, class_name, image_path, vietnam_time))
+            for student in students:
+                try:
+                    cursor.execute('''
+                        INSERT INTO students (student_id, name, email, phone, class, image_path, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (student['student_id'], student['name'], student.get('email'), student.get('phone'),
+                          student.get('class') or None, student.get('image_path'), vietnam_time))
+                    results.append((student['student_id'], True, "Thêm sinh viên thành công"))
+                except sqlite3.IntegrityError:
+                    results.append((student['student_id'], False, "Mã sinh viên đã tồn tại"))
             conn.commit()
-            return True, "Thêm sinh viên thành công"
-        except sqlite3.IntegrityError:
-            return False, "Mã sinh viên đã tồn tại"
-        finally:
-            conn.close()
-    
+            self.student_cache.invalidate([student['student_id'] for student in students])
+            return results
+
+    @timed('db_get_student')
     def get_student(self, student_id):
-        """Lấy thông tin sinh viên"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM students WHERE student_id = ?', (student_id,))
-        student = cursor.fetchone()
-        conn.close()
-        return dict(student) if student else None
+        """Lấy thông tin sinh viên (đọc qua cache)"""
+        self._check_student_cache()
+        student = self.student_cache.get(student_id)
+        if student is not None:
+            return student
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM students WHERE student_id = ?', (student_id,))
+            student = cursor.fetchone()
+            if not student:
+                return None
+            student = dict(student)
+            self.student_cache.put(student)
+            return student
+    
+    @timed('db_get_students')
+    def get_students(self, student_ids):
+        """Lấy thông tin nhiều sinh viên (cache, phần thiếu bằng một truy vấn IN (...)), trả về dict student_id -> sinh viên"""
+        self._check_student_cache()
+        students, missing = self.student_cache.get_many(dict.fromkeys(student_ids))
+        if missing:
+            with self.connection() as conn:
+                students.update(self._fetch_students(conn.cursor(), missing))
+        return students
+    
+    def _fetch_students(self, cursor, student_ids):
+        student_ids = list(dict.fromkeys(student_ids))
+        students = {}
+        # SQLite giới hạn số tham số mỗi câu lệnh
+        for i in range(0, len(student_ids), Config.DB_MAX_VARIABLES):
+            chunk = student_ids[i:i + Config.DB_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT * FROM students WHERE student_id IN ({placeholders})', chunk)
+            students.update((row['student_id'], dict(row)) for row in cursor.fetchall())
+        self.student_cache.put_many(students.values())
+        return students
     
     def get_all_students(self):
-        """Lấy danh sách tất cả sinh viên"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM students ORDER BY name')
-        students = cursor.fetchall()
-        conn.close()
-        return [dict(student) for student in students]
+        """Lấy danh sách tất cả sinh viên (bản chụp được cache tới lần thêm/xóa tiếp theo)"""
+        self._check_student_cache()
+        roster = self.student_cache.get_roster()
+        if roster is not None:
+            return roster
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM students ORDER BY name')
+            students = [dict(student) for student in cursor.fetchall()]
+            self.student_cache.set_roster(students)
+            self.student_cache.put_many(students)
+            return students
     
+    @timed('db_mark_attendance')
     def mark_attendance(self, student_id, image_path=None):
         """Điểm danh sinh viên"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Lấy thời gian Việt Nam
-        vietnam_time = self.get_vietnam_time()
-        today = vietnam_time.split(' ')[0]  # Lấy phần ngày
-        
-        # Kiểm tra đã điểm danh hôm nay chưa
-        cursor.execute('''
-            SELECT * FROM attendance 
-            WHERE student_id = ? AND DATE(check_in_time) = ?
-        ''', (student_id, today))
-        
-        if cursor.fetchone():
-            conn.close()
-            return False, "Sinh viên đã điểm danh hôm nay"
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Lấy thời gian Việt Nam
+            vietnam_time = self.get_vietnam_time()
+            today = vietnam_time.split(' ')[0]  # Lấy phần ngày
+            
+            # Unique index (student_id, check_in_date) chặn điểm danh trùng trong một lệnh
+            cursor.execute('''
+                INSERT OR IGNORE INTO attendance (student_id, image_path, check_in_time, check_in_date)
+                VALUES (?, ?, ?, ?)
+            ''', (student_id, image_path, vietnam_time, today))
+            conn.commit()
+            
+            if cursor.rowcount == 0:
+                return False, "Sinh viên đã điểm danh hôm nay"
+            return True, "Điểm danh thành công"
+    
+    @timed('db_mark_attendance_many')
+    def mark_attendance_many(self, student_ids, image_path=None):
+        """Điểm danh nhiều sinh viên (ví dụ mọi khuôn mặt trong một ảnh) trong một transaction
         
-        # Thêm điểm danh mới với thời gian Việt Nam
-        cursor.execute('''
-            INSERT INTO attendance (student_id, image_path, check_in_time)
-            VALUES (?, ?, ?)
-        ''', (student_id, image_path, vietnam_time))
-        conn.commit()
-        conn.close()
-        return True, "Điểm danh thành công"
+        Trả về dict student_id -> {'status': 'new' | 'already_marked' | 'unknown', 'student': sinh viên hoặc None}.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Lấy thời gian Việt Nam
+            vietnam_time = self.get_vietnam_time()
+            today = vietnam_time.split(' ')[0]  # Lấy phần ngày
+            
+            # Sinh viên đã cache không cần đọc SQL; chỉ truy vấn phần còn thiếu
+            self._check_student_cache(cursor)
+            students, missing = self.student_cache.get_many(dict.fromkeys(student_ids))
+            if missing:
+                students.update(self._fetch_students(cursor, missing))
+            results = {}
+            for student_id in dict.fromkeys(student_ids):
+                student = students.get(student_id)
+                if student is None:
+                    results[student_id] = {'status': 'unknown', 'student': None}
+                    continue
+                cursor.execute('''
+                    INSERT OR IGNORE INTO attendance (student_id, image_path, check_in_time, check_in_date)
+                    VALUES (?, ?, ?, ?)
+                ''', (student_id, image_path, vietnam_time, today))
+                status = 'new' if cursor.rowcount == 1 else 'already_marked'
+                results[student_id] = {'status': status, 'student': student}
+            conn.commit()
+            return results
     
     def get_attendance_history(self, date=None):
         """Lấy lịch sử điểm danh"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            if date:
+                cursor.execute('''
+                    SELECT a.*, s.name, s.class 
+                    FROM attendance a
+                    JOIN students s ON a.student_id = s.student_id
+                    WHERE a.check_in_date = ?
+                    ORDER BY a.check_in_time DESC
+                ''', (date,))
+            else:
+                cursor.execute('''
+                    SELECT a.*, s.name, s.class 
+                    FROM attendance a
+                    JOIN students s ON a.student_id = s.student_id
+                    ORDER BY a.check_in_time DESC
+                    LIMIT 100
+                ''')
+            
+            records = cursor.fetchall()
+            return [dict(record) for record in records]
+    
+    @staticmethod
+    def encode_cursor(record):
+        """Cursor phân trang (keyset) từ bản ghi cuối của trang: (check_in_time, id)"""
+        raw = f"{record['check_in_time']}|{record['id']}".encode()
+        return base64.urlsafe_b64encode(raw).decode()
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Ngược lại của encode_cursor; cursor hỏng (sửa tay, cắt cụt) gây ValueError"""
+        try:
+            check_in_time, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+            return check_in_time, int(record_id)
+        except ValueError:
+            # binascii.Error, UnicodeDecodeError và lỗi tách chuỗi đều là ValueError
+            raise ValueError('Cursor phân trang không hợp lệ') from None
+    
+    @staticmethod
+    def _history_filters(date_from=None, date_to=None, class_name=None, student_id=None):
+        """Điều kiện WHERE dùng chung cho phân trang và export (đều dùng được index)"""
+        conditions, params = [], []
+        if date_from:
+            conditions.append('a.check_in_date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('a.check_in_date <= ?')
+            params.append(date_to)
+        if class_name:
+            conditions.append('s.class = ?')
+            params.append(class_name)
+        if student_id:
+            conditions.append('a.student_id = ?')
+            params.append(student_id)
+        return conditions, params
+    
+    def get_attendance_page(self, after=None, limit=100, **filters):
+        """Một trang lịch sử điểm danh, mới nhất trước
         
-        if date:
-            cursor.execute('''
+        after: cursor của trang trước (None = trang đầu). Trả về (records, next_cursor),
+        next_cursor là None khi hết dữ liệu.
+        """
+        conditions, params = self._history_filters(**filters)
+        if after:
+            # Keyset: tiếp tục ngay sau bản ghi cuối thay vì OFFSET (không phải quét lại các trang trước)
+            conditions.append('(a.check_in_time, a.id) < (?, ?)')
+            params.extend(self.decode_cursor(after))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
                 SELECT a.*, s.name, s.class 
                 FROM attendance a
                 JOIN students s ON a.student_id = s.student_id
-                WHERE DATE(a.check_in_time) = ?
-                ORDER BY a.check_in_time DESC
-            ''', (date,))
-        else:
-            cursor.execute('''
-                SELECT a.*, s.name, s.class 
+                {where}
+                ORDER BY a.check_in_time DESC, a.id DESC
+                LIMIT ?
+            ''', params + [limit + 1])
+            records = [dict(record) for record in cursor.fetchall()]
+        
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = self.encode_cursor(records[-1])
+        return records, next_cursor
+    
+    def iter_attendance(self, batch_size=500, **filters):
+        """Duyệt toàn bộ lịch sử theo bộ lọc bằng server-side cursor (fetchmany), bộ nhớ không đổi"""
+        conditions, params = self._history_filters(**filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT a.id, a.student_id, s.name, s.class, a.check_in_time, a.status, a.image_path
                 FROM attendance a
                 JOIN students s ON a.student_id = s.student_id
-                ORDER BY a.check_in_time DESC
-                LIMIT 100
-            ''')
-        
-        records = cursor.fetchall()
-        conn.close()
-        return [dict(record) for record in records]
+                {where}
+                ORDER BY a.check_in_time DESC, a.id DESC
+            ''', params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                # Client ngắt giữa chừng: đóng cursor trước khi trả kết nối về pool
+                cursor.close()
+    
+    def get_stats_overview(self, date):
+        """Tổng số sinh viên và số lượt điểm danh trong ngày (cho trang chủ)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            total_students = cursor.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+            present = cursor.execute(
+                'SELECT COALESCE(SUM(present_count), 0) FROM attendance_daily_summary WHERE check_in_date = ?',
+                (date,)
+            ).fetchone()[0]
+            return {'total_students': total_students, 'date': date, 'present': present}
+    
+    def get_class_summary(self, date_from, date_to, class_name=None):
+        """Số có mặt / sĩ số / giờ điểm danh đầu-cuối theo lớp và ngày, đọc từ bảng tổng hợp"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            query = f'''
+                SELECT d.class, d.check_in_date, d.present_count, COALESCE(e.enrolled_count, 0) AS enrolled_count,
+                       d.first_check_in, d.last_check_in,
+                       ROUND(1.0 * d.present_count / MAX(COALESCE(e.enrolled_count, 0), 1), 4) AS attendance_rate
+                FROM attendance_daily_summary d
+                LEFT JOIN ({ENROLLED_BY_CLASS}) e ON e.class = d.class
+                WHERE d.check_in_date BETWEEN ? AND ?
+            '''
+            params = [date_from, date_to]
+            if class_name is not None:
+                query += ' AND d.class = ?'
+                params.append(class_name)
+            cursor.execute(query + ' ORDER BY d.check_in_date DESC, d.class', params)
+            return [dict(row) for row in cursor.fetchall()]
     
+    def get_attendance_trend(self, date_from, date_to, class_name=None):
+        """Tỉ lệ điểm danh theo ngày (toàn trường hoặc một lớp)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            query = f'''
+                SELECT d.check_in_date, SUM(d.present_count) AS present,
+                       COALESCE(SUM(e.enrolled_count), 0) AS enrolled,
+                       ROUND(1.0 * SUM(d.present_count) / MAX(COALESCE(SUM(e.enrolled_count), 0), 1), 4)
+                           AS attendance_rate
+                FROM attendance_daily_summary d
+                LEFT JOIN ({ENROLLED_BY_CLASS}) e ON e.class = d.class
+                WHERE d.check_in_date BETWEEN ? AND ?
+            '''
+            params = [date_from, date_to]
+            if class_name is not None:
+                query += ' AND d.class = ?'
+                params.append(class_name)
+            cursor.execute(query + ' GROUP BY d.check_in_date ORDER BY d.check_in_date', params)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_student_attendance_rates(self, class_name, date_from, date_to):
+        """Tỉ lệ chuyên cần từng sinh viên của lớp: số buổi có mặt / số buổi lớp có điểm danh"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            sessions = cursor.execute('''
+                SELECT COUNT(*) FROM attendance_daily_summary
+                WHERE class = ? AND check_in_date BETWEEN ? AND ? AND present_count > 0
+            ''', (class_name, date_from, date_to)).fetchone()[0]
+            cursor.execute('''
+                SELECT s.student_id, s.name,
+                       (SELECT COUNT(*) FROM attendance a
+                        WHERE a.student_id = s.student_id AND a.check_in_date BETWEEN ? AND ?) AS present_days
+                FROM students s
+                WHERE s.class IS ?
+                ORDER BY s.name
+            ''', (date_from, date_to, class_name or None))
+            rates = []
+            for row in cursor.fetchall():
+                record = dict(row)
+                record['sessions'] = sessions
+                record['attendance_rate'] = round(record['present_days'] / sessions, 4) if sessions else 0.0
+                rates.append(record)
+            return rates
+    
+    def get_absentees(self, class_name, date):
+        """Sinh viên của lớp chưa điểm danh trong ngày"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT s.student_id, s.name, s.email, s.phone
+                FROM students s
+                WHERE s.class IS ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM attendance a
+                      WHERE a.student_id = s.student_id AND a.check_in_date = ?
+                  )
+                ORDER BY s.name
+            ''', (class_name or None, date))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_image_references(self):
+        """Trả về (tập ảnh không được xóa, {ảnh minh chứng được tham chiếu: check_in_time sớm nhất tham chiếu nó})
+
+        Ảnh không được xóa gồm ảnh của sinh viên và ảnh của các lượt trùng đã archive.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT image_path FROM students WHERE image_path IS NOT NULL')
+            students = {row[0] for row in cursor.fetchall()}
+            if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_duplicates'").fetchone():
+                cursor.execute('SELECT image_path FROM attendance_duplicates WHERE image_path IS NOT NULL')
+                students.update(row[0] for row in cursor.fetchall())
+            cursor.execute('''
+                SELECT image_path, MIN(check_in_time) FROM attendance
+                WHERE image_path IS NOT NULL GROUP BY image_path
+            ''')
+            attendance = {row[0]: row[1] for row in cursor.fetchall()}
+            return students, attendance
+
+    def update_attendance_images(self, moves):
+        """Đổi image_path của các lượt điểm danh theo moves {ảnh cũ: ảnh mới hoặc None nếu đã xóa}
+
+        image_path không có index: ghi moves vào bảng tạm rồi cập nhật trong một lần
+        quét bảng attendance thay vì một UPDATE (một lần quét) cho mỗi ảnh.
+        Trả về số dòng đã cập nhật.
+        """
+        if not moves:
+            return 0
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS image_moves (old_path TEXT PRIMARY KEY, new_path TEXT)')
+            cursor.execute('DELETE FROM image_moves')
+            cursor.executemany('INSERT OR REPLACE INTO image_moves (old_path, new_path) VALUES (?, ?)', moves.items())
+            cursor.execute('''
+                UPDATE attendance
+                SET image_path = (SELECT new_path FROM image_moves WHERE old_path = attendance.image_path)
+                WHERE image_path IN (SELECT old_path FROM image_moves)
+            ''')
+            updated = cursor.rowcount
+            cursor.execute('DELETE FROM image_moves')
+            conn.commit()
+            return updated
+
     def delete_student(self, student_id):
         """Xóa sinh viên"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Xóa lịch sử điểm danh
-            cursor.execute('DELETE FROM attendance WHERE student_id = ?', (student_id,))
+        with self.connection() as conn:
+            cursor = conn.cursor()
             
-            # Xóa sinh viên
-            cursor.execute('DELETE FROM students WHERE student_id = ?', (student_id,))
+            try:
+                # Xóa lịch sử điểm danh
+                cursor.execute('DELETE FROM attendance WHERE student_id = ?', (student_id,))
             
-            conn.commit()
-            return True, "Xóa sinh viên thành công"
-        except Exception as e:
-            return False, f"Lỗi khi xóa: {str(e)}"
-        finally:
-            conn.close()
\ No newline at end of file
+                # Xóa sinh viên
+                cursor.execute('DELETE FROM students WHERE student_id = ?', (student_id,))
+            
+                conn.commit()
+                self.student_cache.invalidate([student_id])
+                return True, "Xóa sinh viên thành công"
+            except Exception as e:
+                return False, f"Lỗi khi xóa: {str(e)}"
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Công cụ bảo trì database')
+    parser.add_argument('command', choices=['rebuild-summary'], help='rebuild-summary: tính lại bảng tổng hợp điểm danh')
+    args = parser.parse_args()
+    
+    Config.init_app()
+    if args.command == 'rebuild-summary':
+        print(f"Đã tính lại {Database().rebuild_attendance_summary()} dòng tổng hợp (lớp, ngày)")
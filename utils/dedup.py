@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+def image_hash(image):
+    """pHash 64 bit của ảnh (bytes file ảnh hoặc frame BGR), kèm kích thước ảnh
+
+    Ảnh được giải mã ở 1/8 độ phân giải, đưa về xám 32x32 rồi lấy dấu của 8x8
+    hệ số DCT tần số thấp so với trung vị: hai lần chụp gần như giống nhau cho
+    hash chỉ khác vài bit. Trả về (hash, (rộng, cao)) hoặc None nếu không giải mã được.
+    """
+    if isinstance(image, np.ndarray):
+        size = (image.shape[1], image.shape[0])
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    else:
+        gray = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            return None
+        # Kích thước gốc xấp xỉ, chỉ dùng để không ghép hai ảnh khác tỉ lệ
+        size = (gray.shape[1] * 8, gray.shape[0] * 8)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big'), size
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class RecognitionCache:
+    """Cache kết quả nhận diện theo pHash của ảnh để bỏ qua ảnh chụp / upload lặp lại
+
+    Mỗi mục giữ kết quả so khớp (trước bước ghi DB), tên ảnh minh chứng đã lưu
+    và phiên bản gallery lúc nhận diện. Ảnh mới khớp một mục nếu cùng chế độ,
+    cùng kích thước, hash cách nhau tối đa max_distance bit, mục chưa quá ttl giây
+    và gallery chưa đổi (đăng ký, xóa, thêm mẫu ở bất kỳ worker nào).
+    """
+
+    def __init__(self, ttl=120, max_distance=4, capacity=256):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _expire(self, now, version):
+        for key, entry in list(self._entries.items()):
+            if now - entry['created_at'] > self.ttl or entry['version'] != version:
+                if entry['version'] != version:
+                    self.invalidated += 1
+                del self._entries[key]
+
+    def get(self, key, version):
+        """Tìm mục gần trùng với key = (hash, kích thước, chế độ), trả về bản sao mục hoặc None"""
+        image_hash, size, mode = key
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now, version)
+            best = None
+            for entry_id, entry in self._entries.items():
+                if entry['size'] != size or entry['mode'] != mode:
+                    continue
+                distance = hamming(entry['hash'], image_hash)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, entry_id)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best[1])
+            return dict(self._entries[best[1]], distance=best[0])
+
+    def put(self, key, version, recognized, message, filename=None):
+        """Lưu kết quả so khớp của ảnh; trả về id của mục để cập nhật ảnh minh chứng sau"""
+        image_hash, size, mode = key
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'hash': image_hash, 'size': size, 'mode': mode, 'version': version,
+                'created_at': time.monotonic(), 'recognized': recognized, 'message': message,
+                'filename': filename, 'id': entry_id
+            }
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            return entry_id
+
+    def set_filename(self, entry_id, filename):
+        """Ghi nhận ảnh minh chứng đã lưu cho một mục (lần gần trùng sau dùng lại file này)"""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is not None and entry['filename'] is None:
+                entry['filename'] = filename
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'ttl': self.ttl,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidated': self.invalidated
+            }
@@ -0,0 +1,343 @@
+import os
+import json
+import pickle
+import threading
+from contextlib import contextmanager
+import numpy as np
+from utils.gallery import ENCODING_DIM
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ chạy một process, khóa thread là đủ
+    fcntl = None
+
+
+class EncodingStore:
+    """Kho encoding nhị phân append-only trên đĩa
+
+    Mỗi thế hệ (generation) gồm ba file:
+      - face_vectors.<gen>.f32: các bản ghi float32 (dim) nối tiếp nhau
+      - face_ids.<gen>.txt: mã sinh viên, mỗi dòng ứng với một bản ghi (một sinh
+        viên có thể có nhiều bản ghi - các mẫu khuôn mặt)
+      - face_tombstones.<gen>.i64: số thứ tự các bản ghi đã xóa (int64)
+    File manifest face_store.json trỏ tới thế hệ hiện tại; compaction ghi thế hệ
+    mới rồi đổi manifest bằng os.replace nên luôn nguyên tử.
+
+    Nhiều process (gunicorn worker) dùng chung một thư mục kho: mọi lần ghi giữ
+    khóa file face_store.lock và tăng bộ đếm phiên bản trong face_store.version.
+    Bộ đếm được mmap nên mỗi worker kiểm tra thay đổi mà không cần system call,
+    rồi refresh() chỉ đọc phần được ghi thêm từ lần trước. Trạng thái trong bộ
+    nhớ (n_records, tombstones, ...) chỉ được cập nhật qua open/refresh/compact.
+    """
+
+    MANIFEST = 'face_store.json'
+    VERSION = 'face_store.version'
+    LOCK = 'face_store.lock'
+
+    def __init__(self, directory, dim=ENCODING_DIM, compact_ratio=0.25, compact_min=64):
+        self.directory = directory
+        self.dim = dim
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.generation = 0
+        self.n_records = 0
+        self.tombstones = set()
+        self.record_ids = []
+        self._record_of = {}
+        self._ids_offset = 0
+        self._tombstones_offset = 0
+        self._counter = None
+        self._seen = None
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST)
+
+    def _paths(self, generation):
+        return (os.path.join(self.directory, f'face_vectors.{generation}.f32'),
+                os.path.join(self.directory, f'face_ids.{generation}.txt'),
+                os.path.join(self.directory, f'face_tombstones.{generation}.i64'))
+
+    @property
+    def vectors_path(self):
+        return self._paths(self.generation)[0]
+
+    @property
+    def ids_path(self):
+        return self._paths(self.generation)[1]
+
+    @property
+    def tombstones_path(self):
+        return self._paths(self.generation)[2]
+
+    def __len__(self):
+        return len(self._record_of)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    @contextmanager
+    def lock(self):
+        """Khóa ghi giữa các thread và process dùng chung kho (có thể lồng nhau)"""
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_file = open(os.path.join(self.directory, self.LOCK), 'a+')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _open_counter(self):
+        path = os.path.join(self.directory, self.VERSION)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(np.int64(0).tobytes())
+        self._counter = np.memmap(path, dtype=np.int64, mode='r+', shape=(1,))
+
+    def _bump(self):
+        """Báo cho các worker khác là kho vừa thay đổi (gọi trong lock())"""
+        self._counter[0] += 1
+        self._counter.flush()
+
+    def changed(self):
+        """Kiểm tra rẻ (đọc một số nguyên trên vùng nhớ dùng chung) xem có thay đổi chưa refresh"""
+        return self._counter is not None and int(self._counter[0]) != self._seen
+
+    @property
+    def version(self):
+        """Phiên bản dùng chung của kho, tăng sau mỗi lần ghi ở bất kỳ worker nào"""
+        return int(self._counter[0]) if self._counter is not None else 0
+
+    def vectors(self):
+        """Map (chỉ đọc) toàn bộ bản ghi đã refresh, kể cả bản ghi đã xóa"""
+        if self.n_records == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.n_records, self.dim))
+
+    def _write_manifest(self, generation):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'generation': generation, 'dim': self.dim}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_generation(self, generation, encodings, student_ids):
+        """Ghi một thế hệ đầy đủ (chỉ gồm bản ghi còn sống) ra file"""
+        vectors_path, ids_path, tombstones_path = self._paths(generation)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with open(vectors_path, 'wb') as f:
+            f.write(encodings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(ids_path, 'w', encoding='utf-8') as f:
+            f.writelines(f'{student_id}\n' for student_id in student_ids)
+            f.flush()
+            os.fsync(f.fileno())
+        open(tombstones_path, 'wb').close()
+
+    def open(self, legacy_pickle=None):
+        """Mở kho (tự chuyển đổi từ file pickle cũ nếu có)
+
+        Trả về (vectors, record_ids, tombstones): vectors là np.memmap chỉ đọc của
+        mọi bản ghi (không giải mã hay copy), record_ids là mã sinh viên theo số
+        thứ tự bản ghi và tombstones là tập bản ghi đã xóa.
+        """
+        with self.lock():
+            return self._open(legacy_pickle)
+
+    def _open(self, legacy_pickle):
+        if not self.exists():
+            encodings, student_ids = np.empty((0, self.dim), dtype=np.float32), []
+            if legacy_pickle and os.path.exists(legacy_pickle):
+                with open(legacy_pickle, 'rb') as f:
+                    data = pickle.load(f)
+                if len(data['student_ids']) > 0:
+                    encodings, student_ids = data['encodings'], list(data['student_ids'])
+            self._write_generation(0, encodings, student_ids)
+            self._write_manifest(0)
+            if legacy_pickle and os.path.exists(legacy_pickle):
+                os.replace(legacy_pickle, legacy_pickle + '.migrated')
+
+        if self._counter is None:
+            self._open_counter()
+        self._seen = int(self._counter[0])
+
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        self.generation = manifest['generation']
+        if manifest['dim'] != self.dim:
+            raise ValueError(f"Kho encoding có dim={manifest['dim']}, cần {self.dim}")
+
+        with open(self.ids_path, encoding='utf-8') as f:
+            student_ids = f.read().splitlines()
+        record_bytes = self.dim * 4
+        n_vectors = os.path.getsize(self.vectors_path) // record_bytes
+        # Ghi dở do crash: chỉ giữ các bản ghi có đủ cả vector và mã sinh viên
+        self.n_records = min(n_vectors, len(student_ids))
+        if os.path.getsize(self.vectors_path) != self.n_records * record_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self.n_records * record_bytes)
+        if len(student_ids) != self.n_records:
+            student_ids = student_ids[:self.n_records]
+            with open(self.ids_path, 'w', encoding='utf-8') as f:
+                f.writelines(f'{student_id}\n' for student_id in student_ids)
+        self._ids_offset = os.path.getsize(self.ids_path)
+
+        if os.path.exists(self.tombstones_path):
+            tombstones = np.fromfile(self.tombstones_path, dtype=np.int64)
+        else:
+            open(self.tombstones_path, 'wb').close()
+            tombstones = np.empty(0, dtype=np.int64)
+        self._tombstones_offset = len(tombstones) * 8
+        self.tombstones = {int(r) for r in tombstones if r < self.n_records}
+
+        self.record_ids = student_ids
+        self._record_of = {}
+        for record, student_id in enumerate(student_ids):
+            if record not in self.tombstones:
+                self._record_of.setdefault(student_id, []).append(record)
+
+        return self.vectors(), list(self.record_ids), set(self.tombstones)
+
+    def refresh(self):
+        """Đọc các thay đổi đã ghi xuống đĩa (bởi process này hoặc process khác) từ lần đọc trước
+
+        Trả về (bản ghi mới, bản ghi bị xóa), mỗi phần là danh sách (record, student_id),
+        hoặc None nếu kho đã compaction sang thế hệ khác và cần open() lại.
+        """
+        seen = int(self._counter[0])
+        try:
+            with open(self.manifest_path) as f:
+                if json.load(f)['generation'] != self.generation:
+                    return None
+            n_vectors = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            with open(self.ids_path, 'rb') as f:
+                f.seek(self._ids_offset)
+                ids_data = f.read()
+            with open(self.tombstones_path, 'rb') as f:
+                f.seek(self._tombstones_offset)
+                tombstones_data = f.read()
+        except FileNotFoundError:
+            # File của thế hệ cũ vừa bị compaction xóa
+            return None
+
+        # Chỉ nhận dòng trọn vẹn đã có đủ vector (vector luôn được ghi trước)
+        lines = ids_data[:ids_data.rfind(b'\n') + 1].splitlines(keepends=True)
+        added = []
+        for line in lines[:max(0, n_vectors - self.n_records)]:
+            student_id = line.decode('utf-8').rstrip('\r\n')
+            record = self.n_records
+            self.record_ids.append(student_id)
+            self._record_of.setdefault(student_id, []).append(record)
+            self.n_records += 1
+            self._ids_offset += len(line)
+            added.append((record, student_id))
+
+        removed = []
+        usable = len(tombstones_data) // 8 * 8
+        for record in np.frombuffer(tombstones_data[:usable], dtype=np.int64):
+            record = int(record)
+            if record >= self.n_records:
+                # Tombstone của bản ghi chưa đọc được: để lần refresh sau
+                break
+            self._tombstones_offset += 8
+            if record in self.tombstones:
+                continue
+            self.tombstones.add(record)
+            student_id = self.record_ids[record]
+            records = self._record_of.get(student_id, [])
+            if record in records:
+                records.remove(record)
+                if not records:
+                    del self._record_of[student_id]
+            removed.append((record, student_id))
+
+        self._seen = seen
+        return added, removed
+
+    def append(self, encoding, student_id):
+        """Ghi thêm một bản ghi vào cuối file (O(1) thay vì ghi lại toàn bộ)"""
+        self.append_many([encoding], [student_id])
+
+    def append_many(self, encodings, student_ids, replace=True):
+        """Ghi thêm nhiều bản ghi với một lần ghi và một lần fsync cho mỗi file
+
+        replace=True xóa các bản ghi cũ của cùng sinh viên (đăng ký lại),
+        replace=False giữ lại để thêm mẫu. Gọi trong lock() sau khi refresh để
+        biết các bản ghi cũ; bản ghi mới được nạp vào bộ nhớ ở lần refresh() tiếp theo.
+        """
+        with self.lock():
+            if replace:
+                for student_id in set(student_ids):
+                    self.remove(student_id)
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+            # Ghi vector trước, mã sinh viên sau: bản ghi chỉ hợp lệ khi cả hai đã xuống đĩa
+            with open(self.vectors_path, 'ab') as f:
+                f.write(encodings.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.ids_path, 'a', encoding='utf-8') as f:
+                f.writelines(f'{student_id}\n' for student_id in student_ids)
+                f.flush()
+                os.fsync(f.fileno())
+            self._bump()
+
+    def remove(self, student_id):
+        """Xóa mọi bản ghi của sinh viên bằng tombstone, không ghi lại file vector"""
+        return self.remove_records(self._record_of.get(student_id, []))
+
+    def remove_records(self, records):
+        """Ghi tombstone cho các bản ghi (ví dụ một mẫu cũ của sinh viên)"""
+        if not records:
+            return False
+        with self.lock():
+            with open(self.tombstones_path, 'ab') as f:
+                f.write(np.asarray(records, dtype=np.int64).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._bump()
+        return True
+
+    def needs_compaction(self):
+        return len(self.tombstones) >= max(self.compact_min, self.compact_ratio * self.n_records)
+
+    def compact(self, encodings, student_ids):
+        """Ghi lại các bản ghi còn sống sang thế hệ mới rồi đổi manifest nguyên tử (gọi trong lock())
+
+        Worker khác thấy thế hệ đổi sẽ open() lại; trên POSIX file cũ đã xóa vẫn
+        đọc được qua mmap cho tới khi được thay.
+        """
+        old_paths = self._paths(self.generation)
+        generation = self.generation + 1
+        self._write_generation(generation, encodings, student_ids)
+        self._write_manifest(generation)
+        self._bump()
+        self._seen = int(self._counter[0])
+        self.generation = generation
+        self.n_records = len(student_ids)
+        self.tombstones = set()
+        self.record_ids = list(student_ids)
+        self._record_of = {}
+        for record, student_id in enumerate(student_ids):
+            self._record_of.setdefault(student_id, []).append(record)
+        self._ids_offset = os.path.getsize(self.ids_path)
+        self._tombstones_offset = 0
+        for path in old_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def maybe_compact(self, encodings, student_ids):
+        if self.needs_compaction():
+            self.compact(encodings, student_ids)
+            return True
+        return False
@@ -0,0 +1,184 @@
+"""Đăng ký hàng loạt sinh viên từ thư mục/ZIP ảnh và file CSV thông tin
+
+Chạy từ thư mục gốc:
+    python -m utils.enrollment --csv students.csv --images photos.zip --workers 8
+
+CSV cần cột student_id, name; tùy chọn email, phone, class, image (tên file ảnh).
+Nếu không có cột image, ảnh được tìm theo tên file trùng mã sinh viên.
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from config import Config
+from utils.evidence import EvidenceWriter
+from utils.face_recognition import encode_face_file
+
+
+def read_metadata(csv_file):
+    """Đọc CSV (đường dẫn hoặc file-like) thành danh sách dict"""
+    if isinstance(csv_file, (str, os.PathLike)):
+        with open(csv_file, newline='', encoding='utf-8-sig') as f:
+            return list(csv.DictReader(f))
+    data = csv_file.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    return list(csv.DictReader(io.StringIO(data)))
+
+
+def _index_images(image_dir):
+    """Ánh xạ tên file và tên không đuôi -> đường dẫn cho mọi ảnh hợp lệ"""
+    images = {}
+    for root, _, files in os.walk(image_dir):
+        for name in files:
+            if '.' in name and name.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS:
+                path = os.path.join(root, name)
+                images.setdefault(name, path)
+                images.setdefault(os.path.splitext(name)[0], path)
+    return images
+
+
+def _encode_job(job):
+    image_path, model = job
+    try:
+        encoding, message = encode_face_file(image_path, model)
+    except Exception as e:
+        encoding, message = None, f"Lỗi đọc ảnh: {str(e)}"
+    return encoding, message
+
+
+def default_writer():
+    """EvidenceWriter với cấu hình giống app, để ảnh đăng ký hàng loạt được lưu như /register"""
+    return EvidenceWriter(Config.UPLOAD_FOLDER, max_edge=Config.EVIDENCE_MAX_EDGE,
+                          quality=Config.EVIDENCE_JPEG_QUALITY, face_size=Config.EVIDENCE_FACE_SIZE,
+                          face_margin=Config.EVIDENCE_FACE_MARGIN)
+
+
+def enroll_students(recognizer, db, rows, image_dir, workers=None, batch_size=None, writer=None):
+    """Đăng ký hàng loạt: encoding song song trên process pool, ghi DB theo lô
+
+    Ảnh gốc được encode lại qua writer.write (giống /register) thay vì chép nguyên file.
+    Trả về (report, stats): report là danh sách dict theo từng dòng CSV,
+    stats gồm tổng số ảnh, thời gian và số ảnh/giây (tổng và trên mỗi core).
+    """
+    workers = workers or Config.ENROLL_WORKERS or os.cpu_count() or 1
+    batch_size = batch_size or Config.ENROLL_BATCH_SIZE
+    writer = writer or default_writer()
+    images = _index_images(image_dir)
+    report = []
+    jobs = []
+    seen = set()
+    # Nhận cả sinh viên do worker khác vừa đăng ký
+    recognizer.sync()
+
+    for row in rows:
+        student_id = (row.get('student_id') or '').strip()
+        name = (row.get('name') or '').strip()
+        image_name = (row.get('image') or '').strip() or student_id
+        entry = {'student_id': student_id, 'file': image_name, 'success': False, 'message': ''}
+        report.append(entry)
+        if not student_id or not name:
+            entry['message'] = "Thiếu mã sinh viên hoặc họ tên"
+        elif student_id in seen:
+            entry['message'] = "Mã sinh viên bị trùng trong CSV"
+        elif student_id in recognizer.gallery:
+            entry['message'] = f"Mã sinh viên {student_id} đã được đăng ký"
+        elif image_name not in images:
+            entry['message'] = "Không tìm thấy file ảnh"
+        else:
+            seen.add(student_id)
+            jobs.append((entry, row, images[image_name]))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        encoded = list(pool.map(_encode_job, [(path, Config.FACE_DETECTION_MODEL) for _, _, path in jobs],
+                                chunksize=chunksize))
+    encode_seconds = time.perf_counter() - start
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    pending = []
+    for (entry, row, path), (encoding, message) in zip(jobs, encoded):
+        if encoding is None:
+            entry['message'] = message
+            continue
+        filename = secure_filename(f"{entry['student_id']}_{timestamp}.jpg")
+        pending.append((entry, encoding, path, {
+            'student_id': entry['student_id'],
+            'name': row['name'].strip(),
+            'email': row.get('email') or None,
+            'phone': row.get('phone') or None,
+            'class': row.get('class') or None,
+            'image_path': filename
+        }))
+
+    # Mỗi lô một transaction; encoding chỉ ghi vào kho một lần ở cuối
+    new_encodings, new_ids = [], []
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        results = db.add_students([student for _, _, _, student in batch])
+        for (entry, encoding, path, student), (_, success, message) in zip(batch, results):
+            entry['message'] = message
+            if not success:
+                continue
+            with open(path, 'rb') as f:
+                writer.write(student['image_path'], f.read())
+            entry['success'] = True
+            entry['message'] = "Đăng ký sinh viên thành công"
+            new_encodings.append(encoding)
+            new_ids.append(entry['student_id'])
+    recognizer.register_encodings(new_encodings, new_ids)
+
+    total_seconds = time.perf_counter() - start
+    stats = {
+        'total': len(report),
+        'succeeded': len(new_ids),
+        'failed': len(report) - len(new_ids),
+        'workers': workers,
+        'seconds': round(total_seconds, 3),
+        'images_per_sec': round(len(jobs) / encode_seconds, 2) if encode_seconds > 0 else 0.0,
+        'images_per_sec_per_core': round(len(jobs) / encode_seconds / workers, 2) if encode_seconds > 0 else 0.0
+    }
+    return report, stats
+
+
+def enroll_from_source(recognizer, db, csv_file, source, workers=None, batch_size=None, writer=None):
+    """Như enroll_students nhưng nhận thư mục ảnh hoặc file ZIP (đường dẫn hoặc file-like)"""
+    rows = read_metadata(csv_file)
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        return enroll_students(recognizer, db, rows, source, workers, batch_size, writer)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with zipfile.ZipFile(source) as archive:
+            archive.extractall(tmp_dir)
+        return enroll_students(recognizer, db, rows, tmp_dir, workers, batch_size, writer)
+
+
+def main():
+    from utils.database import Database
+    from utils.face_recognition import FaceRecognizer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', required=True, help='File CSV thông tin sinh viên')
+    parser.add_argument('--images', required=True, help='Thư mục hoặc file ZIP chứa ảnh')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    args = parser.parse_args()
+
+    Config.init_app()
+    report, stats = enroll_from_source(FaceRecognizer(), Database(), args.csv, args.images,
+                                       args.workers, args.batch_size)
+    for entry in report:
+        status = 'OK ' if entry['success'] else 'ERR'
+        print(f"{status} {entry['student_id']:<12} {entry['file']:<30} {entry['message']}")
+    print(f"Thành công {stats['succeeded']}/{stats['total']} trong {stats['seconds']}s, "
+          f"{stats['images_per_sec']} ảnh/s ({stats['images_per_sec_per_core']} ảnh/s/core, {stats['workers']} core)")
+
+
+if __name__ == '__main__':
+    main()
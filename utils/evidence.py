@@ -0,0 +1,155 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from werkzeug.utils import secure_filename
+from utils.database import vietnam_now
+from utils.metrics import BACKGROUND_ERRORS, timed
+from utils.preprocess import load_image_bytes
+
+FACE_SUFFIX = '.face_'
+
+
+def evidence_name(prefix, when=None):
+    """Đường dẫn tương đối (lưu vào image_path) cho ảnh minh chứng mới
+
+    Ảnh được chia thư mục theo ngày (YYYY/MM/DD) để thư mục upload không phình
+    thành một danh sách phẳng; ngày tính theo giờ Việt Nam giống check_in_date nên
+    ảnh chụp quanh nửa đêm nằm cùng ngày với lượt điểm danh. Tên gồm thời gian tới
+    micro giây và một chuỗi ngẫu nhiên nên hai request đồng thời không bao giờ trùng tên.
+    """
+    when = when or vietnam_now()
+    name = secure_filename(f"{prefix}_{when.strftime('%H%M%S%f')}_{uuid.uuid4().hex[:12]}.jpg")
+    return f"{when.strftime('%Y/%m/%d')}/{name}"
+
+
+def face_crop_name(filename, label):
+    """Tên ảnh cắt khuôn mặt của label (ví dụ student_id) đi kèm ảnh minh chứng filename"""
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}{FACE_SUFFIX}{secure_filename(str(label))}.jpg"
+
+
+def evidence_owner(filename):
+    """Ảnh minh chứng gốc của một ảnh cắt khuôn mặt (chính nó nếu không phải ảnh cắt)"""
+    stem, sep, _ = filename.rpartition(FACE_SUFFIX)
+    return f"{stem}.jpg" if sep else filename
+
+
+def _fit(image, max_edge):
+    long_edge = max(image.shape[:2])
+    if not max_edge or long_edge <= max_edge:
+        return image
+    factor = max_edge / long_edge
+    return cv2.resize(image, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def crop_face(image, box, margin=0.3, size=160):
+    """Cắt vùng vuông quanh khung (top, right, bottom, left), thêm lề margin, thu về tối đa size px"""
+    top, right, bottom, left = box
+    height, width = image.shape[:2]
+    side = max(bottom - top, right - left) * (1 + 2 * margin)
+    center_y, center_x = (top + bottom) / 2, (left + right) / 2
+    y0, y1 = max(0, int(center_y - side / 2)), min(height, int(center_y + side / 2))
+    x0, x1 = max(0, int(center_x - side / 2)), min(width, int(center_x + side / 2))
+    if y1 <= y0 or x1 <= x0:
+        return None
+    return _fit(image[y0:y1, x0:x1], size)
+
+
+class EvidenceWriter:
+    """Ghi ảnh minh chứng điểm danh xuống đĩa trên một thread nền
+
+    Request chỉ giữ ảnh trong bộ nhớ; ảnh được ghi khi điểm danh thực sự thành
+    công nên không còn vòng ghi - đọc lại - xóa file cho ảnh không nhận diện được.
+    image có thể là bytes của file gốc hoặc frame BGR. Ảnh được encode lại thành
+    JPEG có cạnh dài tối đa max_edge, kèm một ảnh cắt nhỏ cho mỗi khuôn mặt cần giữ.
+    """
+
+    def __init__(self, directory, workers=1, max_edge=1280, quality=80, face_size=160, face_margin=0.3):
+        self.directory = directory
+        self.max_edge = max_edge
+        self.quality = quality
+        self.face_size = face_size
+        self.face_margin = face_margin
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='evidence')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+        self.bytes_written = 0
+
+    def save(self, filename, image, faces=(), source_max_edge=None):
+        """Đưa ảnh vào hàng đợi ghi, trả về Future
+
+        faces: danh sách (label, (top, right, bottom, left)) cần cắt riêng, theo tọa độ
+        của ảnh đã giải mã với cạnh dài source_max_edge (giống bước encoding);
+        với frame webcam là tọa độ của chính frame.
+        """
+        with self._lock:
+            self.pending += 1
+        return self.executor.submit(self._write, filename, image, list(faces), source_max_edge)
+
+    def encode(self, image):
+        """Thu nhỏ về max_edge và encode JPEG, trả về bytes"""
+        ok, buffer = cv2.imencode('.jpg', _fit(image, self.max_edge), [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError('Không thể encode ảnh JPEG')
+        return buffer.tobytes()
+
+    def write_file(self, filename, data):
+        """Ghi ra file tạm rồi đổi tên để không ai đọc được ảnh ghi dở, trả về số byte"""
+        path = os.path.join(self.directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    @timed('evidence_write')
+    def write(self, filename, image, faces=(), source_max_edge=None):
+        """Encode và ghi ngay trên thread gọi, trả về số byte; lỗi được ném ra cho người gọi
+
+        Dùng cho ảnh đăng ký sinh viên: file phải nằm trên đĩa trước khi trả lời
+        request, nếu không một lệnh xóa sinh viên ngay sau đó sẽ để sót file.
+        """
+        if isinstance(image, np.ndarray):
+            bgr = image
+        else:
+            # Giải mã giống bước encoding (xoay theo EXIF, cùng giới hạn cạnh) để khung mặt khớp tọa độ;
+            # không có khuôn mặt cần cắt thì giải mã thẳng ở kích thước lưu
+            prepared = load_image_bytes(bytes(image), detect_max_edge=None,
+                                        encode_max_edge=source_max_edge or self.max_edge)
+            bgr = cv2.cvtColor(prepared.rgb, cv2.COLOR_RGB2BGR)
+        written = self.write_file(filename, self.encode(bgr))
+        for label, box in faces:
+            face = crop_face(bgr, box, self.face_margin, self.face_size)
+            if face is not None:
+                written += self.write_file(face_crop_name(filename, label), self.encode(face))
+        with self._lock:
+            self.written += 1
+            self.bytes_written += written
+        return written
+
+    def _write(self, filename, image, faces, source_max_edge):
+        try:
+            self.write(filename, image, faces, source_max_edge)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+                self.last_error = f"{filename}: {e}"
+            BACKGROUND_ERRORS.inc(label_value='evidence_write')
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self.pending, 'written': self.written, 'failed': self.failed,
+                    'last_error': self.last_error, 'bytes_written': self.bytes_written}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,343 @@
+import os
+import pickle
+import numpy as np
+from utils.gallery import FaceGallery, MappedGallery
+
+
+class ExactIndex:
+    """Quét toàn bộ gallery (brute force) - kết quả chuẩn để so sánh"""
+
+    name = 'exact'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def add(self, encodings, student_ids):
+        pass
+
+    def remove(self, student_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, probes, k=1):
+        return self.gallery.search_ids(probes, k)
+
+    def save(self, path, version=None):
+        pass
+
+    def load(self, path, version=None):
+        return True
+
+
+def kmeans(data, n_clusters, n_iter=15, seed=0):
+    """K-means (Lloyd) thuần NumPy, khởi tạo bằng cách chọn ngẫu nhiên các điểm"""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    data_sq = np.einsum('ij,ij->i', data, data)
+    for _ in range(n_iter):
+        cent_sq = np.einsum('ij,ij->i', centroids, centroids)
+        dists = data_sq[:, None] + cent_sq[None, :] - 2.0 * (data @ centroids.T)
+        assign = np.argmin(dists, axis=1)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # Cụm rỗng: lấy lại một điểm ngẫu nhiên
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted file index: chia gallery thành các cụm k-means, chỉ quét nprobe cụm gần nhất"""
+
+    name = 'ivf'
+
+    def __init__(self, gallery, n_lists=None, n_probe=8, min_train_size=1000):
+        self.gallery = gallery
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.centroids = None
+        self.lists = []
+        self.list_of = {}
+        self.trained_size = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _auto_n_lists(self, size):
+        return self.n_lists or max(1, int(4 * np.sqrt(size)))
+
+    def _assign(self, encodings):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.gallery.dim)
+        cent_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        dists = cent_sq[None, :] - 2.0 * (encodings @ self.centroids.T)
+        return np.argmin(dists, axis=1)
+
+    def _fill_lists(self, student_ids, encodings, assign):
+        self.lists = [FaceGallery(dim=self.gallery.dim, initial_capacity=16) for _ in range(len(self.centroids))]
+        self.list_of = {}
+        for list_no in np.unique(assign):
+            rows = np.flatnonzero(assign == list_no)
+            ids = [student_ids[i] for i in rows]
+            self.lists[list_no].add_many(encodings[rows], ids)
+            for student_id in ids:
+                self.list_of[student_id] = int(list_no)
+
+    def rebuild(self):
+        """Huấn luyện lại các centroid từ toàn bộ gallery"""
+        size = len(self.gallery)
+        if size == 0 or size < self.min_train_size:
+            self.centroids = None
+            self.lists = []
+            self.list_of = {}
+            self.trained_size = 0
+            return
+        encodings, student_ids = self.gallery.live()
+        self.centroids = kmeans(encodings, min(self._auto_n_lists(size), size))
+        self._fill_lists(student_ids, encodings, self._assign(encodings))
+        self.trained_size = size
+
+    def add(self, encodings, student_ids):
+        """Chèn tăng dần vào cụm gần nhất; huấn luyện lại khi gallery tăng gấp đôi"""
+        size = len(self.gallery)
+        if not self.is_trained or size >= 2 * self.trained_size:
+            self.rebuild()
+            return
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.gallery.dim)
+        for encoding, student_id, list_no in zip(encodings, student_ids, self._assign(encodings)):
+            self.lists[list_no].add(encoding, student_id)
+            self.list_of[student_id] = int(list_no)
+
+    def remove(self, student_id):
+        list_no = self.list_of.pop(student_id, None)
+        if list_no is not None:
+            self.lists[list_no].remove(student_id)
+
+    def search(self, probes, k=1):
+        if not self.is_trained:
+            return self.gallery.search_ids(probes, k)
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.gallery.dim)
+        n_probe = min(self.n_probe, len(self.centroids))
+        cent_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        coarse = cent_sq[None, :] - 2.0 * (probes @ self.centroids.T)
+        probed = np.argpartition(coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+        result_ids, result_dists = [], []
+        for probe, lists in zip(probes, probed):
+            # Ghép các cụm được quét thành một ma trận ứng viên rồi tính khoảng cách một lần
+            galleries = [self.lists[list_no] for list_no in lists if len(self.lists[list_no])]
+            if not galleries:
+                result_ids.append([])
+                result_dists.append(np.empty(0, dtype=np.float32))
+                continue
+            matrix = np.concatenate([g.matrix for g in galleries])
+            sq_norms = np.concatenate([g.sq_norms for g in galleries])
+            sq = sq_norms - 2.0 * (matrix @ probe) + probe @ probe
+            kk = min(k, len(sq))
+            top = np.argpartition(sq, kk - 1)[:kk]
+            top = top[np.argsort(sq[top])]
+            ids = [sid for g in galleries for sid in g.student_ids]
+            result_ids.append([ids[i] for i in top])
+            result_dists.append(np.sqrt(np.maximum(sq[top], 0.0)))
+        return result_ids, result_dists
+
+    def save(self, path, version=None):
+        """Lưu centroid và phân cụm (vector vẫn nằm trong gallery) kèm phiên bản kho encoding"""
+        _save(path, {
+            'centroids': self.centroids,
+            'list_of': self.list_of,
+            'trained_size': self.trained_size,
+            'version': version
+        })
+
+    def load(self, path, version=None):
+        """Khôi phục index đã lưu; trả về False nếu đã cũ (kho đổi phiên bản) hoặc không khớp gallery
+
+        Chỉ so tập mã sinh viên là chưa đủ: đăng ký lại một mã đã có đổi encoding
+        mà không đổi tập mã, nên index chỉ được tin khi phiên bản kho trùng khớp.
+        """
+        data = _load(path)
+        if data is None or data.get('version') != version or 'list_of' not in data:
+            return False
+        encodings, student_ids = self.gallery.live()
+        if data['centroids'] is None or set(data['list_of']) != set(student_ids):
+            return False
+        self.centroids = data['centroids']
+        self.trained_size = data['trained_size']
+        assign = np.array([data['list_of'][student_id] for student_id in student_ids])
+        self._fill_lists(student_ids, encodings, assign)
+        return True
+
+
+class ExactSampleIndex:
+    """Best-of-K trên mọi mẫu của MappedGallery (quét toàn bộ rồi gộp theo sinh viên)"""
+
+    name = 'exact'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def extend(self, records):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, probes, k=1):
+        return self.gallery.search_students(probes, k)
+
+    def save(self, path, version=None):
+        pass
+
+    def load(self, path, version=None):
+        return True
+
+
+class IVFSampleIndex:
+    """IVF trên từng mẫu của MappedGallery, sau đó gộp best-of-K theo sinh viên
+
+    Mỗi cụm chỉ giữ số thứ tự bản ghi; vector của các cụm được quét đọc thẳng từ
+    ma trận mmap dùng chung, nên mỗi worker chỉ giữ riêng centroid các cụm và một
+    số nguyên cho mỗi bản ghi. Bản ghi đã xóa vẫn nằm trong cụm tới lần huấn
+    luyện lại nhưng bị bỏ qua khi gộp (nhãn -1).
+    """
+
+    name = 'ivf'
+
+    def __init__(self, gallery, n_lists=None, n_probe=8, min_train_size=1000):
+        self.gallery = gallery
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.centroids = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.lists = []
+        self.trained_size = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _assign(self, records):
+        vectors = np.asarray(self.gallery.matrix[records], dtype=np.float32)
+        cent_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        return np.argmin(cent_sq[None, :] - 2.0 * (vectors @ self.centroids.T), axis=1).astype(np.int32)
+
+    def _fill_lists(self):
+        records = np.flatnonzero(self.assign >= 0)
+        order = np.argsort(self.assign[records], kind='stable')
+        bounds = np.searchsorted(self.assign[records][order], np.arange(len(self.centroids) + 1))
+        self.lists = [records[order[bounds[i]:bounds[i + 1]]] for i in range(len(self.centroids))]
+
+    def rebuild(self):
+        """Huấn luyện lại các centroid từ mọi mẫu còn sống"""
+        size = len(self.gallery)
+        self.assign = np.full(self.gallery.n_rows, -1, dtype=np.int32)
+        if size == 0 or size < self.min_train_size:
+            self.centroids = None
+            self.lists = []
+            self.trained_size = 0
+            return
+        records = self.gallery.live_records()
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(size)))
+        self.centroids = kmeans(np.asarray(self.gallery.matrix[records]), min(n_lists, size))
+        self.assign[records] = self._assign(records)
+        self._fill_lists()
+        self.trained_size = size
+
+    def extend(self, records):
+        """Xếp các bản ghi mới vào cụm gần nhất; huấn luyện lại khi số mẫu tăng gấp đôi"""
+        if not self.is_trained or len(self.gallery) >= 2 * self.trained_size:
+            self.rebuild()
+            return
+        records = np.asarray(records, dtype=np.int64)
+        assign = np.full(self.gallery.n_rows, -1, dtype=np.int32)
+        assign[:len(self.assign)] = self.assign
+        self.assign = assign
+        if len(records) == 0:
+            return
+        new_lists = self._assign(records)
+        self.assign[records] = new_lists
+        for list_no in np.unique(new_lists):
+            self.lists[list_no] = np.concatenate([self.lists[list_no], records[new_lists == list_no]])
+
+    def search(self, probes, k=1):
+        if not self.is_trained:
+            return self.gallery.search_students(probes, k)
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.gallery.dim)
+        n_probe = min(self.n_probe, len(self.centroids))
+        cent_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        coarse = cent_sq[None, :] - 2.0 * (probes @ self.centroids.T)
+        probed = np.argpartition(coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+        sq_norms = self.gallery.sq_norms
+        result_ids, result_dists = [], []
+        for probe, lists in zip(probes, probed):
+            records = np.concatenate([self.lists[list_no] for list_no in lists])
+            if len(records) == 0:
+                result_ids.append([])
+                result_dists.append(np.empty(0, dtype=np.float32))
+                continue
+            vectors = np.asarray(self.gallery.matrix[records], dtype=np.float32)
+            sq = sq_norms[records] - 2.0 * (vectors @ probe) + probe @ probe
+            ids, dists = self.gallery.best_per_student(records, sq, k)
+            result_ids.append(ids)
+            result_dists.append(dists)
+        return result_ids, result_dists
+
+    def save(self, path, version=None):
+        """Lưu centroid và cụm của từng bản ghi kèm phiên bản kho encoding"""
+        _save(path, {
+            'centroids': self.centroids,
+            'assign': self.assign,
+            'trained_size': self.trained_size,
+            'version': version
+        })
+
+    def load(self, path, version=None):
+        """Khôi phục index đã lưu; trả về False nếu kho đã đổi phiên bản (số thứ tự bản ghi không còn đúng)"""
+        data = _load(path)
+        if (data is None or data.get('version') != version or data.get('centroids') is None
+                or len(data.get('assign', ())) != self.gallery.n_rows):
+            return False
+        self.centroids = data['centroids']
+        self.assign = data['assign']
+        self.trained_size = data['trained_size']
+        self._fill_lists()
+        return True
+
+
+def _save(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def create_index(backend, gallery, **kwargs):
+    """Tạo index theo tên backend trong Config.FACE_INDEX_BACKEND
+
+    Với MappedGallery (nhiều mẫu mỗi sinh viên) index làm việc trên từng mẫu và
+    trả về sinh viên theo best-of-K; với FaceGallery (một hàng mỗi sinh viên, ví dụ
+    centroid) index trả về thẳng các hàng gần nhất.
+    """
+    if backend not in ('ivf', 'exact'):
+        raise ValueError(f"Không hỗ trợ index backend: {backend}")
+    if isinstance(gallery, MappedGallery):
+        return IVFSampleIndex(gallery, **kwargs) if backend == 'ivf' else ExactSampleIndex(gallery)
+    return IVFIndex(gallery, **kwargs) if backend == 'ivf' else ExactIndex(gallery)
@@ -1,109 +1,491 @@
+import dlib
 import face_recognition
-import cv2
+import logging
 import numpy as np
-import pickle
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from config import Config
+from utils.gallery import FaceGallery, MappedGallery, student_centroids
+from utils.face_index import create_index
+from utils.encoding_store import EncodingStore
+from utils.preprocess import load_image, load_image_bytes, prepare_frame
+from utils.tiling import detect_tiled, merge_boxes
+from utils.batching import BatchScheduler
+from utils.metrics import timed, observe_faces
+
+logger = logging.getLogger(__name__)
+# Tắt đường encoding theo lô sau lần lỗi đầu tiên (API nội bộ của face_recognition/dlib không ổn định)
+_batch_encoding_supported = True
+
+_tile_executor = None
+
+@timed('decode')
+def prepare_image(source, detect_max_edge=None, encode_max_edge=None):
+    """Đưa ảnh qua bước tiền xử lý chung (giải mã thu nhỏ, EXIF, giới hạn cạnh dài)
+    
+    source có thể là đường dẫn file, bytes của file ảnh (upload trong bộ nhớ)
+    hoặc frame BGR (ndarray) từ webcam. Mặc định dùng giới hạn trong Config.
+    """
+    detect_max_edge = detect_max_edge or Config.DETECTION_MAX_EDGE
+    encode_max_edge = encode_max_edge or Config.ENCODING_MAX_EDGE
+    if isinstance(source, np.ndarray):
+        return prepare_frame(source, detect_max_edge)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return load_image_bytes(bytes(source),
+                                detect_max_edge=detect_max_edge,
+                                encode_max_edge=encode_max_edge)
+    return load_image(source,
+                      detect_max_edge=detect_max_edge,
+                      encode_max_edge=encode_max_edge)
+
+@timed('detect')
+def detect_faces(prepared, model='hog'):
+    """Phát hiện trên ảnh nhỏ, trả về khung theo tọa độ ảnh encoding"""
+    return prepared.to_full(face_recognition.face_locations(prepared.detect_rgb, model=model))
+
+def encode_face_file(source, model='hog'):
+    """Đọc ảnh (đường dẫn, bytes hoặc frame), phát hiện đúng một khuôn mặt và tạo encoding
+    
+    Hàm cấp module để có thể chạy trong process pool. Trả về (encoding, None)
+    hoặc (None, thông báo lỗi).
+    """
+    # Đọc ảnh
+    prepared = prepare_image(source)
+    
+    # Tìm vị trí khuôn mặt
+    face_locations = detect_faces(prepared, model)
+    
+    if len(face_locations) == 0:
+        return None, "Không tìm thấy khuôn mặt trong ảnh"
+    
+    if len(face_locations) > 1:
+        return None, "Phát hiện nhiều hơn 1 khuôn mặt trong ảnh"
+    
+    # Tạo encoding trên ảnh độ phân giải cao hơn
+    with timed('encode'):
+        face_encodings = face_recognition.face_encodings(prepared.rgb, face_locations)
+    
+    if len(face_encodings) == 0:
+        return None, "Không thể tạo encoding cho khuôn mặt"
+    
+    return face_encodings[0], None
+
+def detect_and_encode(source, model='hog'):
+    """Đọc ảnh (đường dẫn, bytes hoặc frame), tìm mọi khuôn mặt và tạo encoding, trả về (face_locations, face_encodings)"""
+    prepared = prepare_image(source)
+    face_locations = detect_faces(prepared, model)
+    observe_faces(len(face_locations))
+    if len(face_locations) == 0:
+        return [], []
+    with timed('encode'):
+        return face_locations, face_recognition.face_encodings(prepared.rgb, face_locations)
+
+def batch_face_locations(images, model='hog'):
+    """Phát hiện trên nhiều ảnh cùng lúc, trả về danh sách khung theo thứ tự ảnh
+    
+    Với cnn dùng face_recognition.batch_face_locations (một lần chạy mạng cho cả
+    lô). Lô cnn yêu cầu ảnh cùng kích thước nên ảnh được nhóm theo cạnh dài
+    (frame webcam một nhóm, ảnh upload một nhóm) và đệm 0 ở phải/dưới tới kích
+    thước lớn nhất của nhóm; đệm không làm đổi tọa độ. HOG không có bản theo lô.
+    """
+    if model != 'cnn':
+        return [face_recognition.face_locations(image, model=model) for image in images]
+    
+    results = [None] * len(images)
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(max(image.shape[:2]), []).append(i)
+    for indices in groups.values():
+        height = max(images[i].shape[0] for i in indices)
+        width = max(images[i].shape[1] for i in indices)
+        canvases = []
+        for i in indices:
+            canvas = np.zeros((height, width, 3), dtype=np.uint8)
+            canvas[:images[i].shape[0], :images[i].shape[1]] = images[i]
+            canvases.append(canvas)
+        found = face_recognition.batch_face_locations(canvases, batch_size=len(canvases))
+        for i, face_locations in zip(indices, found):
+            image_height, image_width = images[i].shape[:2]
+            results[i] = [(top, min(right, image_width), min(bottom, image_height), left)
+                          for top, right, bottom, left in face_locations
+                          if top < image_height and left < image_width]
+    return results
+
+def batch_face_encodings(images, locations_list):
+    """Encoding mọi khuôn mặt của nhiều ảnh trong một lần gọi dlib
+    
+    Dùng cùng landmark (model 'small') và num_jitters=1 như face_recognition.face_encodings
+    nên kết quả giống đường từng ảnh. Đường theo lô dựa vào API nội bộ của face_recognition
+    và dlib; khi lỗi bất kỳ (thiếu hàm, sai chữ ký, RuntimeError của dlib, số kết quả lệch)
+    thì encoding từng ảnh bằng API công khai và không thử lại đường theo lô nữa.
+    """
+    global _batch_encoding_supported
+    results = [[] for _ in images]
+    pending = [i for i, face_locations in enumerate(locations_list) if face_locations]
+    if not pending:
+        return results
+    if _batch_encoding_supported:
+        try:
+            landmarks = [dlib.full_object_detections(
+                             face_recognition.api._raw_face_landmarks(images[i], locations_list[i], model='small'))
+                         for i in pending]
+            descriptors = face_recognition.api.face_encoder.compute_face_descriptor(
+                [images[i] for i in pending], landmarks, 1)
+            batch = [[np.array(descriptor) for descriptor in image_descriptors] for image_descriptors in descriptors]
+            if len(batch) != len(pending) or any(len(batch[n]) != len(locations_list[i])
+                                                 for n, i in enumerate(pending)):
+                raise ValueError('Số encoding trả về không khớp số khuôn mặt')
+            for i, face_encodings in zip(pending, batch):
+                results[i] = face_encodings
+            return results
+        except Exception as e:
+            _batch_encoding_supported = False
+            logger.warning("Encoding theo lô không dùng được (%s), chuyển sang encoding từng ảnh", e)
+    for i in pending:
+        results[i] = face_recognition.face_encodings(images[i], locations_list[i])
+    return results
+
+def detect_and_encode_batch(items, model='hog'):
+    """Xử lý một micro-batch: items là danh sách (PreparedImage, cần encoding hay không)
+    
+    Trả về (face_locations, face_encodings) cho từng item, khung theo tọa độ ảnh encoding.
+    """
+    with timed('batch_detect'):
+        detected = batch_face_locations([prepared.detect_rgb for prepared, _ in items], model)
+    locations = [prepared.to_full(face_locations) for (prepared, _), face_locations in zip(items, detected)]
+    wanted = [i for i, (_, encode) in enumerate(items) if encode]
+    for i in wanted:
+        observe_faces(len(locations[i]))
+    with timed('batch_encode'):
+        encodings = batch_face_encodings([items[i][0].rgb for i in wanted], [locations[i] for i in wanted])
+    results = [(face_locations, []) for face_locations in locations]
+    for i, face_encodings in zip(wanted, encodings):
+        results[i] = (locations[i], face_encodings)
+    return results
+
+def tile_executor():
+    """Process pool dùng chung cho phát hiện theo ô (tạo khi cần lần đầu)"""
+    global _tile_executor
+    if _tile_executor is None:
+        _tile_executor = ProcessPoolExecutor(max_workers=Config.CLASSROOM_WORKERS)
+    return _tile_executor
+
+def detect_and_encode_classroom(source, model='hog', executor=None):
+    """Chế độ lớp học: phát hiện theo ô chồng lấn ở gần độ phân giải gốc
+    
+    Các ô được phát hiện song song trên process pool, khung trùng ở đường nối
+    được gộp bằng NMS rồi encoding tất cả trong một lần gọi. Trả về
+    (face_locations, face_encodings, timings) với timings là thời gian (ms)
+    từng bước và số ô / số khung.
+    """
+    timings = {}
+    start = time.perf_counter()
+    prepared = prepare_image(source, Config.CLASSROOM_MAX_EDGE, Config.CLASSROOM_MAX_EDGE)
+    timings['decode_ms'] = (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    boxes, timings['tiles'] = detect_tiled(prepared.rgb, model,
+                                           tile_size=Config.CLASSROOM_TILE_SIZE,
+                                           overlap=Config.CLASSROOM_TILE_OVERLAP,
+                                           upsample=Config.CLASSROOM_UPSAMPLE,
+                                           executor=executor or tile_executor())
+    timings['detect_ms'] = (time.perf_counter() - start) * 1000
+    timings['raw_boxes'] = len(boxes)
+    
+    start = time.perf_counter()
+    face_locations = merge_boxes(boxes, Config.CLASSROOM_NMS_THRESHOLD)
+    timings['merge_ms'] = (time.perf_counter() - start) * 1000
+    timings['faces'] = len(face_locations)
+    observe_faces(len(face_locations))
+    
+    start = time.perf_counter()
+    face_encodings = face_recognition.face_encodings(prepared.rgb, face_locations) if face_locations else []
+    timings['encode_ms'] = (time.perf_counter() - start) * 1000
+    
+    timings = {key: round(value, 1) if isinstance(value, float) else value for key, value in timings.items()}
+    return face_locations, face_encodings, timings
 
 class FaceRecognizer:
     def __init__(self):
-        self.known_face_encodings = []
-        self.known_student_ids = []
+        # Ma trận mọi mẫu encoding map thẳng từ kho dùng chung, một bản cho mọi worker
+        self.gallery = MappedGallery()
+        # Chế độ 'centroid': một centroid cho mỗi sinh viên, chi phí so khớp tăng theo số sinh
+        # viên thay vì số mẫu, nhưng ma trận centroid là bản riêng của từng process.
+        # Mặc định ('best'): index chạy thẳng trên các mẫu trong ma trận mmap dùng chung
+        # (IVF chỉ giữ số thứ tự bản ghi) rồi gộp best-of-K theo sinh viên.
+        self.centroids = FaceGallery() if Config.FACE_MATCH_MODE == 'centroid' else None
         self.encodings_file = os.path.join(Config.MODELS_PATH, 'face_encodings.pkl')
+        self.store = EncodingStore(Config.MODELS_PATH,
+                                   compact_ratio=Config.FACE_STORE_COMPACT_RATIO,
+                                   compact_min=Config.FACE_STORE_COMPACT_MIN)
+        self.index_file = os.path.join(Config.MODELS_PATH, 'face_index.pkl')
+        self.index = self._create_index()
+        self.batcher = None
+        if Config.DETECTION_BATCHING:
+            # Ảnh upload và frame webcam đến đồng thời được gom thành micro-batch
+            self.batcher = BatchScheduler(
+                lambda items: detect_and_encode_batch(items, Config.FACE_DETECTION_MODEL),
+                max_batch_size=Config.DETECTION_BATCH_SIZE,
+                max_wait=Config.DETECTION_BATCH_WAIT_MS / 1000)
         self.load_encodings()
     
+    def _create_index(self):
+        gallery = self.gallery if self.centroids is None else self.centroids
+        return create_index(Config.FACE_INDEX_BACKEND, gallery,
+                            n_lists=Config.FACE_INDEX_N_LISTS,
+                            n_probe=Config.FACE_INDEX_N_PROBE,
+                            min_train_size=Config.FACE_INDEX_MIN_TRAIN_SIZE)
+    
+    @property
+    def known_student_ids(self):
+        self.sync()
+        if self.centroids is None:
+            return self.gallery.live()[1]
+        return self.centroids.student_ids
+    
+    @property
+    def known_face_encodings(self):
+        """Encoding dùng để so khớp (mọi mẫu, hoặc centroid từng sinh viên), cùng thứ tự với known_student_ids"""
+        self.sync()
+        if self.centroids is None:
+            return self.gallery.live()[0]
+        return self.centroids.matrix
+    
     def load_encodings(self):
-        """Load dữ liệu encoding đã lưu"""
-        if os.path.exists(self.encodings_file):
-            with open(self.encodings_file, 'rb') as f:
-                data = pickle.load(f)
-                self.known_face_encodings = data['encodings']
-                self.known_student_ids = data['student_ids']
+        """Map kho encoding dùng chung và dựng index"""
+        with self.store.lock():
+            # Lần đầu chạy sẽ chuyển face_encodings.pkl cũ sang kho nhị phân
+            vectors, record_ids, tombstones = self.store.open(legacy_pickle=self.encodings_file)
+            self.gallery.attach(vectors, record_ids, tombstones)
+            if self.store.needs_compaction():
+                self._compact(reindex=False)
+            if self.centroids is not None:
+                self.centroids.clear()
+                encodings, record_ids = self.gallery.live()
+                student_ids, centroids = student_centroids(encodings, record_ids,
+                                                           outlier_distance=Config.FACE_OUTLIER_DISTANCE)
+                self.centroids.add_many(centroids, student_ids)
+            
+            # Dùng lại index đã lưu nếu được lưu ở đúng phiên bản kho hiện tại, nếu không thì xây lại
+            if not self.index.load(self.index_file, self.store.version):
+                self.index.rebuild()
+                self.index.save(self.index_file, self.store.version)
+    
+    def _compact(self, reindex=True):
+        """Ghi thế hệ kho mới chỉ gồm bản ghi còn sống và map lại gallery (gọi trong store.lock())"""
+        encodings, student_ids = self.gallery.live()
+        self.store.compact(encodings, student_ids)
+        self.gallery.attach(self.store.vectors(), self.store.record_ids)
+        if reindex and self.centroids is None:
+            # Index theo mẫu lưu số thứ tự bản ghi, đã đổi sau compaction
+            self.index.rebuild()
+
+    @property
+    def gallery_version(self):
+        """Phiên bản gallery dùng chung giữa các worker (đổi khi đăng ký, xóa hoặc thêm mẫu)"""
+        return self.store.version
+
+    def sync(self):
+        """Áp dụng các thêm/xóa do worker khác ghi vào kho
+        
+        Gọi ở mỗi request: khi không có thay đổi chỉ tốn một lần đọc bộ đếm phiên
+        bản dùng chung. Khi có thay đổi chỉ đọc phần ghi thêm, không đọc lại cả kho.
+        """
+        if not self.store.changed():
+            return False
+        with self.store.lock(), timed('gallery_sync'):
+            changes = self.store.refresh()
+            if changes is None:
+                # Worker khác đã compaction: map lại thế hệ mới
+                self.load_encodings()
+                return True
+            added, removed = changes
+            if added:
+                self.gallery.extend(self.store.vectors(), [student_id for _, student_id in added],
+                                    self.store.tombstones)
+                if self.centroids is None:
+                    self.index.extend([record for record, _ in added])
+            for record, _ in removed:
+                self.gallery.kill(record)
+            self._update_centroids({student_id for _, student_id in added + removed})
+        return True
+    
+    def _update_centroids(self, student_ids):
+        """Tính lại centroid (và vị trí trong index) của các sinh viên vừa thay đổi mẫu"""
+        if self.centroids is None:
+            return
+        for student_id in student_ids:
+            self.centroids.remove(student_id)
+            self.index.remove(student_id)
+            records = self.gallery.records_of(student_id)
+            if not records:
+                continue
+            ids, centroid = student_centroids(self.gallery.matrix[records], [student_id] * len(records),
+                                              outlier_distance=Config.FACE_OUTLIER_DISTANCE)
+            self.centroids.add_many(centroid, ids)
+            self.index.add(centroid, ids)
     
     def save_encodings(self):
-        """Lưu dữ liệu encoding"""
-        data = {
-            'encodings': self.known_face_encodings,
-            'student_ids': self.known_student_ids
-        }
-        with open(self.encodings_file, 'wb') as f:
-            pickle.dump(data, f)
-    
-    def register_face(self, image_path, student_id):
-        """Đăng ký khuôn mặt mới"""
-        # Đọc ảnh
-        image = face_recognition.load_image_file(image_path)
-        
-        # Tìm vị trí khuôn mặt
-        face_locations = face_recognition.face_locations(image, model=Config.FACE_DETECTION_MODEL)
+        """Lưu index và compaction kho encoding khi có nhiều bản ghi đã xóa
         
-        if len(face_locations) == 0:
-            return False, "Không tìm thấy khuôn mặt trong ảnh"
+        Bản thân encoding đã được ghi nối tiếp ngay khi đăng ký/xóa.
+        """
+        with self.store.lock():
+            self.sync()
+            if self.store.needs_compaction():
+                self._compact()
+            self.index.save(self.index_file, self.store.version)
+    
+    @timed('match')
+    def match_encodings(self, face_encodings, k=1):
+        """So khớp tất cả encoding của một ảnh trong một lần tính khoảng cách
         
-        if len(face_locations) > 1:
-            return False, "Phát hiện nhiều hơn 1 khuôn mặt trong ảnh"
+        Trả về danh sách (theo từng khuôn mặt) các cặp (student_id, distance), tối đa k cặp.
+        """
+        self.sync()
+        if len(face_encodings) == 0 or len(self.gallery) == 0:
+            return [[] for _ in face_encodings]
+        # Chế độ 'best': mẫu gần nhất của mỗi sinh viên (exact: segment-reduce trên mọi mẫu,
+        # ivf: chỉ các mẫu trong cụm gần nhất); 'centroid': centroid gần nhất
+        ids, distances = self.index.search(np.asarray(face_encodings), k=k)
+        return [list(zip(row_ids, map(float, row_dists))) for row_ids, row_dists in zip(ids, distances)]
+    
+    def register_face(self, image, student_id):
+        """Đăng ký khuôn mặt mới (image: đường dẫn, bytes hoặc frame BGR)"""
+        face_encoding, message = encode_face_file(image, Config.FACE_DETECTION_MODEL)
         
-        # Tạo encoding
-        face_encodings = face_recognition.face_encodings(image, face_locations)
+        if face_encoding is None:
+            return False, message
         
-        if len(face_encodings) > 0:
-            face_encoding = face_encodings[0]
-            
-            # KIỂM TRA MÃ SV ĐÃ TỒN TẠI CHƯA (THAY VÌ KIỂM TRA KHUÔN MẶT)
-            if student_id in self.known_student_ids:
-                return False, f"Mã sinh viên {student_id} đã được đăng ký"
-            
-            # Thêm vào danh sách
-            self.known_face_encodings.append(face_encoding)
-            self.known_student_ids.append(student_id)
+        # KIỂM TRA MÃ SV ĐÃ TỒN TẠI CHƯA (THAY VÌ KIỂM TRA KHUÔN MẶT)
+        self.sync()
+        if student_id in self.gallery:
+            return False, f"Mã sinh viên {student_id} đã được đăng ký"
+        
+        self.register_encodings([face_encoding], [student_id])
+        return True, "Đăng ký khuôn mặt thành công"
+    
+    def add_sample(self, image, student_id):
+        """Thêm một ảnh mẫu cho sinh viên đã đăng ký (ánh sáng, góc mặt khác)"""
+        face_encoding, message = encode_face_file(image, Config.FACE_DETECTION_MODEL)
+        if face_encoding is None:
+            return False, message
+        
+        self.sync()
+        if student_id not in self.gallery:
+            return False, f"Mã sinh viên {student_id} chưa được đăng ký"
+        
+        self.add_samples([face_encoding], [student_id])
+        return True, f"Đã thêm mẫu, sinh viên có {len(self.gallery.records_of(student_id))} mẫu"
+    
+    def register_encodings(self, face_encodings, student_ids):
+        """Thêm nhiều encoding đã tính sẵn: ghi nối tiếp vào kho rồi nạp lại phần vừa ghi
+        
+        Mẫu cũ của cùng sinh viên bị thay thế (đăng ký lại).
+        """
+        if len(student_ids) == 0:
+            return
+        with self.store.lock():
+            self.sync()
+            self.store.append_many(face_encodings, student_ids)
+            self.sync()
             self.save_encodings()
-            
-            return True, "Đăng ký khuôn mặt thành công"
+    
+    def add_samples(self, face_encodings, student_ids):
+        """Thêm mẫu cho sinh viên đã có, giữ tối đa FACE_MAX_SAMPLES mẫu mỗi người
         
-        return False, "Không thể tạo encoding cho khuôn mặt"
+        Khi vượt giới hạn, bỏ các mẫu thêm sau cũ nhất; mẫu đăng ký ban đầu luôn được giữ.
+        """
+        if len(student_ids) == 0:
+            return
+        with self.store.lock():
+            self.sync()
+            self.store.append_many(face_encodings, student_ids, replace=False)
+            self.sync()
+            stale = []
+            for student_id in set(student_ids):
+                records = self.gallery.records_of(student_id)
+                excess = len(records) - Config.FACE_MAX_SAMPLES
+                if excess > 0:
+                    stale.extend(records[1:1 + excess])
+            if stale:
+                self.store.remove_records(stale)
+                self.sync()
+            self.save_encodings()
     
-    def recognize_face(self, image_path):
-        """Nhận diện khuôn mặt từ ảnh"""
-        if len(self.known_face_encodings) == 0:
-            return None, "Chưa có dữ liệu khuôn mặt nào được đăng ký"
+    def learn_samples(self, recognized):
+        """Thêm mẫu từ các lần điểm danh có độ tin cậy cao
         
-        # Đọc ảnh
-        image = face_recognition.load_image_file(image_path)
+        recognized là kết quả của recognize_encodings. Chỉ lấy khuôn mặt có độ tin
+        cậy >= FACE_SAMPLE_MIN_CONFIDENCE và đủ khác các mẫu đã có (cách mẫu gần
+        nhất ít nhất FACE_SAMPLE_MIN_NOVELTY), trả về số mẫu đã thêm.
+        """
+        encodings, student_ids = [], []
+        for info in recognized or []:
+            if info['confidence'] < Config.FACE_SAMPLE_MIN_CONFIDENCE or info['student_id'] in student_ids:
+                continue
+            records = self.gallery.records_of(info['student_id'])
+            if not records:
+                continue
+            nearest = np.linalg.norm(np.asarray(self.gallery.matrix[records]) - info['encoding'], axis=1).min()
+            if nearest >= Config.FACE_SAMPLE_MIN_NOVELTY:
+                encodings.append(info['encoding'])
+                student_ids.append(info['student_id'])
+        self.add_samples(encodings, student_ids)
+        return len(student_ids)
+    
+    def recognize_face(self, image):
+        """Nhận diện khuôn mặt từ ảnh (đường dẫn, bytes hoặc frame BGR)"""
+        self.sync()
+        if len(self.gallery) == 0:
+            return None, "Chưa có dữ liệu khuôn mặt nào được đăng ký"
         
-        # Tìm khuôn mặt
-        face_locations = face_recognition.face_locations(image, model=Config.FACE_DETECTION_MODEL)
+        face_locations, face_encodings = self.detect_and_encode(image)
+        return self.recognize_encodings(face_encodings)
+    
+    def detect_and_encode(self, image):
+        """Phát hiện + encoding, đi qua bộ gom batch nếu bật; trả về (face_locations, face_encodings)"""
+        if self.batcher is None:
+            return detect_and_encode(image, Config.FACE_DETECTION_MODEL)
+        prepared = prepare_image(image)
+        with timed('batch_roundtrip'):
+            return self.batcher.submit((prepared, True)).result()
+    
+    def recognize_classroom(self, image):
+        """Nhận diện ảnh toàn cảnh lớp học (nhiều khuôn mặt nhỏ), trả về (kết quả, thông báo, timings)"""
+        face_locations, face_encodings, timings = detect_and_encode_classroom(image, Config.FACE_DETECTION_MODEL)
+        recognized, message = self.recognize_encodings(face_encodings)
+        return recognized, message, timings
+    
+    def recognize_encodings(self, face_encodings):
+        """So khớp các encoding đã tính sẵn (ví dụ từ process pool) với gallery"""
+        self.sync()
+        if len(self.gallery) == 0:
+            return None, "Chưa có dữ liệu khuôn mặt nào được đăng ký"
         
-        if len(face_locations) == 0:
+        if len(face_encodings) == 0:
             return None, "Không tìm thấy khuôn mặt trong ảnh"
         
-        # Tạo encoding
-        face_encodings = face_recognition.face_encodings(image, face_locations)
-        
         recognized_students = []
         
-        for face_encoding in face_encodings:
-            # So sánh với database
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings, 
-                face_encoding,
-                tolerance=Config.FACE_RECOGNITION_TOLERANCE
-            )
+        # So khớp tất cả khuôn mặt với gallery trong một lần
+        for face_index, (face_encoding, matches) in enumerate(zip(face_encodings, self.match_encodings(face_encodings))):
+            if not matches:
+                continue
+            student_id, distance = matches[0]
             
-            if True in matches:
-                # Tìm khuôn mặt khớp nhất
-                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                best_match_idx = np.argmin(face_distances)
+            if distance <= Config.FACE_RECOGNITION_TOLERANCE:
+                confidence = 1 - distance
                 
-                if matches[best_match_idx]:
-                    confidence = 1 - face_distances[best_match_idx]
-                    
-                    # THÊM KIỂM TRA: Chỉ chấp nhận nếu độ tin cậy >= 60%
-                    if confidence >= 0.60:
-                        student_id = self.known_student_ids[best_match_idx]
-                        recognized_students.append({
-                            'student_id': student_id,
-                            'confidence': float(confidence)
-                        })
+                # Chỉ chấp nhận nếu độ tin cậy đạt ngưỡng
+                if confidence >= Config.FACE_MIN_CONFIDENCE:
+                    recognized_students.append({
+                        'student_id': student_id,
+                        'confidence': float(confidence),
+                        'encoding': np.asarray(face_encoding, dtype=np.float32),
+                        'face_index': face_index
+                    })
         
         if recognized_students:
             return recognized_students, "Nhận diện thành công"
@@ -112,54 +494,53 @@ class FaceRecognizer:
     
     def recognize_face_from_frame(self, frame):
         """Nhận diện khuôn mặt từ frame video (cho webcam)"""
-        if len(self.known_face_encodings) == 0:
+        self.sync()
+        if len(self.gallery) == 0:
             return [], []
         
-        # Resize frame để xử lý nhanh hơn
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        # Tìm khuôn mặt
-        face_locations = face_recognition.face_locations(rgb_small_frame, model='hog')
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-        
-        student_ids = []
-        face_locations_scaled = []
+        rgb_frame, face_locations = self.detect_faces_in_frame(frame)
+        student_ids = self.identify_faces_in_frame(rgb_frame, face_locations)
+        return student_ids, face_locations
+    
+    @timed('live_detect')
+    def detect_faces_in_frame(self, frame):
+        """Chỉ phát hiện khuôn mặt (không encoding) trên bản thu nhỏ của frame
         
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings,
-                face_encoding,
-                tolerance=Config.FACE_RECOGNITION_TOLERANCE
-            )
-            
-            student_id = "Unknown"
-            
-            if True in matches:
-                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                best_match_idx = np.argmin(face_distances)
-                
-                if matches[best_match_idx]:
-                    student_id = self.known_student_ids[best_match_idx]
-            
-            student_ids.append(student_id)
-            
-            # Scale lại tọa độ về kích thước gốc
-            top, right, bottom, left = face_location
-            top *= 4
-            right *= 4
-            bottom *= 4
-            left *= 4
-            face_locations_scaled.append((top, right, bottom, left))
+        Trả về (rgb_frame, face_locations) với tọa độ theo frame gốc. Khi bật gom
+        batch, frame đi chung batch với ảnh upload.
+        """
+        prepared = prepare_frame(frame, Config.WEBCAM_DETECTION_MAX_EDGE)
+        if self.batcher is not None:
+            face_locations, _ = self.batcher.submit((prepared, False)).result()
+            return prepared.rgb, face_locations
+        return prepared.rgb, detect_faces(prepared, 'hog')
+    
+    def identify_faces_in_frame(self, rgb_frame, face_locations):
+        """Encoding và so khớp các khuôn mặt đã phát hiện, trả về mã SV hoặc "Unknown" cho từng khuôn mặt"""
+        return [student_id or "Unknown" for student_id, _ in self.match_faces_in_frame(rgb_frame, face_locations)]
+    
+    def match_faces_in_frame(self, rgb_frame, face_locations):
+        """Như identify_faces_in_frame nhưng trả về (student_id hoặc None, distance) cho từng khuôn mặt"""
+        if len(face_locations) == 0:
+            return []
+        with timed('live_encode'):
+            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
         
-        return student_ids, face_locations_scaled
+        results = []
+        for matches in self.match_encodings(face_encodings):
+            if matches and matches[0][1] <= Config.FACE_RECOGNITION_TOLERANCE:
+                results.append(matches[0])
+            else:
+                results.append((None, matches[0][1] if matches else 1.0))
+        return results
     
     def delete_face_encoding(self, student_id):
         """Xóa encoding của sinh viên"""
-        if student_id in self.known_student_ids:
-            idx = self.known_student_ids.index(student_id)
-            self.known_face_encodings.pop(idx)
-            self.known_student_ids.pop(idx)
+        with self.store.lock():
+            self.sync()
+            if student_id not in self.gallery:
+                return False
+            self.store.remove(student_id)
+            self.sync()
             self.save_encodings()
             return True
-        return False
\ No newline at end of file
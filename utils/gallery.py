@@ -0,0 +1,338 @@
+import numpy as np
+
+ENCODING_DIM = 128
+
+
+class BaseGallery:
+    """Phần chỉ đọc dùng chung của các gallery: tính khoảng cách và tìm top-k
+
+    Lớp con cung cấp matrix (N, dim), sq_norms (N,) và student_ids theo hàng.
+    """
+
+    def __init__(self, dim=ENCODING_DIM):
+        self.dim = dim
+        self._size = 0
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self.student_ids = []
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self._size]
+
+    def distances(self, probes):
+        """Khoảng cách Euclid (M, N) giữa các probe và toàn bộ gallery bằng một phép nhân ma trận"""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        sq = probe_sq[:, None] + self.sq_norms[None, :] - 2.0 * (probes @ self.matrix.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def search(self, probes, k=1):
+        """Tìm top-k cho mỗi probe, trả về (chỉ số hàng (M, k), khoảng cách (M, k))"""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if self._size == 0 or len(probes) == 0:
+            empty = np.empty((len(probes), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        dists = self.distances(probes)
+        k = min(k, self._size)
+        if k == 1:
+            idx = np.argmin(dists, axis=1)[:, None]
+        else:
+            idx = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(dists, idx, axis=1), axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+        return idx, np.take_along_axis(dists, idx, axis=1)
+
+    def search_ids(self, probes, k=1):
+        """Như search nhưng trả về mã sinh viên thay cho chỉ số hàng"""
+        idx, dists = self.search(probes, k)
+        ids = [[self.student_ids[i] for i in row] for row in idx]
+        return ids, dists
+
+
+class FaceGallery(BaseGallery):
+    """Ma trận encoding liền mạch (N, 128) float32 dùng cho so khớp 1:N"""
+
+    def __init__(self, dim=ENCODING_DIM, initial_capacity=1024, growth_factor=1.5):
+        super().__init__(dim)
+        self.growth_factor = growth_factor
+        self._matrix = np.empty((initial_capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(initial_capacity, dtype=np.float32)
+        self._index_of = {}
+
+    def __contains__(self, student_id):
+        return student_id in self._index_of
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    @property
+    def matrix(self):
+        """View (không copy) lên phần đã dùng của ma trận"""
+        return self._matrix[:self._size]
+
+    def _reserve(self, needed):
+        """Cấp phát thêm theo từng khối để chi phí append được khấu hao"""
+        if needed <= self.capacity:
+            return
+        new_capacity = max(needed, int(self.capacity * self.growth_factor) + 1)
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+
+    def add(self, encoding, student_id):
+        """Thêm một encoding, trả về vị trí hàng trong ma trận"""
+        return self.add_many([encoding], [student_id])[0]
+
+    def add_many(self, encodings, student_ids):
+        """Thêm nhiều encoding cùng lúc"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        start = self._size
+        end = start + len(encodings)
+        self._reserve(end)
+        self._matrix[start:end] = encodings
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', encodings, encodings)
+        for offset, student_id in enumerate(student_ids):
+            self.student_ids.append(student_id)
+            self._index_of[student_id] = start + offset
+        self._size = end
+        return list(range(start, end))
+
+    def remove(self, student_id):
+        """Xóa encoding bằng cách chuyển hàng cuối vào chỗ trống (O(1))"""
+        idx = self._index_of.pop(student_id, None)
+        if idx is None:
+            return False
+        last = self._size - 1
+        if idx != last:
+            self._matrix[idx] = self._matrix[last]
+            self._sq_norms[idx] = self._sq_norms[last]
+            moved_id = self.student_ids[last]
+            self.student_ids[idx] = moved_id
+            self._index_of[moved_id] = idx
+        self.student_ids.pop()
+        self._size = last
+        return True
+
+    def clear(self):
+        self._size = 0
+        self.student_ids = []
+        self._index_of = {}
+
+    def index_of(self, student_id):
+        return self._index_of.get(student_id)
+
+    def live(self):
+        """(encodings, student_ids) của các hàng còn sống"""
+        return self.matrix, self.student_ids
+
+
+def student_centroids(matrix, student_ids, outlier_distance=None):
+    """Centroid của từng sinh viên bằng segment-reduce trên các hàng đã nhóm theo sinh viên
+
+    Với sinh viên có từ 3 mẫu, các mẫu cách centroid ban đầu xa hơn
+    outlier_distance (ảnh mờ, góc lệch, nhận nhầm) bị loại rồi tính lại.
+    Trả về (danh sách mã sinh viên, ma trận centroid (S, dim)).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if len(student_ids) == 0:
+        return [], np.empty((0, matrix.shape[1] if matrix.ndim == 2 else ENCODING_DIM), dtype=np.float32)
+    unique, labels = np.unique(np.asarray(student_ids), return_inverse=True)
+    order = np.argsort(labels, kind='stable')
+    rows = matrix[order]
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    counts = np.diff(np.r_[starts, len(rows)])
+    centroids = np.add.reduceat(rows, starts, axis=0) / counts[:, None]
+    if outlier_distance is not None:
+        segment = np.repeat(np.arange(len(starts)), counts)
+        distance = np.linalg.norm(rows - centroids[segment], axis=1)
+        keep = (distance <= outlier_distance) | (counts[segment] < 3)
+        kept = np.add.reduceat(keep.astype(np.float32), starts)
+        sums = np.add.reduceat(rows * keep[:, None], starts, axis=0)
+        valid = kept > 0
+        centroids[valid] = sums[valid] / kept[valid, None]
+    return [str(student_id) for student_id in unique], centroids.astype(np.float32)
+
+
+class MappedGallery(BaseGallery):
+    """Gallery chỉ đọc trỏ thẳng vào file vector của EncodingStore qua mmap
+
+    Các worker map cùng một file nên ma trận encoding chỉ có một bản trong page
+    cache của hệ điều hành, bất kể số worker; mỗi worker chỉ giữ riêng sq_norms
+    và nhãn (vài byte/hàng) cùng danh sách mã sinh viên. Mỗi sinh viên có thể
+    có nhiều hàng (mẫu). Hàng đã xóa vẫn nằm trong file nhưng có sq_norm = inf
+    và nhãn -1 nên không bao giờ khớp. Gallery không có API ghi: thêm/xóa đi qua
+    EncodingStore rồi áp dụng bằng extend/kill.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, growth_factor=1.5):
+        super().__init__(dim)
+        self.growth_factor = growth_factor
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._records_of = {}
+        self._label_of = {}
+        self._label_ids = []
+        self._segments = None
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, student_id):
+        return student_id in self._records_of
+
+    @property
+    def n_students(self):
+        return len(self._records_of)
+
+    @property
+    def matrix(self):
+        return self._vectors
+
+    def records_of(self, student_id):
+        """Các hàng (mẫu) còn sống của sinh viên, theo thứ tự thêm vào"""
+        return list(self._records_of.get(student_id, ()))
+
+    def attach(self, vectors, record_ids, dead=()):
+        """Gắn lại toàn bộ file (lúc khởi động hoặc sau compaction)"""
+        self.clear()
+        self.extend(vectors, record_ids, dead)
+
+    def extend(self, vectors, new_ids, dead=()):
+        """Nhận các bản ghi mới ở cuối file; vectors là memmap của cả file sau khi ghi thêm"""
+        start = self._size
+        end = start + len(new_ids)
+        if end > len(self._sq_norms):
+            capacity = max(end, int(len(self._sq_norms) * self.growth_factor) + 1)
+            sq_norms = np.empty(capacity, dtype=np.float32)
+            labels = np.empty(capacity, dtype=np.int64)
+            sq_norms[:start] = self._sq_norms[:start]
+            labels[:start] = self._labels[:start]
+            self._sq_norms = sq_norms
+            self._labels = labels
+        rows = np.asarray(vectors[start:end], dtype=np.float32)
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', rows, rows)
+        self._vectors = vectors[:end]
+        self._size = end
+        self._segments = None
+        for record, student_id in enumerate(new_ids, start):
+            self.student_ids.append(student_id)
+            if record in dead:
+                self._sq_norms[record] = np.inf
+                self._labels[record] = -1
+                self.student_ids[record] = None
+                continue
+            if student_id not in self._label_of:
+                self._label_of[student_id] = len(self._label_ids)
+                self._label_ids.append(student_id)
+            self._labels[record] = self._label_of[student_id]
+            self._records_of.setdefault(student_id, []).append(record)
+            self._live += 1
+
+    def kill(self, record):
+        """Đánh dấu một bản ghi đã xóa, trả về False nếu đã xóa trước đó"""
+        student_id = self.student_ids[record]
+        if student_id is None:
+            return False
+        self._sq_norms[record] = np.inf
+        self._labels[record] = -1
+        self.student_ids[record] = None
+        self._live -= 1
+        self._segments = None
+        records = self._records_of[student_id]
+        records.remove(record)
+        if not records:
+            del self._records_of[student_id]
+        return True
+
+    def index_of(self, student_id):
+        records = self._records_of.get(student_id)
+        return records[-1] if records else None
+
+    def clear(self):
+        self._size = 0
+        self.student_ids = []
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._records_of = {}
+        self._label_of = {}
+        self._label_ids = []
+        self._segments = None
+        self._live = 0
+
+    def live(self):
+        records = sorted(record for records in self._records_of.values() for record in records)
+        return np.asarray(self._vectors[records], dtype=np.float32), [self.student_ids[r] for r in records]
+
+    @property
+    def n_rows(self):
+        """Số hàng đã map, gồm cả hàng đã xóa (số thứ tự bản ghi chạy từ 0 tới n_rows - 1)"""
+        return self._size
+
+    def live_records(self):
+        """Số thứ tự các bản ghi còn sống (int64, tăng dần)"""
+        return np.flatnonzero(self._labels[:self._size] >= 0)
+
+    def best_per_student(self, records, sq_distances, k=1):
+        """Gộp best-of-K trên một tập bản ghi ứng viên: top-k sinh viên theo mẫu gần nhất
+
+        records và sq_distances (bình phương khoảng cách tới probe) cùng độ dài;
+        bản ghi đã xóa bị bỏ qua. Trả về (mã sinh viên, khoảng cách).
+        """
+        labels = self._labels[records]
+        alive = labels >= 0
+        labels, sq_distances = labels[alive], sq_distances[alive]
+        order = np.argsort(sq_distances, kind='stable')
+        # Lần xuất hiện đầu tiên của mỗi nhãn theo thứ tự khoảng cách = mẫu gần nhất của sinh viên đó
+        _, first = np.unique(labels[order], return_index=True)
+        best = order[np.sort(first)[:k]]
+        return ([self._label_ids[label] for label in labels[best]],
+                np.sqrt(np.maximum(sq_distances[best], 0.0)).astype(np.float32))
+
+    def search_ids(self, probes, k=1):
+        """Như BaseGallery.search_ids nhưng bỏ các hàng đã xóa (khoảng cách inf)"""
+        idx, dists = self.search(probes, k)
+        ids, kept = [], []
+        for row_idx, row_dists in zip(idx, dists):
+            alive = np.isfinite(row_dists)
+            ids.append([self.student_ids[i] for i in row_idx[alive]])
+            kept.append(row_dists[alive])
+        return ids, kept
+
+    def _student_segments(self):
+        """Thứ tự hàng còn sống nhóm theo sinh viên và vị trí bắt đầu mỗi nhóm (cache tới lần thay đổi sau)"""
+        if self._segments is None:
+            labels = self._labels[:self._size]
+            alive = np.flatnonzero(labels >= 0)
+            order = alive[np.argsort(labels[alive], kind='stable')]
+            sorted_labels = labels[order]
+            starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if len(order) else order
+            self._segments = (order, starts, [self._label_ids[label] for label in sorted_labels[starts]])
+        return self._segments
+
+    def search_students(self, probes, k=1):
+        """Best-of-K: khoảng cách tới mẫu gần nhất của từng sinh viên, top-k sinh viên cho mỗi probe
+
+        Khoảng cách tới mọi mẫu được gộp theo sinh viên bằng np.minimum.reduceat.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if self._live == 0 or len(probes) == 0:
+            return [[] for _ in probes], [np.empty(0, dtype=np.float32) for _ in probes]
+        order, starts, ids = self._student_segments()
+        per_student = np.minimum.reduceat(self.distances(probes)[:, order], starts, axis=1)
+        k = min(k, len(ids))
+        if k == 1:
+            idx = np.argmin(per_student, axis=1)[:, None]
+        else:
+            idx = np.argpartition(per_student, k - 1, axis=1)[:, :k]
+            idx = np.take_along_axis(idx, np.argsort(np.take_along_axis(per_student, idx, axis=1), axis=1), axis=1)
+        return [[ids[i] for i in row] for row in idx], np.take_along_axis(per_student, idx, axis=1)
@@ -0,0 +1,107 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.metrics import current_trace, tracing
+
+
+def _run_traced(trace, fn, *args):
+    """Chạy fn trong worker thread với trace của request đã gửi job (Server-Timing, cProfile)"""
+    with tracing(trace):
+        return fn(*args)
+
+
+class QueueFull(Exception):
+    """Hàng đợi đã đầy - endpoint trả về 429"""
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status}
+        if self.finished_at is not None:
+            data['latency_ms'] = round((self.finished_at - self.created_at) * 1000, 1)
+        if self.status == 'error':
+            data['message'] = self.error
+        return data
+
+
+class RecognitionQueue:
+    """Hàng đợi nhận diện trong tiến trình, chạy trên thread pool hoặc process pool
+
+    Mỗi job gồm hai bước: `fn(*args)` chạy trong pool (detect + encode, có thể là
+    process riêng nên fn phải pickle được), sau đó `then(result)` chạy trong tiến
+    trình web để so khớp gallery và ghi database.
+    """
+
+    def __init__(self, workers=2, kind='thread', max_pending=32, job_ttl=300):
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recognition')
+        else:
+            raise ValueError(f"Không hỗ trợ loại pool: {kind}")
+        self.kind = kind
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        """Bỏ các job đã xong quá job_ttl giây (gọi khi đang giữ lock)"""
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self, fn, *args, then=None):
+        """Đưa job vào hàng đợi, trả về Job; ném QueueFull khi vượt max_pending"""
+        with self.lock:
+            self._expire()
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"Hàng đợi nhận diện đã đầy ({self.max_pending} yêu cầu)")
+            job = Job(uuid.uuid4().hex)
+            self.jobs[job.id] = job
+            self.pending += 1
+        # Trace không pickle được nên chỉ chuyển sang worker khi dùng thread pool
+        trace = current_trace() if self.kind == 'thread' else None
+
+        def finish(future):
+            try:
+                result = future.result()
+                with tracing(trace):
+                    job.result = then(result) if then else result
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'error'
+            job.finished_at = time.time()
+            with self.lock:
+                self.pending -= 1
+            job.done.set()
+
+        if trace is not None:
+            future = self.executor.submit(_run_traced, trace, fn, *args)
+        else:
+            future = self.executor.submit(fn, *args)
+        future.add_done_callback(finish)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        """Chờ job xong tối đa timeout giây, trả về True nếu đã xong"""
+        return job.done.wait(timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
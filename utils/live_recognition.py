@@ -0,0 +1,119 @@
+import threading
+import time
+from utils.tracking import IoUTracker, iou
+from utils.metrics import RateMeter
+
+
+class LiveRecognizer:
+    """Nhận diện bất đồng bộ cho luồng webcam
+
+    Thread nền lấy frame mới nhất từ CameraStream với tần số detection_hz, chỉ
+    phát hiện khuôn mặt rồi ghép với các track cũ bằng IoU. Mỗi track giữ cache
+    danh tính (bỏ phiếu đa số trên K lần nhận diện gần nhất); encoding chỉ chạy
+    lại khi track mới, cache hết hạn, khung bị lệch hoặc độ tin cậy còn thấp.
+    Luồng MJPEG đọc overlays để vẽ lại nhãn trên mọi frame nên tốc độ stream
+    bằng tốc độ camera.
+    """
+
+    def __init__(self, camera, recognizer, detection_hz=5, iou_threshold=0.3, max_misses=3,
+                 vote_window=5, identity_ttl=10.0, drift_iou=0.5, min_confidence=0.6,
+                 attendance_votes=3, on_identity=None):
+        self.camera = camera
+        self.recognizer = recognizer
+        self.detection_hz = detection_hz
+        self.vote_window = vote_window
+        self.identity_ttl = identity_ttl
+        self.drift_iou = drift_iou
+        self.min_confidence = min_confidence
+        self.attendance_votes = attendance_votes
+        # on_identity(student_id, confidence, frame, box): gọi một lần cho mỗi track có danh tính ổn định
+        self.on_identity = on_identity
+        self.tracker = IoUTracker(iou_threshold, max_misses, vote_window)
+        self.overlays = []
+        self.counters = {'observations': 0, 'cache_hits': 0, 'encodings': 0, 'identities_marked': 0}
+        self.detection_rate = RateMeter()
+        self.refcount = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def acquire(self):
+        """Đăng ký một người xem: mở camera và thread nhận diện nếu cần"""
+        self.camera.acquire()
+        with self._lock:
+            self.refcount += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self.tracker = IoUTracker(self.tracker.iou_threshold, self.tracker.max_misses, self.vote_window)
+                self._thread = threading.Thread(target=self._run, name='live-recognition', daemon=True)
+                self._thread.start()
+
+    def release(self):
+        with self._lock:
+            self.refcount = max(0, self.refcount - 1)
+            thread = None
+            if self.refcount == 0 and self._thread is not None:
+                self._stop.set()
+                thread, self._thread = self._thread, None
+                self.overlays = []
+        if thread is not None:
+            thread.join(timeout=2)
+        self.camera.release()
+
+    def _run(self):
+        interval = 1.0 / self.detection_hz
+        seq = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            seq, frame = self.camera.wait_frame(seq)
+            if frame is not None:
+                self.process(frame)
+                self.detection_rate.tick()
+            self._stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+    def needs_encoding(self, track, now):
+        """Track mới, chưa đủ phiếu, cache hết hạn, khung lệch xa so với lần encode trước, hoặc chưa đủ tin cậy"""
+        if track.recognized_at is None or now - track.recognized_at > self.identity_ttl:
+            return True
+        if len(track.history) < self.attendance_votes:
+            return True
+        if iou(track.box, track.recognized_box) < self.drift_iou:
+            return True
+        student_id, _, confidence = track.vote()
+        return student_id is None or confidence < self.min_confidence
+
+    def process(self, frame):
+        """Phát hiện + tracking trên một frame; chỉ encoding các track cần nhận diện lại"""
+        now = time.monotonic()
+        rgb_frame, face_locations = self.recognizer.detect_faces_in_frame(frame)
+        tracks, _ = self.tracker.update(face_locations)
+        stale = [t for t in tracks if self.needs_encoding(t, now)]
+        if stale:
+            matches = self.recognizer.match_faces_in_frame(rgb_frame, [t.box for t in stale])
+            for track, (student_id, distance) in zip(stale, matches):
+                track.history.append((student_id, distance))
+                track.recognized_at = now
+                track.recognized_box = track.box
+        self.counters['observations'] += len(tracks)
+        self.counters['encodings'] += len(stale)
+        self.counters['cache_hits'] += len(tracks) - len(stale)
+
+        for track in tracks:
+            student_id, votes, confidence = track.vote()
+            track.label = student_id or "Unknown"
+            if (student_id is not None and not track.marked and self.on_identity is not None
+                    and votes >= self.attendance_votes and confidence >= self.min_confidence):
+                track.marked = True
+                self.counters['identities_marked'] += 1
+                self.on_identity(student_id, confidence, frame, track.box)
+
+        self.overlays = [(t.box, t.label) for t in tracks]
+        return self.overlays
+
+    def stats(self):
+        observations = self.counters['observations']
+        return dict(self.counters,
+                    detection_fps=self.detection_rate.rate(),
+                    encodings_saved=self.counters['cache_hits'],
+                    cache_hit_rate=round(self.counters['cache_hits'] / observations, 4) if observations else 0.0,
+                    active_tracks=len(self.tracker.tracks))
@@ -0,0 +1,287 @@
+import cProfile
+import math
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from config import Config
+
+# Đo đạc bật/tắt một lần lúc khởi động: khi tắt, timed() trả về đối tượng rỗng dùng chung
+# và decorator trả lại nguyên hàm gốc nên đường nóng không tốn thêm gì.
+ENABLED = Config.METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REGISTRY = []
+_local = threading.local()
+
+
+def _labels(label, value, **extra):
+    pairs = ([(label, value)] if label else []) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{str(val)}"' for key, val in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cộng dồn, _sum, _count), có thể tách theo một nhãn"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, label_value=''):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+        for label_value, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.label, label_value, le=_number(bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label, label_value)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label, label_value)} {count}')
+        return lines
+
+
+class Counter:
+    """Bộ đếm tăng dần"""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, label_value=''):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.label, key)} {_number(value)}' for key, value in values)
+        return lines
+
+
+class Gauge:
+    """Giá trị tức thời, đọc qua hàm fn lúc render (không tốn gì trên đường nóng)"""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {_number(value)}']
+
+
+class RateMeter:
+    """Số sự kiện mỗi giây trong cửa sổ trượt window giây (FPS của luồng webcam)"""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+    def rate(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._events) / self.window
+
+
+STAGE_LATENCY = Histogram('attendance_stage_seconds', 'Thời gian từng bước xử lý (giải mã, phát hiện, encoding, so khớp, DB)',
+                          label='stage')
+REQUEST_LATENCY = Histogram('attendance_http_request_seconds', 'Thời gian xử lý request theo endpoint',
+                            label='endpoint')
+FACES_PER_IMAGE = Histogram('attendance_faces_per_image', 'Số khuôn mặt phát hiện được trên mỗi ảnh',
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+PROFILES_CAPTURED = Counter('attendance_profiles_captured_total', 'Số request chậm đã ghi cProfile')
+BACKGROUND_ERRORS = Counter('attendance_background_errors_total', 'Số lỗi của các tác vụ nền (ghi ảnh, dọn ảnh)',
+                            label='task')
+
+
+class Trace:
+    """Thời gian các bước của một request (cho header Server-Timing) và cProfile nếu được lấy mẫu
+
+    Trace được gắn vào thread đang xử lý bằng tracing(); hàng đợi nhận diện gắn
+    tiếp trace của request vào worker thread nên các bước chạy nền cũng được ghi.
+    """
+
+    def __init__(self, profile=False):
+        self.started = time.perf_counter()
+        self.profile = profile
+        self.stages = []
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages.append((stage, seconds))
+
+    def server_timing(self):
+        """Giá trị header Server-Timing, gộp các bước cùng tên"""
+        totals = {}
+        with self._lock:
+            for stage, seconds in self.stages:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in totals.items()]
+        parts.append(f'total;dur={self.elapsed * 1000:.2f}')
+        return ', '.join(parts)
+
+    def dump_profile(self, directory, name):
+        """Gộp cProfile của mọi thread đã chạy cho request và ghi ra file .prof, trả về đường dẫn"""
+        with self._lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d%H%M%S')}_{name}_{int(self.elapsed * 1000)}ms.prof")
+        stats.dump_stats(path)
+        PROFILES_CAPTURED.inc()
+        return path
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def tracing(trace):
+    """Gắn trace vào thread hiện tại; bật cProfile riêng cho thread nếu trace được lấy mẫu"""
+    if trace is None:
+        yield None
+        return
+    previous = current_trace()
+    _local.trace = trace
+    profiler = None
+    if trace.profile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Đã có profiler khác đang chạy (Python 3.12+ chỉ cho một profiler mỗi process)
+            profiler = None
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            with trace._lock:
+                trace.profiles.append(profiler)
+        _local.trace = previous
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        STAGE_LATENCY.observe(elapsed, self.stage)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.add(self.stage, elapsed)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __call__(self, fn):
+        return fn
+
+
+_NOOP = _NoopTimer()
+
+
+def timed(stage):
+    """Đo thời gian một bước: `with timed('detect'):` hoặc decorator `@timed('db_get_student')`
+
+    Chỉ đo được trong process web; bước chạy trong process pool (RECOGNITION_POOL=process)
+    không xuất hiện ở /metrics.
+    """
+    return _Timer(stage) if ENABLED else _NOOP
+
+
+def observe_faces(count):
+    if ENABLED:
+        FACES_PER_IMAGE.observe(count)
+
+
+def render():
+    """Toàn bộ metric theo định dạng text của Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# Các mức giải mã thu nhỏ của OpenCV (JPEG giải mã trực tiếp ở 1/2, 1/4, 1/8 kích thước)
+REDUCED_COLOR_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                       (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class PreparedImage:
+    """Ảnh đã tiền xử lý: rgb dùng để encoding, detect_rgb (nhỏ hơn) dùng để phát hiện
+
+    scale là tỉ lệ từ tọa độ detect_rgb sang tọa độ rgb.
+    """
+
+    def __init__(self, rgb, detect_rgb, scale):
+        self.rgb = rgb
+        self.detect_rgb = detect_rgb
+        self.scale = scale
+
+    @property
+    def megapixels(self):
+        return self.rgb.shape[0] * self.rgb.shape[1] / 1e6
+
+    def to_full(self, face_locations):
+        """Đổi khung (top, right, bottom, left) từ detect_rgb sang rgb, kẹp trong biên ảnh"""
+        height, width = self.rgb.shape[:2]
+        return [(max(0, int(round(top * self.scale))),
+                 min(width, int(round(right * self.scale))),
+                 min(height, int(round(bottom * self.scale))),
+                 max(0, int(round(left * self.scale))))
+                for top, right, bottom, left in face_locations]
+
+
+def _reduce_flag(long_edge, encode_max_edge):
+    """Chọn mức giải mã thu nhỏ lớn nhất mà cạnh dài vẫn >= encode_max_edge"""
+    for factor, flag in REDUCED_COLOR_FLAGS:
+        if long_edge // factor >= encode_max_edge:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _downscale(image, max_edge):
+    """Thu nhỏ để cạnh dài <= max_edge, trả về (ảnh, tỉ lệ ảnh gốc / ảnh nhỏ)"""
+    long_edge = max(image.shape[:2])
+    if not max_edge or long_edge <= max_edge:
+        return image, 1.0
+    factor = max_edge / long_edge
+    small = cv2.resize(image, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    return small, image.shape[1] / small.shape[1]
+
+
+def prepare_array(rgb, detect_max_edge):
+    """Tiền xử lý ảnh RGB đã có trong bộ nhớ"""
+    detect_rgb, scale = _downscale(rgb, detect_max_edge)
+    return PreparedImage(rgb, detect_rgb, scale)
+
+
+def prepare_frame(frame, detect_max_edge):
+    """Tiền xử lý frame BGR từ webcam"""
+    return prepare_array(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), detect_max_edge)
+
+
+def _decode(header_source, imread, pil_source, detect_max_edge, encode_max_edge):
+    """Phần chung của load_image/load_image_bytes; imread(flag) giải mã bằng OpenCV"""
+    with Image.open(header_source) as header:
+        long_edge = max(header.size)
+    bgr = imread(_reduce_flag(long_edge, encode_max_edge))
+    if bgr is None:
+        # Định dạng OpenCV không đọc được: dùng PIL
+        with Image.open(pil_source) as pil_image:
+            rgb = np.asarray(ImageOps.exif_transpose(pil_image).convert('RGB'))
+    else:
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    rgb, _ = _downscale(rgb, encode_max_edge)
+    return prepare_array(np.ascontiguousarray(rgb), detect_max_edge)
+
+
+def load_image(image_path, detect_max_edge=800, encode_max_edge=1600):
+    """Đọc ảnh upload và chuẩn bị cho phát hiện + encoding
+
+    - Đọc kích thước từ header (không giải mã) để chọn IMREAD_REDUCED_* phù hợp,
+      ảnh 12MP chỉ giải mã ở 1/2 hoặc 1/4 kích thước.
+    - cv2.imread tự xoay ảnh theo EXIF orientation (ảnh chụp dọc từ điện thoại).
+    - Cạnh dài của ảnh encoding giới hạn ở encode_max_edge, ảnh phát hiện ở detect_max_edge.
+    """
+    return _decode(image_path, lambda flag: cv2.imread(image_path, flag), image_path,
+                   detect_max_edge, encode_max_edge)
+
+
+def load_image_bytes(data, detect_max_edge=800, encode_max_edge=1600):
+    """Như load_image nhưng giải mã thẳng từ bytes trong bộ nhớ (cv2.imdecode), không ghi đĩa"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return _decode(io.BytesIO(data), lambda flag: cv2.imdecode(buffer, flag), io.BytesIO(data),
+                   detect_max_edge, encode_max_edge)
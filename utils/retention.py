@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from datetime import datetime
+import cv2
+from utils.evidence import evidence_owner
+from utils.metrics import BACKGROUND_ERRORS
+from utils.preprocess import load_image_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ chạy một process, khóa thread là đủ
+    fcntl = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+LOCK_NAME = '.retention.lock'
+
+
+def scan(directory):
+    """Mọi file ảnh (và file .tmp ghi dở) dưới directory: {đường dẫn tương đối dạng a/b.jpg: (byte, mtime)}"""
+    files = {}
+    stack = [directory]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and entry.name.lower().endswith(IMAGE_EXTENSIONS + ('.tmp',)):
+                    stat = entry.stat()
+                    files[os.path.relpath(entry.path, directory).replace(os.sep, '/')] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def parse_time(value):
+    """check_in_time dạng 'YYYY-MM-DD HH:MM:SS' -> datetime (None nếu không đọc được)"""
+    try:
+        return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+class EvidenceRetention:
+    """Dọn thư mục ảnh minh chứng
+
+    Mỗi lần chạy:
+    - compaction (chỉ khi compact_legacy): ảnh minh chứng cũ nằm phẳng ở thư mục gốc
+      (ảnh gốc nhiều MB) được encode lại thành ảnh nhỏ, chuyển vào thư mục theo ngày
+      điểm danh (giữ nguyên tên file) và cập nhật image_path;
+    - xóa ảnh không còn lượt điểm danh nào tham chiếu sau orphan_grace giây (chỉ khi
+      delete_orphans);
+    - xóa ảnh cũ hơn retention_days ngày, rồi ảnh cũ nhất cho tới khi tổng dung lượng
+      dưới quota_bytes; image_path của các lượt điểm danh tương ứng được đặt về NULL.
+    Tuổi của ảnh được tham chiếu tính từ check_in_time của lượt điểm danh, không phải
+    mtime của file. Compaction và xóa ảnh mồ côi tắt thì chỉ báo cáo số ảnh ứng viên;
+    run(dry_run=True) báo cáo mọi thứ sẽ làm mà không đụng tới file hay DB.
+    Ảnh của sinh viên (bảng students) không bao giờ bị xóa. Nhiều worker dùng chung
+    thư mục: flock bảo đảm mỗi lúc chỉ một process dọn, các process khác bỏ qua lượt đó.
+    """
+
+    def __init__(self, directory, db, writer, retention_days=None, quota_bytes=None, orphan_grace=3600,
+                 delete_orphans=False, compact_legacy=False, interval=3600):
+        self.directory = directory
+        self.db = db
+        self.writer = writer
+        self.retention_days = retention_days
+        self.quota_bytes = quota_bytes
+        self.orphan_grace = orphan_grace
+        self.delete_orphans = delete_orphans
+        self.compact_legacy = compact_legacy
+        self.interval = interval
+        self.last_report = None
+        self.runs = 0
+        self.reclaimed_total = 0
+        self.errors = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Chạy ngay một lượt rồi lặp lại mỗi interval giây trên thread nền (gọi tường minh, không tự chạy khi import)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='evidence-retention', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+                BACKGROUND_ERRORS.inc(label_value='evidence_retention')
+            self._stop.wait(self.interval)
+
+    def run(self, dry_run=False):
+        """Chạy một lượt dọn, trả về báo cáo hoặc None nếu thread/process khác đang dọn"""
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_NAME), 'w') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return None
+                try:
+                    report = self._run(dry_run)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._run_lock.release()
+        if not dry_run:
+            with self._lock:
+                self.last_report = report
+                self.runs += 1
+                self.reclaimed_total += report['reclaimed_bytes']
+        return report
+
+    def _remove(self, relative_path):
+        try:
+            os.remove(os.path.join(self.directory, relative_path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _compact(self, relative_path, taken_at, mtime):
+        """Encode lại một ảnh phẳng cũ vào thư mục ngày điểm danh taken_at, giữ tên file
+
+        Trả về đường dẫn mới hoặc None nếu không đọc được hay đích đã có file.
+        """
+        new_path = f"{taken_at.strftime('%Y/%m/%d')}/{os.path.splitext(relative_path)[0]}.jpg"
+        if os.path.exists(os.path.join(self.directory, new_path)):
+            return None
+        with open(os.path.join(self.directory, relative_path), 'rb') as f:
+            data = f.read()
+        try:
+            prepared = load_image_bytes(data, detect_max_edge=None, encode_max_edge=self.writer.max_edge)
+        except Exception:
+            return None
+        self.writer.write_file(new_path, self.writer.encode(cv2.cvtColor(prepared.rgb, cv2.COLOR_RGB2BGR)))
+        os.utime(os.path.join(self.directory, new_path), (mtime, mtime))
+        return new_path
+
+    def _run(self, dry_run):
+        start = time.perf_counter()
+        now = time.time()
+        checked_at = parse_time(self.db.get_vietnam_time())
+        report = {'dry_run': dry_run, 'compacted': 0, 'orphaned': 0, 'expired': 0, 'over_quota': 0,
+                  'stale_tmp': 0, 'reclaimed_bytes': 0, 'references_updated': 0,
+                  'compact_candidates': 0, 'compact_candidate_bytes': 0,
+                  'orphan_candidates': 0, 'orphan_candidate_bytes': 0}
+        protected, referenced = self.db.get_image_references()
+        taken = {path: parse_time(value) for path, value in referenced.items()}
+        files = scan(self.directory)
+
+        # File .tmp sót lại khi process chết giữa chừng lúc ghi
+        for path, (size, mtime) in list(files.items()):
+            if path.endswith('.tmp'):
+                del files[path]
+                if now - mtime > self.orphan_grace and (dry_run or self._remove(path)):
+                    report['stale_tmp'] += 1
+                    report['reclaimed_bytes'] += size
+
+        def age(path, mtime):
+            """Số giây từ lúc điểm danh (ảnh được tham chiếu) hoặc từ lần ghi file (ảnh khác)"""
+            if taken.get(path) and checked_at:
+                return (checked_at - taken[path]).total_seconds()
+            return now - mtime
+
+        # Compaction: ghi ảnh mới, cập nhật DB trong một lần, rồi mới xóa ảnh gốc
+        max_age = self.retention_days * 86400 if self.retention_days else None
+        moves = {}
+        for path, (size, mtime) in list(files.items()):
+            if '/' in path or path not in referenced or path in protected:
+                continue
+            if max_age is not None and age(path, mtime) > max_age:
+                # Sắp bị xóa vì hết hạn, không cần encode lại
+                continue
+            if dry_run or not self.compact_legacy:
+                report['compact_candidates'] += 1
+                report['compact_candidate_bytes'] += size
+                continue
+            new_path = self._compact(path, taken[path] or datetime.fromtimestamp(mtime), mtime)
+            if new_path is None:
+                continue
+            new_size = os.path.getsize(os.path.join(self.directory, new_path))
+            files[new_path] = (new_size, mtime)
+            moves[path] = new_path
+            report['reclaimed_bytes'] += size - new_size
+        if moves:
+            report['references_updated'] += self.db.update_attendance_images(moves)
+            for path in moves:
+                self._remove(path)
+                del files[path]
+            report['compacted'] = len(moves)
+            for old_path, new_path in moves.items():
+                referenced[new_path] = referenced.pop(old_path)
+                taken[new_path] = taken.pop(old_path)
+
+        # Ảnh minh chứng và các ảnh cắt khuôn mặt đi kèm được xử lý như một nhóm
+        groups = {}
+        for path, (size, mtime) in files.items():
+            group = groups.setdefault(evidence_owner(path), {'paths': [], 'bytes': 0, 'mtime': 0.0})
+            group['paths'].append(path)
+            group['bytes'] += size
+            group['mtime'] = max(group['mtime'], mtime)
+        for owner, group in groups.items():
+            group['age'] = age(owner, group['mtime'])
+
+        doomed = {}
+        for owner, group in groups.items():
+            if owner in protected:
+                continue
+            if owner not in referenced:
+                if now - group['mtime'] > self.orphan_grace:
+                    if self.delete_orphans:
+                        doomed[owner] = 'orphaned'
+                    else:
+                        report['orphan_candidates'] += 1
+                        report['orphan_candidate_bytes'] += group['bytes']
+            elif max_age is not None and group['age'] > max_age:
+                doomed[owner] = 'expired'
+
+        if self.quota_bytes:
+            used = sum(group['bytes'] for owner, group in groups.items() if owner not in doomed)
+            candidates = sorted(((group['age'], owner) for owner, group in groups.items()
+                                 if owner not in doomed and owner not in protected), reverse=True)
+            for _, owner in candidates:
+                if used <= self.quota_bytes:
+                    break
+                doomed[owner] = 'over_quota'
+                used -= groups[owner]['bytes']
+
+        # Bỏ tham chiếu trong DB trước khi xóa file: lỗi giữa chừng chỉ để lại file mồ côi, lượt sau dọn tiếp
+        if not dry_run:
+            report['references_updated'] += self.db.update_attendance_images(
+                {owner: None for owner in doomed if owner in referenced})
+        for owner, reason in doomed.items():
+            report[reason] += 1
+            for path in groups[owner]['paths']:
+                if dry_run or self._remove(path):
+                    report['reclaimed_bytes'] += files[path][0]
+
+        remaining = [group for owner, group in groups.items() if owner not in doomed]
+        report.update({
+            'files': sum(len(group['paths']) for group in remaining),
+            'bytes': sum(group['bytes'] for group in remaining),
+            'duration_s': round(time.perf_counter() - start, 3),
+            'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        return report
+
+    def stats(self):
+        """Báo cáo lần dọn gần nhất (dung lượng hiện tại, byte thu hồi), tổng số byte đã thu hồi và số lỗi nền"""
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'reclaimed_bytes_total': self.reclaimed_total,
+                'retention_days': self.retention_days,
+                'quota_bytes': self.quota_bytes,
+                'delete_orphans': self.delete_orphans,
+                'compact_legacy': self.compact_legacy,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'last_run': dict(self.last_report) if self.last_report else None
+            }
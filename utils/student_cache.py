@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StudentCache:
+    """Cache LRU thông tin sinh viên theo student_id, kèm bản chụp toàn bộ danh sách
+
+    Đường ghi của Database (thêm/xóa sinh viên) invalidate ngay trong process
+    của nó; ghi từ worker khác được phát hiện qua phiên bản dùng chung trong DB
+    (validate), kiểm tra tối đa mỗi check_interval giây. Dữ liệu sinh viên hiếm
+    khi thay đổi nên đường nhận diện gần như không cần đọc SQL.
+    """
+
+    def __init__(self, capacity=10000, check_interval=1.0):
+        self.capacity = capacity
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = float('-inf')
+        self._entries = OrderedDict()
+        self._roster = None
+        self._lock = threading.Lock()
+        self.resets = 0
+        self.hits = 0
+        self.misses = 0
+        self.roster_hits = 0
+        self.roster_misses = 0
+
+    def get(self, student_id):
+        """Trả về bản sao dict sinh viên hoặc None nếu chưa có trong cache"""
+        with self._lock:
+            student = self._entries.get(student_id)
+            if student is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(student_id)
+            self.hits += 1
+            return dict(student)
+
+    def get_many(self, student_ids):
+        """Trả về (dict student_id -> sinh viên đã cache, danh sách id còn thiếu)"""
+        found, missing = {}, []
+        with self._lock:
+            for student_id in student_ids:
+                student = self._entries.get(student_id)
+                if student is None:
+                    missing.append(student_id)
+                    continue
+                self._entries.move_to_end(student_id)
+                found[student_id] = dict(student)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put(self, student):
+        with self._lock:
+            self._entries[student['student_id']] = dict(student)
+            self._entries.move_to_end(student['student_id'])
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def put_many(self, students):
+        for student in students:
+            self.put(student)
+
+    def get_roster(self):
+        """Bản chụp toàn bộ danh sách sinh viên (đã sắp theo tên) hoặc None"""
+        with self._lock:
+            if self._roster is None:
+                self.roster_misses += 1
+                return None
+            self.roster_hits += 1
+            return [dict(student) for student in self._roster]
+
+    def set_roster(self, students):
+        with self._lock:
+            self._roster = [dict(student) for student in students]
+
+    def needs_check(self):
+        """Đã tới lúc đọc lại phiên bản dùng chung chưa"""
+        return time.monotonic() - self._checked_at >= self.check_interval
+
+    def validate(self, version):
+        """Xóa toàn bộ cache nếu phiên bản dữ liệu sinh viên đã đổi (do bất kỳ process nào ghi)"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.resets += 1
+            self.version = version
+            self._entries.clear()
+            self._roster = None
+
+    def invalidate(self, student_ids=()):
+        """Bỏ các sinh viên đã thay đổi và bản chụp danh sách"""
+        with self._lock:
+            for student_id in student_ids:
+                self._entries.pop(student_id, None)
+            self._roster = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._roster = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'roster_cached': self._roster is not None,
+                'roster_hits': self.roster_hits,
+                'roster_misses': self.roster_misses,
+                'version': self.version,
+                'resets': self.resets
+            }
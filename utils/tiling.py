@@ -0,0 +1,71 @@
+import face_recognition
+import numpy as np
+
+
+def make_tiles(height, width, tile_size, overlap):
+    """Chia ảnh thành các ô vuông chồng lấn, trả về danh sách (top, left, bottom, right)
+
+    Ô cuối mỗi hàng/cột được kéo về sát biên để mọi ô có cùng kích thước
+    (trừ khi ảnh nhỏ hơn tile_size).
+    """
+    step = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(top, left, min(height, top + tile_size), min(width, left + tile_size))
+            for top in starts(height) for left in starts(width)]
+
+
+def _detect_tile(tile, offset, model, upsample):
+    """Phát hiện trên một ô, trả về khung theo tọa độ ảnh đầy đủ (chạy được trong process pool)"""
+    top_offset, left_offset = offset
+    return [(top + top_offset, right + left_offset, bottom + top_offset, left + left_offset)
+            for top, right, bottom, left in face_recognition.face_locations(
+                tile, number_of_times_to_upsample=upsample, model=model)]
+
+
+def merge_boxes(boxes, threshold=0.5):
+    """NMS cho khung (top, right, bottom, left) trùng nhau ở đường nối giữa các ô
+
+    HOG không trả về điểm tin cậy nên ưu tiên khung lớn hơn. Độ trùng tính bằng
+    diện tích giao / diện tích khung nhỏ hơn, vì khuôn mặt bị cắt ở mép ô cho
+    khung nhỏ nằm gọn trong khung đầy đủ (IoU thấp nhưng vẫn là một khuôn mặt).
+    """
+    if len(boxes) == 0:
+        return []
+    b = np.asarray(boxes, dtype=np.float64)
+    top, right, bottom, left = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    areas = (bottom - top) * (right - left)
+    order = np.argsort(-areas, kind='stable')
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_h = np.clip(np.minimum(bottom[i], bottom[rest]) - np.maximum(top[i], top[rest]), 0, None)
+        inter_w = np.clip(np.minimum(right[i], right[rest]) - np.maximum(left[i], left[rest]), 0, None)
+        overlap = inter_h * inter_w / np.maximum(np.minimum(areas[i], areas[rest]), 1.0)
+        order = rest[overlap <= threshold]
+    return [tuple(int(v) for v in boxes[i]) for i in sorted(keep)]
+
+
+def detect_tiled(rgb, model='hog', tile_size=1024, overlap=192, upsample=1, executor=None):
+    """Phát hiện khuôn mặt trên từng ô của ảnh lớn, song song trên executor nếu có
+
+    Trả về (khung thô chưa gộp NMS, số ô), khung theo tọa độ rgb.
+    """
+    height, width = rgb.shape[:2]
+    tiles = make_tiles(height, width, tile_size, overlap)
+    jobs = [(np.ascontiguousarray(rgb[top:bottom, left:right]), (top, left), model, upsample)
+            for top, left, bottom, right in tiles]
+    if executor is None or len(jobs) == 1:
+        results = [_detect_tile(*job) for job in jobs]
+    else:
+        results = list(executor.map(_detect_tile, *zip(*jobs)))
+    return [box for boxes in results for box in boxes], len(tiles)
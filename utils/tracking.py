@@ -0,0 +1,80 @@
+import collections
+import itertools
+
+
+def iou(a, b):
+    """IoU giữa hai khung (top, right, bottom, left)"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    def __init__(self, track_id, box, history_size=5):
+        self.id = track_id
+        self.box = box
+        self.label = None
+        self.misses = 0
+        # Cache danh tính: các lần nhận diện gần nhất (student_id hoặc None, distance)
+        self.history = collections.deque(maxlen=history_size)
+        self.recognized_at = None
+        self.recognized_box = None
+        self.marked = False
+
+    def vote(self):
+        """Bỏ phiếu đa số trên history, trả về (student_id hoặc None, số phiếu, độ tin cậy trung bình)"""
+        if not self.history:
+            return None, 0, 0.0
+        counts = collections.Counter(student_id for student_id, _ in self.history)
+        student_id, votes = counts.most_common(1)[0]
+        confidence = sum(1 - d for sid, d in self.history if sid == student_id) / votes
+        return student_id, votes, confidence
+
+
+class IoUTracker:
+    """Tracker rẻ: ghép khung mới với track cũ theo IoU lớn nhất (greedy)"""
+
+    def __init__(self, iou_threshold=0.3, max_misses=3, history_size=5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.history_size = history_size
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes):
+        """Cập nhật với các khung phát hiện được, trả về (track khớp với từng khung, track mới)"""
+        pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(self.tracks)
+                        for b, box in enumerate(boxes)), reverse=True)
+        matched_tracks, assigned = set(), {}
+        for score, t, b in pairs:
+            if score < self.iou_threshold:
+                break
+            if t in matched_tracks or b in assigned:
+                continue
+            matched_tracks.add(t)
+            assigned[b] = self.tracks[t]
+
+        for t, track in enumerate(self.tracks):
+            track.misses = 0 if t in matched_tracks else track.misses + 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        new_tracks = []
+        result = []
+        for b, box in enumerate(boxes):
+            track = assigned.get(b)
+            if track is None:
+                track = Track(next(self._ids), box, self.history_size)
+                self.tracks.append(track)
+                new_tracks.append(track)
+            track.box = box
+            result.append(track)
+        return result, new_tracks
+
+    def visible(self):
+        """Các track vừa được thấy ở lần phát hiện gần nhất"""
+        return [track for track in self.tracks if track.misses == 0]